@@ -0,0 +1,136 @@
+'''
+Entradas de la caché de forge, con serialización y compresión por espacio de
+nombres.
+
+Cada espacio de nombres (por ejemplo, ``cache-page`` para las páginas o
+``form-html`` para el html de los formularios) declara en ``NAMESPACES`` cómo
+se serializan sus valores (``pickle``, ``json`` o ``text``) y con qué nivel de
+zlib se comprimen (0 para no comprimirlos); ``FORGE_CACHE_NAMESPACES`` permite
+cambiarlo. Los valores de menos de ``FORGE_CACHE_COMPRESS_MIN`` bytes no se
+comprimen, y el primer byte de lo que se guarda indica si lo está.
+
+Los valores se guardan directamente en redis, sin el serializador de
+``django_redis``. Con ``FORGE_CACHE_STATS`` activado, cada lectura y escritura
+se contabiliza en el hash ``cache-stats:<espacio>`` en el mismo viaje a redis
+(ver ``get_stats`` y el comando ``forge_cache_stats``); las lecturas pasan a
+hacerse en el servidor de escritura, por lo que está desactivado por defecto.
+'''
+import json
+import pickle
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+NAMESPACES: Dict[str, Dict[str, Any]] = {
+    'cache-page': {'serializer': 'pickle', 'compress': 6},
+    'form-html': {'serializer': 'text', 'compress': 6},
+    'data': {'serializer': 'json', 'compress': 1},
+}
+for _name, _options in getattr(settings, 'FORGE_CACHE_NAMESPACES', {}).items():
+    NAMESPACES[_name] = dict(NAMESPACES.get(_name, {}), **_options)
+
+COMPRESS_MIN = getattr(settings, 'FORGE_CACHE_COMPRESS_MIN', 512)
+STATS_ENABLED = getattr(settings, 'FORGE_CACHE_STATS', False)
+STATS = ('hits', 'misses', 'read', 'writes', 'written', 'raw')
+
+RAW = b'-'
+COMPRESSED = b'z'
+
+SERIALIZERS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    'pickle': (lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL), pickle.loads),
+    'json': (lambda value: json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':')).encode(),
+             lambda value: json.loads(value.decode())),
+    'text': (lambda value: str(value).encode(), lambda value: value.decode()),
+}
+
+# Lee el valor y contabiliza el acierto o el fallo
+GET = '''
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('HINCRBY', KEYS[2], 'hits', 1)
+    redis.call('HINCRBY', KEYS[2], 'read', #value)
+else
+    redis.call('HINCRBY', KEYS[2], 'misses', 1)
+end
+return value
+'''
+
+
+def stats_key(namespace: str) -> str:
+    return f'cache-stats:{namespace}'
+
+
+def _compress(namespace: str, data: bytes) -> bytes:
+    level = NAMESPACES[namespace]['compress']
+    if level and len(data) >= COMPRESS_MIN:
+        return COMPRESSED + zlib.compress(data, level)
+    return RAW + data
+
+
+def dumps(namespace: str, value: Any) -> bytes:
+    return _compress(namespace, SERIALIZERS[NAMESPACES[namespace]['serializer']][0](value))
+
+
+def loads(namespace: str, payload: bytes) -> Any:
+    data = payload[1:]
+    if payload[:1] == COMPRESSED:
+        data = zlib.decompress(data)
+    return SERIALIZERS[NAMESPACES[namespace]['serializer']][1](data)
+
+
+def get(namespace: str, key: str, default: Any = None) -> Any:
+    if STATS_ENABLED:
+        client = cache.client.get_client(write=True)
+        payload = client.register_script(GET)(keys=[cache.client.make_key(key),
+                                                    cache.client.make_key(stats_key(namespace))])
+    else:
+        payload = cache.client.get_client().get(cache.client.make_key(key))
+    return default if payload is None else loads(namespace, payload)
+
+
+def set(namespace: str, key: str, value: Any, timeout: Optional[int] = -1) -> None:  # pylint: disable=redefined-builtin
+    '''
+    Guarda ``value`` en ``key`` durante ``timeout`` segundos (por defecto, los
+    de la caché; ``None`` para que no expire)
+    '''
+    if timeout == -1:
+        timeout = cache.default_timeout
+    if timeout is not None and timeout <= 0:
+        cache.delete(key)
+        return
+    raw = SERIALIZERS[NAMESPACES[namespace]['serializer']][0](value)
+    payload = _compress(namespace, raw)
+    pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+    pipeline.set(cache.client.make_key(key), payload, ex=None if timeout is None else int(timeout))
+    if STATS_ENABLED:
+        stats = cache.client.make_key(stats_key(namespace))
+        pipeline.hincrby(stats, 'writes', 1)
+        pipeline.hincrby(stats, 'written', len(payload))
+        pipeline.hincrby(stats, 'raw', len(raw))
+    pipeline.execute()
+
+
+def delete(*keys: str) -> None:
+    if keys:
+        cache.delete_many(keys)
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    '''
+    Contadores de cada espacio de nombres: aciertos, fallos, bytes leídos,
+    escrituras, bytes escritos y los que habría ocupado sin comprimir
+    '''
+    client = cache.client.get_client()
+    pipeline = client.pipeline(transaction=False)
+    for namespace in NAMESPACES:
+        pipeline.hgetall(cache.client.make_key(stats_key(namespace)))
+    return {namespace: {stat: int(values.get(stat.encode(), 0)) for stat in STATS}
+            for namespace, values in zip(NAMESPACES, pipeline.execute())}
+
+
+def reset_stats() -> None:
+    cache.client.get_client(write=True).delete(
+        *[cache.client.make_key(stats_key(namespace)) for namespace in NAMESPACES])
@@ -0,0 +1,100 @@
+'''
+Conversión entre los valores de un formulario (``cleaned_data``) y el json que
+se almacena en ``forge.models.Data.data``.
+'''
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date, parse_datetime, parse_duration, parse_time
+
+from .utils import LRUCache
+
+# Mismo formato que usa ``DjangoJSONEncoder``, para que los datos ya
+# almacenados se sigan pudiendo leer
+_encode_default = DjangoJSONEncoder().default
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _encode_file(value: Any) -> Any:
+    return getattr(value, 'name', value) or None
+
+
+def _parser(parse: Callable) -> Callable:
+    def decode(value: Any) -> Any:
+        if not isinstance(value, str):
+            return value
+        try:
+            return parse(value) or value
+        except ValueError:
+            return value
+    return decode
+
+
+def _decode_decimal(value: Any) -> Any:
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return value
+
+
+# Tipo de campo -> (codificar, decodificar). Los tipos que no aparecen
+# (texto, números enteros, listas, booleanos y los de los módulos) se
+# almacenan tal cual.
+FIELD_CODECS = {
+    'date': (_encode_default, _parser(parse_date)),
+    'datetime': (_encode_default, _parser(parse_datetime)),
+    'time': (_encode_default, _parser(parse_time)),
+    'duration': (_encode_default, _parser(parse_duration)),
+    'decimal': (_encode_default, _decode_decimal),
+    'file': (_encode_file, _identity),
+    'image': (_encode_file, _identity),
+}
+
+
+class StructureCodec:
+    '''
+    Codec compilado a partir de los campos de una estructura. ``encode``
+    convierte ``cleaned_data`` en valores json y ``decode`` hace lo contrario,
+    sin necesidad de validar un formulario.
+    '''
+
+    def __init__(self, fields: list) -> None:
+        self.encoders: Dict[str, Callable] = {}
+        self.decoders: Dict[str, Callable] = {}
+        for field in fields:
+            encoder, decoder = FIELD_CODECS.get(field['type'], (_identity, _identity))
+            if encoder is not _identity:
+                self.encoders[field['name']] = encoder
+            if decoder is not _identity:
+                self.decoders[field['name']] = decoder
+
+    def encode(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        encoders = self.encoders
+        return {name: encoders[name](value) if name in encoders and value is not None else value
+                for name, value in values.items()}
+
+    def decode(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        decoders = self.decoders
+        return {name: decoders[name](value) if name in decoders and value is not None else value
+                for name, value in data.items()}
+
+
+codecs = LRUCache(getattr(settings, 'FORGE_CODEC_CACHE_SIZE', 128))
+
+
+def get_codec(structure: Any) -> StructureCodec:
+    '''
+    Devuelve el codec de ``structure``. Se compila una sola vez por versión de
+    la estructura (su ``last_modified``) y proceso.
+    '''
+    key = (structure.id, getattr(structure, 'last_modified', None))
+    codec = codecs.get(key)
+    if codec is None:
+        codec = StructureCodec(structure.structure['fields'])
+        codecs.set(key, codec)
+    return codec
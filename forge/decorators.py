@@ -1,38 +1,150 @@
-from typing import Any, Callable
+import hashlib
+import time
+import uuid
+from calendar import timegm
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from functools import wraps
 
+from django.conf import settings
+from django.contrib.messages import get_messages
 from django.core.cache import cache
 from django.http import HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.utils.text import slugify
 
+from . import caching
+from .utils import get_generation
 
-def cache_page(expiration: int) -> Callable:
+# Headers of the original response that are stored along with cached pages
+CACHED_HEADERS = ('Content-Type', 'Content-Language', 'Last-Modified', 'ETag')
+# Seconds a page can take to render before another request may render it too
+LOCK_TIMEOUT = getattr(settings, 'FORGE_CACHE_LOCK_TIMEOUT', 30)
+# Seconds requests wait for a page that is being rendered, and polling interval
+LOCK_WAIT = getattr(settings, 'FORGE_CACHE_LOCK_WAIT', 3)
+LOCK_POLL = 0.05
+
+# Deletes the lock only if it still holds the token of the request that took it
+RELEASE = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def conditional(state: Callable[..., Optional[Tuple]]) -> Callable:
+    """Answers GET and HEAD requests with 304 Not Modified, without calling the
+    view, when the page hasn't changed since the client got it.
+
+    ``state`` receives the view arguments and returns a tuple of values that
+    change whenever the page does, usually with a single ``values_list`` query,
+    or ``None`` if the object doesn't exist. The ETag is derived from those
+    values and the user (pages show who is logged in) and Last-Modified from
+    the latest datetime among them. Responses must be revalidated every time,
+    since they are user-based.
+
+    Requests with pending messages are always rendered, so the messages are shown."""
+
+    def decorator(view: Callable) -> Callable:
+
+        @wraps(view)
+        def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponseBase:
+            if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+            values = state(*args, **kwargs)
+            if values is None:
+                return view(request, *args, **kwargs)
+            etag = quote_etag(hashlib.md5(repr((request.user.pk,) + tuple(values)).encode()).hexdigest())
+            dates = [value for value in values if isinstance(value, datetime)]
+            last_modified = timegm(max(dates).utctimetuple()) if dates else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _cached_response(content: bytes, headers: Dict[str, str]) -> HttpResponse:
+    response = HttpResponse(content)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def cache_page(expiration: int, depends_on: str = 'pk', stale: Optional[int] = None) -> Callable:
     """This decorator works in replacement to Django's decorator with same name, but
     it doesn't use Django's middleware system to make cache key, so, it uses its own
     logic to do it and make possible invalidate cache.
 
+    The cached page records the cache generation of the object whose id is the
+    view argument ``depends_on``, so the page is invalidated when that object
+    changes.
+
+    Pages are fresh for ``expiration`` seconds and are kept ``stale`` more
+    seconds (``FORGE_CACHE_STALE`` by default). Only one request at a time
+    renders a page, holding a short lock in the cache: while it does, the other
+    requests get the stale copy if there is one of the current generation, or
+    wait up to ``FORGE_CACHE_LOCK_WAIT`` seconds for the new one before
+    rendering it themselves. Invalidated pages are never served.
+
     This decorator shouldn't be used to views with user-based data."""
+    if stale is None:
+        stale = getattr(settings, 'FORGE_CACHE_STALE', 5 * 60)
 
     def decorator(view: Callable) -> Callable:
 
         @wraps(view)
         def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            if request.method == 'POST':
+                return view(request, *args, **kwargs)
+            generation = get_generation(kwargs[depends_on]) if depends_on in kwargs else 0
             key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
-            cached = cache.get(key)
-            if not cached:
+            cached = caching.get('cache-page', key)
+            if cached and cached[0] == generation and cached[1] > time.time():
+                return _cached_response(*cached[2:])
+
+            lock = f'{key}:lock'
+            token = uuid.uuid4().hex
+            # The token is stored raw so the release script can compare it
+            client = cache.client.get_client(write=True)
+            if not client.set(cache.client.make_key(lock), token, nx=True, ex=LOCK_TIMEOUT):
+                if cached and cached[0] == generation:
+                    return _cached_response(*cached[2:])
+                deadline = time.time() + LOCK_WAIT
+                while time.time() < deadline and cache.has_key(lock):
+                    time.sleep(LOCK_POLL)
+                    cached = caching.get('cache-page', key)
+                    if cached and cached[0] == generation:
+                        return _cached_response(*cached[2:])
+
+            try:
                 response = view(request, *args, **kwargs)
-                to_cache = response.content
                 # Only stores in cache if is a regular HttpResponse returning text/html
-                # and the response code is 200
+                # and the response code is 200. Streaming responses are never cached
                 if (isinstance(response, HttpResponse)
-                        and getattr(response, 'mimetype', 'text/html') == 'text/html'
-                        and response.status_code == 200
-                        and request.method != 'POST'):
-                    cache.set(key, to_cache, timeout=expiration)
-                else:
-                    return response
-            return HttpResponse(cached or to_cache)
+                        and response.get('Content-Type', 'text/html').startswith('text/html')
+                        and response.status_code == 200):
+                    headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+                    caching.set('cache-page', key, (generation, time.time() + expiration, response.content, headers),
+                                timeout=expiration + stale)
+            finally:
+                # If rendering took longer than the lock, another request may hold it now
+                client.register_script(RELEASE)(keys=[cache.client.make_key(lock)], args=[token])
+            return response
 
         return wrapper
 
@@ -0,0 +1,119 @@
+'''
+Exportación de los datos de una estructura a CSV o JSONL.
+
+Las filas se leen con un cursor del lado del servidor y se generan a medida
+que se leen, de modo que la memoria que se usa no depende de la cantidad de
+datos. El formato es el mismo que lee el comando ``forge_import``: una columna
+por campo, en el orden de la definición actual de la estructura, más el
+identificador de los datos (``_id``) y el de los datos que enmiendan
+(``_parent``). Los valores de los campos que ya no están en la estructura no
+se exportan.
+'''
+import csv
+import json
+from typing import Any, Dict, Iterator, List
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Data
+from .patches import iter_documents
+
+# Columnas que no son campos de la estructura
+ID_COLUMN = '_id'
+PARENT_COLUMN = '_parent'
+# Separador de los valores de los campos de selección múltiple en los CSV
+MULTIPLE_SEPARATOR = '|'
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def export_columns(structure: Any) -> List[str]:
+    return [ID_COLUMN, PARENT_COLUMN] + [field['name'] for field in structure.definition.structure['fields']]
+
+
+def iter_records(structure: Any, chunk_size: int = 2000, current: bool = False) -> Iterator[Dict[str, Any]]:
+    '''
+    Genera los datos de ``structure`` como diccionarios ``columna -> valor``
+    con las columnas de ``export_columns``. Con ``current`` solo se generan las
+    versiones actuales, sin el identificador de los datos que enmiendan.
+    '''
+    fields = export_columns(structure)[2:]
+    queryset = Data.objects.for_structure(structure)
+    if current:
+        queryset = queryset.current()
+    rows = queryset.order_by('tree_id', 'lft').values_list(
+        'id', 'parent_id', 'tree_id', 'data', 'patch').iterator(chunk_size=chunk_size)
+    # Las enmiendas almacenadas como diferencias se reconstruyen a partir de
+    # sus padres, que se leen antes
+    for (data_id, parent_id, *_), data in iter_documents(rows):
+        record = {ID_COLUMN: str(data_id), PARENT_COLUMN: str(parent_id) if parent_id and not current else None}
+        for name in fields:
+            record[name] = data.get(name)
+        yield record
+
+
+class _Echo:  # pylint: disable=too-few-public-methods
+    '''
+    Pseudo fichero que devuelve lo que se escribe en él, para generar el CSV
+    línea a línea
+    '''
+
+    def write(self, value: str) -> str:  # pylint: disable=no-self-use
+        return value
+
+
+def _buffered(lines: Iterator[str], size: int) -> Iterator[str]:
+    # Enviar cada línea por separado es muy lento: se agrupan en bloques de
+    # aproximadamente ``size`` caracteres
+    buffer: List[str] = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return MULTIPLE_SEPARATOR.join(str(item) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+def _csv_lines(structure: Any, chunk_size: int, current: bool) -> Iterator[str]:
+    columns = export_columns(structure)
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for record in iter_records(structure, chunk_size, current):
+        yield writer.writerow([_csv_value(record[column]) for column in columns])
+
+
+def _jsonl_lines(structure: Any, chunk_size: int, current: bool) -> Iterator[str]:
+    for record in iter_records(structure, chunk_size, current):
+        # Igual que en los JSONL que se importan, las llaves sin valor se omiten
+        yield json.dumps({column: value for column, value in record.items() if value is not None},
+                         cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+EXPORTERS = {
+    'csv': _csv_lines,
+    'jsonl': _jsonl_lines,
+}
+
+
+def export(structure: Any, export_format: str, chunk_size: int = 2000, buffer_size: int = 64 * 1024,
+           current: bool = False) -> Iterator[str]:
+    '''
+    Genera el contenido de la exportación de ``structure`` en ``export_format``
+    (``csv`` o ``jsonl``) por bloques de ``buffer_size`` caracteres. Con
+    ``current`` solo se exportan las versiones actuales de los datos.
+    '''
+    return _buffered(EXPORTERS[export_format](structure, chunk_size, current), buffer_size)
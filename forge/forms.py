@@ -2,94 +2,127 @@
 '''
 
 from collections import OrderedDict
-from typing import Any, Dict
+from copy import deepcopy
+from typing import Any, Dict, Iterator, Type
 
-from django.core.cache import cache
+from django.conf import settings
 from django import forms
+from django.utils.html import conditional_escape
+from django.utils.safestring import SafeText, mark_safe
 
+from . import caching
 from .registries import modules
+from .utils import LRUCache
 
 
 class DynamicForm(forms.Form):
     '''
     Formulario cuyos campos se generan de forma dinámica de acuerdo a una
-    estructura en formato json que se obtiene de la base de datos. Para obtener
-    esta estructura, esta clase recibe un kwarg ``structure`` que es una
-    instancia de ``forge.models.Structure``
+    estructura en formato json que se obtiene de la base de datos.
+
+    Las clases generadas por ``get_form_class`` heredan de esta y ya tienen sus
+    campos declarados. Por compatibilidad, también puede instanciarse
+    directamente pasándole un kwarg ``structure`` que es una instancia de
+    ``forge.models.Structure``
     '''
+    structure_id = None
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         # Extraer el parámetro `structure de los argumentos` antes de ejecutar
         # el método `init` de la clase padre
-        structure = kwargs.pop('structure')
+        structure = kwargs.pop('structure', None)
 
         super().__init__(*args, **kwargs)
 
-        fields = structure.structure['fields']
-        self.structure_id = structure.id
-
-        # Primero consultar la cache
-        self.fields = cache.get(f'fields_{self.structure_id}')
-
-        if not self.fields:
-            self.fields = OrderedDict(
-                (field['name'], generate_field(dict(field))) for field in fields)
-            cache.set(f'fields_{self.structure_id}', self.fields)
-
-
-def generate_field(field: Dict[str, str]) -> forms.Field:  # pylint: disable=too-many-branches,too-many-return-statements
-
-    field_classes = {
-        'text': forms.CharField,
-        'textarea': forms.CharField,
-        'email': forms.EmailField,
-        'radio': forms.ChoiceField,
-        'select': forms.ChoiceField,
-        'multiselect': forms.MultipleChoiceField,
-        'date': forms.DateField,
-        'datetime': forms.DateTimeField,
-        'duration': forms.DurationField,
-        'time': forms.TimeField,
-        'integer': forms.IntegerField,
-        'decimal': forms.DecimalField,
-        'file': forms.FileField,
-        'filepath': forms.FilePathField,
-        'image': forms.ImageField,
-        'checkbox': forms.BooleanField
-    }
-
-    custom_widgets = {
-        'textarea': forms.Textarea(),
-        'radio': forms.RadioSelect(),
-        'date': forms.SelectDateWidget(attrs={'type': 'date'}),
-        'datetime': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
-        'time': forms.TimeInput(attrs={'type': 'time'}),
-        'checkbox': forms.CheckboxInput(),
-    }
-
-    try:
-        field_type = field['type']
-    except KeyError:
-        raise ValueError('Wrong or not implemented field type')
-
-    field_class = None
-    registred_widget = None
-
-    for module in modules.values():
-        try:
-            field_class = module.fields[field_type]['field_type']
-        except KeyError:
-            continue
-        else:
-            registred_widget = module.fields[field_type]['widget']
-
-    if not field_class:
-        try:
-            field_class = field_classes[field_type]
-        except KeyError:
-            raise ValueError('Wrong or not implemented field type')
+        if structure is not None:
+            self.structure_id = structure.id
+            self.fields = deepcopy(get_form_class(structure).base_fields)
+
+
+form_classes = LRUCache(getattr(settings, 'FORGE_FORM_CLASS_CACHE_SIZE', 128))
+
+
+def get_form_class(structure: Any) -> Type[DynamicForm]:
+    '''
+    Devuelve una subclase de ``DynamicForm`` con los campos de ``structure``
+    declarados. La clase se genera una sola vez por versión de la estructura
+    (su ``last_modified``) y proceso. Los campos no se guardan en redis:
+    generarlos a partir de la estructura es más rápido que deserializarlos.
+    '''
+    version = getattr(structure, 'last_modified', None)
+    key = (structure.id, version)
+
+    form_class = form_classes.get(key)
+    if form_class is None:
+        form_class = build_form_class(structure)
+        form_classes.set(key, form_class)
+    return form_class
+
+
+def generate_fields(structure: Any) -> Dict[str, forms.Field]:
+    return OrderedDict((field['name'], generate_field(dict(field))) for field in structure.structure['fields'])
+
+
+def build_form_class(structure: Any, fields: Dict[str, forms.Field] = None) -> Type[DynamicForm]:
+    '''
+    Genera la subclase de ``DynamicForm`` de ``structure`` sin consultar ninguna
+    caché. Se usa directamente donde no se debe acceder a redis, por ejemplo en
+    procesos hijos.
+    '''
+    attrs: Dict[str, Any] = OrderedDict(fields if fields is not None else generate_fields(structure))
+    attrs['structure_id'] = structure.id
+    return type(f'DynamicForm_{structure.id}', (DynamicForm,), attrs)
+
+
+def render_unbound_form(structure: Any) -> SafeText:
+    '''
+    Devuelve el html del formulario vacío de ``structure``. Es igual para todos
+    los usuarios, por lo que se genera una sola vez por versión de la estructura
+    y se guarda en la caché. El token CSRF y los mensajes quedan fuera, en la
+    plantilla que lo incluye.
+    '''
+    version = getattr(structure, 'last_modified', None)
+    key = f'form-html:{structure.id}:{version}'
+
+    html = caching.get('form-html', key)
+    if html is None:
+        html = str(get_form_class(structure)().as_p())
+        caching.set('form-html', key, html, timeout=getattr(settings, 'FORGE_FORM_HTML_TIMEOUT', 60 * 60 * 24))
+    return mark_safe(html)
+
+
+def iter_form_html(form: forms.Form, chunk_size: int = 100) -> Iterator[str]:
+    '''
+    Genera el mismo html que ``form.as_p()`` pero por partes de ``chunk_size``
+    campos, para poder enviar formularios muy grandes sin construirlos
+    completos en memoria.
+    '''
+    top_errors = form.non_field_errors()
+    rows = [str(top_errors)] if top_errors else []
+    separator = ''
+    for name in form.fields:
+        bound_field = form[name]
+        errors = form.error_class([conditional_escape(error) for error in bound_field.errors])
+        if errors:
+            rows.append(str(errors))
+        label = bound_field.label_tag(conditional_escape(bound_field.label)) if bound_field.label else ''
+        help_text = f' <span class="helptext">{bound_field.help_text}</span>' if bound_field.help_text else ''
+        css_classes = bound_field.css_classes()
+        html_class_attr = f' class="{css_classes}"' if css_classes else ''
+        rows.append(f'<p{html_class_attr}>{label} {bound_field}{help_text}</p>')
+
+        if len(rows) >= chunk_size:
+            yield separator + '\n'.join(rows)
+            rows, separator = [], '\n'
+    if rows:
+        yield separator + '\n'.join(rows)
+
+
+def generate_field(field: Dict[str, Any]) -> forms.Field:
+
+    # ``resolve`` lanza ``ValueError`` si el tipo falta o no está registrado
+    field_class, field_widget = modules.resolve(field.get('type'))
 
     field_options = field.get('options', {})
-    field_widget = registred_widget or custom_widgets.get(field_type, None)
 
     return field_class(widget=field_widget, **field_options)
@@ -1,12 +1,15 @@
-from typing import Any
+import threading
+from functools import partial
+from typing import Any, Dict, Set
 
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_out
-from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.http import HttpRequest
 
-from . import jobs
+from . import jobs, partitions, projections
 from .models import BaseModel, Data, Structure
 
 
@@ -19,21 +22,129 @@ def post_logout_cleaning(sender: Any, request: HttpRequest, user: User, **kwargs
         jobs.release_all_locks_of_user.delay(str(user.id))
 
 
+_batch = threading.local()
+
+
+def invalidate_cache(instance: BaseModel) -> None:
+    '''
+    Invalida lo que se guardó en la caché a partir de ``instance`` aumentando
+    su generación (las entradas anteriores no se eliminan: expiran solas). Los
+    objetos que cambian en una transacción se reúnen y, una vez que se
+    confirma, se envía un solo trabajo con todos ellos.
+
+    Cada objeto registra su propio envío del lote, de modo que revertir un
+    savepoint no descarta el de los objetos que siguen en la transacción: el
+    primero que se ejecuta envía el lote y lo vacía, y el resto no hace nada.
+    Fuera de una transacción el envío se ejecuta en el acto. Los objetos de
+    una transacción revertida pueden enviarse con el lote siguiente, lo que
+    solo cuesta volver a generar lo que tenían en la caché.
+    '''
+    add_to_batch('pks', instance.pk)
+
+
+def add_to_batch(kind: str, pk: Any) -> None:
+    batch = getattr(_batch, 'current', None)
+    if batch is None or not transaction.get_connection().in_atomic_block:
+        batch = _batch.current = {'pks': set(), 'structure_ids': set()}
+    batch[kind].add(str(pk))
+    transaction.on_commit(partial(send_batch, batch))
+
+
+def send_batch(batch: Dict[str, Set[str]]) -> None:
+    if getattr(_batch, 'current', None) is batch:
+        del _batch.current
+        jobs.invalidate_cache.delay(sorted(batch['pks']), sorted(batch['structure_ids']))
+
+
 def post_save_cleaning(sender: Any, instance: BaseModel, created: bool, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
     if not created:
-        jobs.vanish_pattern_from_cache.delay(f'*{instance.pk}*')
+        invalidate_cache(instance)
 
 
-post_save.connect(post_save_cleaning, sender=Data)
+# Solo se guardan en la caché páginas que dependen de las estructuras (ver
+# ``forge.decorators.cache_page``), por lo que los datos no tienen generación
 post_save.connect(post_save_cleaning, sender=Structure)
 
 
 def post_delete_cleaning(sender: Any, instance: BaseModel, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
-    jobs.vanish_pattern_from_cache.delay(f'*{instance.pk}*')
-    if sender == Structure:
-        for data in Data.objects.filter(structure_id=instance.pk):
-            jobs.vanish_pattern_from_cache.delay(f'*{data.pk}*')
+    invalidate_cache(instance)
 
 
-post_delete.connect(post_delete_cleaning, sender=Data)
 post_delete.connect(post_delete_cleaning, sender=Structure)
+
+
+def structure_partition_create(sender: Any, instance: Structure, created: bool, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    '''
+    Crea la partición de los datos de una estructura nueva en la misma
+    transacción, antes de que pueda tener datos
+    '''
+    if created:
+        partitions.create_partition(instance.pk)
+
+
+def structure_partition_detach(sender: Any, instance: Structure, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    '''
+    Deja sin estructura los datos de una estructura que se elimina y elimina
+    su partición (ver ``forge.partitions.detach_structure``)
+    '''
+    partitions.detach_structure(instance.pk)
+
+
+post_save.connect(structure_partition_create, sender=Structure)
+pre_delete.connect(structure_partition_detach, sender=Structure)
+
+
+def structure_indexes_sync(sender: Any, instance: Structure, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    '''
+    Crea o elimina en segundo plano los índices de los campos de la estructura
+    una vez que se confirmen los cambios
+    '''
+    structure_id = str(instance.pk)
+    transaction.on_commit(lambda: jobs.sync_field_indexes.delay(structure_id))
+
+
+post_save.connect(structure_indexes_sync, sender=Structure)
+post_delete.connect(structure_indexes_sync, sender=Structure)
+
+
+def structure_projection_sync(sender: Any, instance: Structure, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    '''
+    Construye o elimina en segundo plano la proyección de la estructura una vez
+    que se confirmen los cambios
+    '''
+    structure_id = str(instance.pk)
+    transaction.on_commit(lambda: jobs.sync_projection.delay(structure_id))
+
+
+post_save.connect(structure_projection_sync, sender=Structure)
+post_delete.connect(structure_projection_sync, sender=Structure)
+
+
+def data_projection_refresh(sender: Any, instance: Data, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    '''
+    Mantiene la fila de los datos en la proyección de su estructura dentro de
+    la misma transacción en que se salvan
+    '''
+    projections.refresh_row(instance)
+
+
+def data_projection_delete(sender: Any, instance: Data, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    projections.delete_row(instance)
+
+
+post_save.connect(data_projection_refresh, sender=Data)
+post_delete.connect(data_projection_delete, sender=Data)
+
+
+def data_version_bump(sender: Any, instance: Data, *args: Any, **kwargs: Any) -> None:  # pylint: disable=unused-argument
+    '''
+    Cambia la versión de los datos de la estructura (ver
+    ``forge.utils.get_data_version``) en el mismo lote que las invalidaciones
+    de la transacción, para que sus detalles dejen de responderse con 304
+    '''
+    if instance.structure_id:
+        add_to_batch('structure_ids', instance.structure_id)
+
+
+post_save.connect(data_version_bump, sender=Data)
+post_delete.connect(data_version_bump, sender=Data)
@@ -0,0 +1,125 @@
+'''
+Índices de expresión por campo sobre ``forge_data.data``.
+
+Los campos de una estructura marcados con ``"indexed": true`` tienen un índice
+``(forge_to_tipo(data->>'campo'))`` en la partición de la estructura (ver
+``forge.partitions``), o parcial ``WHERE structure_id = X`` sobre
+``forge_data`` si no está particionada, que permite filtrar por rangos y
+ordenar por ese campo. Los tipos distintos de texto se convierten con
+funciones que devuelven NULL si el valor no es del tipo (ver la migración
+``0011_field_casts``), para que un valor de una versión anterior de la
+estructura no impida salvar los datos ni crear el índice. Para que Postgres
+use el índice, la consulta debe usar la misma expresión, que se obtiene con
+``field_value``::
+
+    Data.objects.for_structure(structure).annotate(
+        number=field_value('document_number', 'integer')).filter(number__gte=100).order_by('number')
+'''
+import hashlib
+from typing import Any, Dict
+
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.db import connection, models
+from psycopg2 import sql
+
+from .partitions import TABLE, get_partition
+
+INDEX_PREFIX = 'forge_fidx_'
+
+# Tipo de campo -> (función de conversión, campo de django). Los tipos que no
+# aparecen se indexan como texto; las fechas y horas se almacenan en formato
+# ISO 8601, por lo que su orden como texto es el cronológico.
+FIELD_CASTS = {
+    'integer': ('forge_to_numeric', models.DecimalField()),
+    'decimal': ('forge_to_numeric', models.DecimalField()),
+    'checkbox': ('forge_to_boolean', models.BooleanField()),
+}
+
+
+class FieldValue(models.Func):  # pylint: disable=abstract-method
+    '''
+    Expresión ``forge_to_tipo(data->>'campo')``, la misma con la que se crean
+    los índices
+    '''
+
+    def __init__(self, name: str, function: str, output_field: models.Field) -> None:
+        super().__init__(KeyTextTransform(name, 'data'), function=function, output_field=output_field)
+
+
+def field_value(name: str, field_type: str) -> models.Expression:
+    try:
+        function, output_field = FIELD_CASTS[field_type]
+    except KeyError:
+        return KeyTextTransform(name, 'data')
+    return FieldValue(name, function, output_field)
+
+
+def index_name(structure_id: Any, field_name: str, field_type: str) -> str:
+    # Los nombres de los campos pueden tener cualquier caracter y los
+    # identificadores de Postgres no pueden pasar de 63. El nombre depende
+    # también de la conversión, para que al cambiar el tipo del campo se cree
+    # un índice nuevo en lugar de conservar el anterior
+    function = FIELD_CASTS.get(field_type, ('text',))[0]
+    digest = hashlib.md5(f'{field_name}:{function}'.encode()).hexdigest()[:8]
+    return f'{INDEX_PREFIX}{structure_id.hex}_{digest}'
+
+
+def declared_indexes(structure: Any) -> Dict[str, str]:
+    '''
+    Devuelve los índices que declara ``structure``: nombre -> sentencia sql
+    para crearlo
+    '''
+    indexes = {}
+    # En la partición de la estructura todas las filas son suyas
+    partition = get_partition(structure.pk)
+    target, condition = (sql.Identifier(partition), sql.SQL('')) if partition else (
+        sql.Identifier(TABLE), sql.SQL(' WHERE structure_id = {}').format(sql.Literal(str(structure.pk))))
+    for field in structure.structure['fields']:
+        if not field.get('indexed'):
+            continue
+        name = index_name(structure.pk, field['name'], field['type'])
+        expression = sql.SQL('data ->> {}').format(sql.Literal(field['name']))
+        if field['type'] in FIELD_CASTS:
+            expression = sql.SQL('{}({})').format(sql.Identifier(FIELD_CASTS[field['type']][0]), expression)
+        statement = sql.SQL('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} (({})){}').format(
+            sql.Identifier(name), target, expression, condition)
+        indexes[name] = statement.as_string(connection.connection)
+    return indexes
+
+
+def _indexes(structure_id: Any) -> Dict[str, bool]:
+    '''
+    Índices de la estructura: nombre -> si es válido. Un ``CREATE INDEX
+    CONCURRENTLY`` que falla deja el índice creado pero inválido.
+    '''
+    with connection.cursor() as cursor:
+        # Pueden estar en ``forge_data`` o en la partición de la estructura
+        cursor.execute('SELECT c.relname, i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid '
+                       'WHERE c.relname LIKE %s',
+                       [f'{INDEX_PREFIX}{structure_id.hex}_'.replace('_', '\\_') + '%'])
+        return dict(cursor.fetchall())
+
+
+def existing_indexes(structure_id: Any) -> set:
+    return {name for name, valid in _indexes(structure_id).items() if valid}
+
+
+def sync_indexes(structure_id: Any, structure: Any = None) -> None:
+    '''
+    Crea los índices que declara la estructura y elimina los que ya no declara.
+    Si ``structure`` es ``None`` (porque se eliminó) se eliminan todos sus
+    índices. Los índices inválidos se crean de nuevo. Los índices se crean y
+    eliminan de forma concurrente, por lo que no debe llamarse dentro de una
+    transacción.
+    '''
+    declared = declared_indexes(structure) if structure is not None else {}
+    indexes = _indexes(structure_id)
+    existing = {name for name, valid in indexes.items() if valid}
+
+    with connection.cursor() as cursor:
+        # Los inválidos se eliminan para volver a crearlos
+        for name in set(indexes) - (existing & set(declared)):
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {connection.ops.quote_name(name)}')
+        for name, sql in declared.items():
+            if name not in existing:
+                cursor.execute(sql)
@@ -1,15 +1,39 @@
 # Create your tasks here
+from typing import List
+from uuid import UUID
 
 from django_rq import job
-from django.core.cache import cache
+
+from . import projections
+from .indexes import sync_indexes
+from .locks import release_all_locks
+from .models import Structure
+from .utils import bump_data_versions, bump_generations
 
 
 @job
-def vanish_pattern_from_cache(pattern: str) -> None:
-    cache.delete_pattern(pattern)
+def invalidate_cache(pks: List[str], structure_ids: List[str] = None) -> None:
+    '''
+    Aumenta la generación de los objetos ``pks`` y cambia la versión de los
+    datos de las estructuras ``structure_ids``
+    '''
+    if pks:
+        bump_generations(pks)
+    if structure_ids:
+        bump_data_versions(structure_ids)
+
 
 @job
 def release_all_locks_of_user(user_id: str) -> None:
-    for key in cache.iter_keys('lock:*'):
-        if str(cache.get(key)) == user_id:
-            cache.delete_pattern(key)
+    release_all_locks(user_id)
+
+
+@job
+def sync_field_indexes(structure_id: str) -> None:
+    structure = Structure.objects.filter(pk=structure_id).first()
+    sync_indexes(UUID(structure_id), structure)
+
+
+@job
+def sync_projection(structure_id: str) -> None:
+    projections.sync(UUID(structure_id))
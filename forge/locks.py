@@ -0,0 +1,147 @@
+'''
+Bloqueos de edición de los recursos (por ejemplo, los datos que un usuario
+está editando) en redis.
+
+Los bloqueos son arrendamientos cortos (``FORGE_LOCK_LEASE`` segundos) que la
+página de edición renueva periódicamente (``renew_lock``), de modo que una
+edición larga no pierde su bloqueo y uno abandonado expira pronto. Cada vez
+que se adquiere un bloqueo se le asigna un token creciente; quien escribe
+comprueba antes (``check_lock``) que su token sigue siendo el vigente, para
+no escribir con un bloqueo que expiró y tomó otro usuario. Como el bloqueo
+puede expirar entre la comprobación y la escritura, los datos registran además
+el token con el que se escribieron (``DataManager.fence``) y rechazan los
+tokens anteriores dentro de la misma transacción.
+
+El valor de la llave ``lock:<recurso>`` es ``<usuario>:<token>``. Las
+operaciones que comparan y modifican ese valor son scripts Lua, por lo que
+son atómicas. Los bloqueos de cada usuario se registran además en el conjunto
+``locks:<usuario>``, para poder liberarlos todos sin recorrer las llaves de
+redis.
+'''
+from typing import Any, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Model
+
+LEASE = getattr(settings, 'FORGE_LOCK_LEASE', 2 * 60)
+# Para las páginas que no renuevan el bloqueo (por ejemplo, la confirmación
+# para eliminar los datos)
+UNRENEWED_LEASE = getattr(settings, 'FORGE_LOCK_TIMEOUT', 15 * 60)
+TOKENS_KEY = 'lock-tokens'
+
+# Si el recurso está libre o ya es del usuario, lo bloquea con un token nuevo.
+# El conjunto de bloqueos del usuario vive tanto como el más largo de ellos
+ACQUIRE = '''
+local current = redis.call('GET', KEYS[1])
+if current and string.match(current, '^(.*):%d+$') ~= ARGV[1] then
+    return false
+end
+local token = redis.call('INCR', KEYS[3])
+redis.call('SET', KEYS[1], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+redis.call('SADD', KEYS[2], KEYS[1])
+if redis.call('PTTL', KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return token
+'''
+
+# Devuelve 1 si se liberó, 0 si no estaba bloqueado y -1 si es de otro usuario
+RELEASE = '''
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return 0
+end
+if string.match(current, '^(.*):%d+$') ~= ARGV[1] then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], KEYS[1])
+return 1
+'''
+
+RENEW = '''
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+if redis.call('PTTL', KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+'''
+
+# Libera los bloqueos del conjunto que aún son del usuario
+RELEASE_ALL = '''
+local released = 0
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local current = redis.call('GET', key)
+    if current and string.match(current, '^(.*):%d+$') == ARGV[1] then
+        redis.call('DEL', key)
+        released = released + 1
+    end
+end
+redis.call('DEL', KEYS[1])
+return released
+'''
+
+
+class ResourceAlreadyBlocked(Exception):
+    pass
+
+
+class UserDoesNotOwnTheLock(Exception):
+    pass
+
+
+def lock_key(resource: Model) -> str:
+    return f'lock:{resource.pk}'
+
+
+def held_locks_key(user_pk: Any) -> str:
+    return f'locks:{user_pk}'
+
+
+def _run(script: str, keys: List[str], args: List[Any]) -> Any:
+    client = cache.client.get_client(write=True)
+    # ``register_script`` no consulta redis: el script se envía por su hash y
+    # solo se carga si redis aún no lo tiene
+    return client.register_script(script)(keys=[cache.client.make_key(key) for key in keys], args=args)
+
+
+def acquire_lock(user: Model, resource: Model, lease: int = LEASE) -> int:
+    '''
+    Bloquea ``resource`` para ``user`` durante ``lease`` segundos y devuelve
+    el token del bloqueo. Si ``user`` ya lo tenía bloqueado (por ejemplo, en
+    otra pestaña) recibe un token nuevo y el anterior deja de ser válido.
+    '''
+    token = _run(ACQUIRE, [lock_key(resource), held_locks_key(user.pk), TOKENS_KEY], [user.pk, lease * 1000])
+    if token is None:
+        raise ResourceAlreadyBlocked('El recurso se encuentra bloqueado por otra persona.')
+    return token
+
+
+def renew_lock(user: Model, resource: Model, token: Any) -> bool:
+    '''
+    Extiende el arrendamiento del bloqueo si ``token`` sigue siendo el vigente
+    '''
+    return bool(_run(RENEW, [lock_key(resource), held_locks_key(user.pk)], [f'{user.pk}:{token}', LEASE * 1000]))
+
+
+def check_lock(user: Model, resource: Model, token: Any) -> bool:
+    value = cache.client.get_client().get(cache.client.make_key(lock_key(resource)))
+    return value is not None and value.decode() == f'{user.pk}:{token}'
+
+
+def release_lock(user: Model, resource: Model) -> None:
+    if _run(RELEASE, [lock_key(resource), held_locks_key(user.pk)], [user.pk]) < 0:
+        raise UserDoesNotOwnTheLock('Este recurso no fue bloqueado por el usuario actual.')
+
+
+def release_all_locks(user_pk: Any) -> int:
+    '''
+    Libera todos los bloqueos del usuario con identificador ``user_pk``. Solo
+    se consultan las llaves de sus bloqueos; las que expiraron o ya son de
+    otro usuario se ignoran. Devuelve cuántos bloqueos se liberaron.
+    '''
+    return _run(RELEASE_ALL, [held_locks_key(user_pk)], [user_pk])
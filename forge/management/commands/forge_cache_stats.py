@@ -0,0 +1,28 @@
+'''
+Comando para mostrar los contadores de la caché de forge por espacio de
+nombres (ver ``forge.caching``). Solo se contabiliza con ``FORGE_CACHE_STATS``
+activado.
+'''
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from forge import caching
+
+
+class Command(BaseCommand):
+    help = 'Muestra los aciertos, fallos y bytes de la caché por espacio de nombres.'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--reset', action='store_true', help='Reinicia los contadores después de mostrarlos')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if not caching.STATS_ENABLED:
+            self.stderr.write('Los contadores están desactivados; se activan con FORGE_CACHE_STATS')
+        for namespace, stats in caching.get_stats().items():
+            ratio = stats['written'] / stats['raw'] if stats['raw'] else 1
+            self.stdout.write(
+                f"{namespace}: {stats['hits']} aciertos, {stats['misses']} fallos, {stats['read']} bytes leídos, "
+                f"{stats['writes']} escrituras, {stats['written']} bytes escritos ({ratio:.0%} sin comprimir)")
+        if options['reset']:
+            caching.reset_stats()
@@ -0,0 +1,30 @@
+'''
+Comando para reescribir cómo se almacenan los datos de las estructuras (ver
+``forge.patches``). Debe ejecutarse de forma periódica.
+'''
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from forge.management.commands.forge_import import find_structure
+from forge.models import Data, Structure
+
+
+class Command(BaseCommand):
+    help = ('Guarda como diferencias las enmiendas anteriores de las estructuras que declaran "delta": true, '
+            'acorta las cadenas de diferencias y guarda completos los datos de las estructuras que no lo declaran.')
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('structures', nargs='*', help='Identificadores o slugs. Por defecto todas')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Cantidad de filas que se reescriben en cada transacción')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options['structures']:
+            structures = [find_structure(key) for key in options['structures']]
+        else:
+            structures = Structure.objects.select_related('version').iterator()
+        for structure in structures:
+            updated = Data.objects.compact(structure, chunk_size=options['chunk_size'])
+            if updated:
+                self.stdout.write(f'{structure.name}: {updated} filas reescritas')
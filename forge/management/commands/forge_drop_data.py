@@ -0,0 +1,32 @@
+'''
+Comando para eliminar todos los datos de una estructura, que se conserva.
+
+Los datos no se eliminan uno a uno con el ORM: se vacía la partición de la
+estructura (ver ``forge.partitions``) y su proyección, sin enviar las señales
+de ``Data``.
+'''
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from forge import partitions, projections
+from forge.management.commands.forge_import import find_structure
+from forge.models import Data
+from forge.utils import bump_generation
+
+
+class Command(BaseCommand):
+    help = 'Elimina todos los datos de una estructura.'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('structure', help='Identificador o slug de la estructura')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        structure = find_structure(options['structure'])
+        count = Data.objects.for_structure(structure).count()
+        with transaction.atomic():
+            partitions.drop_data(structure.pk)
+            projections.clear(structure.pk)
+        bump_generation(structure.pk)
+        self.stdout.write(f'{structure.name}: {count} datos eliminados')
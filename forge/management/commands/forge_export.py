@@ -0,0 +1,40 @@
+'''
+Comando para exportar los datos de una estructura a CSV o JSONL.
+'''
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from forge.export import EXPORTERS, export
+from forge.management.commands.forge_import import find_structure
+
+
+class Command(BaseCommand):
+    help = ('Exporta los datos de una estructura a CSV o JSONL, en el formato que lee forge_import. '
+            'Los datos se leen y escriben por bloques, sin cargarlos todos en memoria.')
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('structure', help='Identificador o slug de la estructura')
+        parser.add_argument('--output', help='Fichero de salida. Por defecto la salida estándar')
+        parser.add_argument('--format', choices=sorted(EXPORTERS), default=None,
+                            help='Formato de la exportación. Por defecto el de la extensión de --output, o csv')
+        parser.add_argument('--current', action='store_true',
+                            help='Exportar solo la versión actual (la enmienda más reciente) de cada registro')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Cantidad de filas que se leen de la base de datos en cada bloque')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        structure = find_structure(options['structure'])
+        output = options['output']
+        export_format = options['format']
+        if not export_format:
+            export_format = 'jsonl' if output and output.endswith('.jsonl') else 'csv'
+
+        blocks = export(structure, export_format, chunk_size=options['chunk_size'], current=options['current'])
+        if not output:
+            for block in blocks:
+                self.stdout.write(block, ending='')
+            return
+        with open(output, 'w', newline='', encoding='utf-8') as target:
+            for block in blocks:
+                target.write(block)
@@ -0,0 +1,297 @@
+'''
+Comando para importar de forma masiva los datos de una estructura desde un
+fichero CSV o JSONL.
+
+Las filas se validan en paralelo con el formulario de la estructura y se
+insertan con ``bulk_create`` en transacciones de ``--chunk-size`` filas, sin
+pasar por ``Data.save`` ni por sus señales. Las enmiendas se insertan en el
+árbol de sus padres y al final se reconstruyen (MPTT) solo esos árboles.
+'''
+import csv
+import hashlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from django import forms
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import DatabaseError, connections, transaction
+
+from forge import projections
+from forge.codec import get_codec
+from forge.export import ID_COLUMN, MULTIPLE_SEPARATOR, PARENT_COLUMN
+from forge.forms import build_form_class
+from forge.models import Data, Projection, Structure, StructureVersion
+from forge.search import get_document, update_vectors
+from forge.utils import bump_data_versions
+
+
+def find_structure(key: str) -> Structure:
+    '''
+    Busca una estructura por su identificador o, si no es un uuid, por su slug
+    '''
+    try:
+        return Structure.objects.select_related('version').get(pk=uuid.UUID(key))
+    except ValueError:
+        structures = list(Structure.objects.select_related('version').filter(slug=key)[:2])
+    except Structure.DoesNotExist:
+        structures = []
+    if len(structures) != 1:
+        raise CommandError(f'No existe una estructura única con identificador o slug {key}')
+    return structures[0]
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    '''
+    Lee las filas de un fichero como pares ``(línea, valores)``. Los ficheros
+    ``.jsonl`` tienen un objeto por línea; el resto se leen como CSV con una
+    cabecera con los nombres de los campos, y sus celdas vacías se omiten.
+    '''
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.jsonl'):
+            for number, line in enumerate(source, start=1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as error:
+                        raise CommandError(f'{path}:{number}: {error}')
+        else:
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, {name: value for name, value in row.items() if value != ''}
+
+
+_VALIDATORS: Dict[str, Tuple] = {}
+
+
+def _row_validator(version: StructureVersion) -> Tuple:
+    validator = _VALIDATORS.get(version.pk)
+    if validator is None:
+        # Sin caché: se ejecuta en los procesos hijos
+        form_class = build_form_class(version)
+        fields = form_class.base_fields.items()
+        files = [name for name, field in fields if isinstance(field, forms.FileField)]
+        multiple = [name for name, field in fields if isinstance(field, forms.MultipleChoiceField)]
+        validator = _VALIDATORS[version.pk] = (form_class, files, multiple, get_codec(version))
+    return validator
+
+
+def clean_rows(task: Tuple[StructureVersion, List[Dict[str, Any]]]) -> List[Tuple[Optional[Dict], List[str]]]:
+    '''
+    Valida unas filas con el formulario de ``version``. Devuelve, por fila, los
+    datos codificados como se almacenan, o ``None`` y los errores.
+
+    Los ficheros no se pueden importar, por lo que el valor de los campos de
+    tipo fichero (su nombre) se almacena tal cual, sin validarlo.
+    '''
+    version, rows = task
+    form_class, files, multiple, codec = _row_validator(version)
+    results: List[Tuple[Optional[Dict], List[str]]] = []
+    for values in rows:
+        values = dict(values)
+        for name in multiple:
+            if isinstance(values.get(name), str):
+                values[name] = values[name].split(MULTIPLE_SEPARATOR)
+        form = form_class(data=values)
+        for name in files:
+            del form.fields[name]
+        if form.is_valid():
+            data = codec.encode(form.cleaned_data)
+            data.update((name, values.get(name)) for name in files)
+            results.append((data, []))
+        else:
+            results.append((None, [f'{name}: {" ".join(errors)}' for name, errors in form.errors.items()]))
+    return results
+
+
+class Command(BaseCommand):
+    help = ('Importa datos de una estructura desde un fichero CSV (con cabecera) o JSONL. '
+            f'La columna "{ID_COLUMN}" (opcional) es el identificador de la fila y "{PARENT_COLUMN}" el de '
+            'los datos que enmienda, que deben existir o aparecer antes en el fichero. En los CSV los valores '
+            f'de los campos de selección múltiple se separan con "{MULTIPLE_SEPARATOR}".')
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('structure', help='Identificador o slug de la estructura')
+        parser.add_argument('file', help='Fichero .csv o .jsonl')
+        parser.add_argument('--user', help='Usuario que figura como creador de los datos')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Cantidad de procesos que validan las filas. Por defecto uno por núcleo')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Cantidad de filas que se insertan en cada transacción')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continuar a partir de la última transacción confirmada de una importación anterior')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        structure = find_structure(options['structure'])
+        if not options['user']:
+            raise CommandError('Se debe indicar un usuario (--user) como creador de los datos')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'No existe el usuario {options["user"]}')
+
+        path = options['file']
+        checkpoint = f'{path}.forge-import'
+        skip, trees = 0, []
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint) as source:
+                state = json.loads(source.read() or '{}')
+            skip, trees = state.get('read', 0), state.get('trees', [])
+            self.stdout.write(f'Continuando a partir de la fila {skip + 1}')
+
+        processes = options['processes'] or os.cpu_count() or 1
+        chunk_size = options['chunk_size']
+        if processes > 1:
+            # Los procesos hijos no deben heredar conexiones abiertas
+            connections.close_all()
+        executor = ProcessPoolExecutor(processes) if processes > 1 else None
+
+        self.structure, self.version, self.user = structure, structure.version, user
+        self.source_digest = file_digest(path)
+        # Árboles en los que se insertaron enmiendas, que deben reconstruirse.
+        # Se guardan en el punto de control para reconstruir también los de
+        # una importación interrumpida
+        self.trees: Set[int] = set(trees)
+        self.document = get_document(self.version)
+        # Identificadores de las filas inválidas, para no enlazar enmiendas con ellas
+        self.rejected: Set[str] = set()
+        read = skip
+        imported = invalid = 0
+        started = time.monotonic()
+        rows = islice(read_rows(path), skip, None)
+        try:
+            for chunk, results in self.validated_chunks(rows, chunk_size, executor, processes):
+                objects = []
+                for (number, row), (data, errors) in zip(chunk, results):
+                    try:
+                        data_id = self.row_id(number, row)
+                        parent = row.get(PARENT_COLUMN) and uuid.UUID(str(row[PARENT_COLUMN]))
+                    except ValueError:
+                        data_id, parent = None, None
+                        errors = errors + [f'{ID_COLUMN}, {PARENT_COLUMN}: Identificador incorrecto']
+                    if not errors and parent and str(parent) in self.rejected:
+                        errors = [f'{PARENT_COLUMN}: Los datos que enmienda no se importaron']
+                    if errors:
+                        invalid += 1
+                        self.rejected.add(str(data_id))
+                        for error in errors:
+                            self.stderr.write(f'{path}:{number} {error}')
+                        continue
+                    objects.append(self.build_data(data_id, parent, data))
+
+                with transaction.atomic():
+                    if options['resume']:
+                        objects = self.exclude_existing(objects)
+                    self.assign_trees(objects)
+                    Data.objects.bulk_create(objects)
+                    update_vectors(self.document, ((data.id, data.data) for data in objects))
+                # ``bulk_create`` no envía ``post_save``
+                bump_data_versions([structure.pk])
+                read += len(chunk)
+                imported += len(objects)
+                with open(checkpoint, 'w') as target:
+                    json.dump({'read': read, 'trees': sorted(self.trees)}, target)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{read} filas leídas, {imported} importadas ({imported / elapsed:.0f} filas/s)')
+        except DatabaseError as error:
+            raise CommandError(f'Importación interrumpida; puede continuarse con --resume: {error}')
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if self.trees:
+            self.stdout.write(f'Reconstruyendo {len(self.trees)} árboles de enmiendas')
+            with transaction.atomic():
+                for tree_id in sorted(self.trees):
+                    Data.objects.partial_rebuild(tree_id)
+                Data.objects.rebuild_heads(self.trees)
+            bump_data_versions([structure.pk])
+        if Projection.objects.filter(structure=structure).exists():
+            projections.rebuild(structure)
+        # Sin bloques procesados (por ejemplo, un fichero vacío) no hay punto de control
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'{imported} filas importadas en {elapsed:.1f}s ({imported / elapsed:.0f} filas/s)')
+        if invalid:
+            raise CommandError(f'{invalid} filas con errores')
+
+    def validated_chunks(self, rows: Iterator, chunk_size: int, executor: Optional[ProcessPoolExecutor],
+                         processes: int) -> Iterator[Tuple[List, List]]:
+        '''
+        Genera los bloques de ``chunk_size`` filas junto con el resultado de
+        validarlas. Mientras se inserta un bloque los procesos validan el
+        siguiente.
+        '''
+        pending = None
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            submitted = (chunk, self.submit(chunk, executor, processes)) if chunk else None
+            if pending:
+                yield pending[0], pending[1]()
+            if not submitted:
+                break
+            pending = submitted
+
+    def submit(self, chunk: List, executor: Optional[ProcessPoolExecutor], processes: int) -> Callable[[], List]:
+        values = [row for _, row in chunk]
+        if not executor:
+            return lambda: clean_rows((self.version, values))
+        size = max(1, len(values) // processes)
+        futures = [executor.submit(clean_rows, (self.version, values[start:start + size]))
+                   for start in range(0, len(values), size)]
+        return lambda: [result for future in futures for result in future.result()]
+
+    def row_id(self, number: int, row: Dict[str, Any]) -> uuid.UUID:
+        # Sin identificador explícito se deriva uno del contenido del fichero
+        # y la posición de la fila, para que al continuar una importación no
+        # se dupliquen los datos y dos ficheros distintos no coincidan
+        if row.get(ID_COLUMN):
+            return uuid.UUID(str(row[ID_COLUMN]))
+        return uuid.uuid5(self.structure.pk, f'{self.source_digest}:{number}')
+
+    def build_data(self, data_id: uuid.UUID, parent: Any, data: Dict[str, Any]) -> Data:
+        # ``bulk_create`` no llama a ``save``: los campos del árbol se asignan
+        # antes de insertar y el vector de búsqueda después
+        return Data(id=data_id, created_by=self.user, structure=self.structure, structure_version=self.version,
+                    data=data, parent_id=parent or None, level=0, lft=1, rght=2)
+
+    @staticmethod
+    def exclude_existing(objects: List[Data]) -> List[Data]:
+        existing = set(Data.objects.filter(id__in=[data.id for data in objects]).values_list('id', flat=True))
+        return [data for data in objects if data.id not in existing]
+
+    def assign_trees(self, objects: List[Data]) -> None:
+        '''
+        Cada fila nueva es la raíz de un árbol nuevo. Las enmiendas se insertan
+        en el árbol de sus padres y se ubican bajo ellos al reconstruirlo al
+        final de la importación. Los identificadores de los árboles nuevos
+        quedan reservados hasta que se confirme el bloque (ver
+        ``DataManager.next_tree_id``)
+        '''
+        tree_id = Data.objects.next_tree_id() - 1
+        parents = {data.parent_id for data in objects if data.parent_id}
+        trees = dict(Data.objects.filter(id__in=parents).values_list('id', 'tree_id')) if parents else {}
+        for data in objects:
+            if data.parent_id and data.parent_id in trees:
+                data.tree_id = trees[data.parent_id]
+                self.trees.add(data.tree_id)
+            else:
+                tree_id += 1
+                data.tree_id = tree_id
+            trees[data.id] = data.tree_id
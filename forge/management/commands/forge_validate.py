@@ -0,0 +1,154 @@
+'''
+Comando para validar (y opcionalmente cargar) definiciones de estructuras
+almacenadas en ficheros JSON o JSONL.
+'''
+import json
+import os
+from collections import deque
+from functools import partial
+from typing import Any, Dict, Iterator, List, Tuple
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connections, transaction
+from django.utils.text import slugify
+
+from forge import jobs, partitions
+from forge.models import Structure, StructureVersion, structure_hash
+from forge.registries import modules
+from forge.validation import validate_structures
+
+
+def read_definitions(path: str) -> Iterator[Tuple[str, int, Dict]]:
+    '''
+    Lee las definiciones de un fichero. Los ficheros ``.jsonl`` se leen línea
+    a línea; el resto se interpretan como un objeto JSON o una lista de ellos.
+    Genera ternas ``(etiqueta, posición, definición)``, donde la posición es
+    el número de línea o el índice en la lista.
+    '''
+    with open(path) as source:
+        if path.endswith('.jsonl'):
+            for number, line in enumerate(source, start=1):
+                if line.strip():
+                    yield f'{path}:{number}', number, json.loads(line)
+        else:
+            content = json.load(source)
+            if isinstance(content, dict):
+                content = [content]
+            for index, definition in enumerate(content):
+                yield f'{path}[{index}]', index, definition
+
+
+def format_path(path: Tuple) -> str:
+    return '.'.join(str(part) for part in path) or '(raíz)'
+
+
+class Command(BaseCommand):
+    help = ('Valida definiciones de estructuras en ficheros JSON o JSONL sin acceder a la base de datos. '
+            'Cada definición es un objeto con las llaves "name", "module" (opcional) y "structure", '
+            'o directamente la estructura con sus "fields".')
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('files', nargs='+', help='Ficheros .json o .jsonl')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Cantidad de procesos a usar. Por defecto uno por núcleo')
+        parser.add_argument('--load', action='store_true',
+                            help='Cargar las estructuras válidas con una sola inserción')
+        parser.add_argument('--user', help='Usuario que figura como creador de las estructuras cargadas')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        user = None
+        if options['load']:
+            if not options['user']:
+                raise CommandError('Se debe indicar un usuario (--user) para cargar las estructuras')
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'No existe el usuario {options["user"]}')
+
+        if options['processes'] != 1:
+            # Los procesos hijos no deben heredar conexiones abiertas
+            connections.close_all()
+
+        pending: deque = deque()
+        valid: List[Structure] = []
+        total = invalid = 0
+
+        def structures() -> Iterator[Any]:
+            for path in options['files']:
+                for label, position, definition in read_definitions(path):
+                    pending.append((path, label, position, definition))
+                    yield definition.get('structure', definition) if isinstance(definition, dict) else definition
+
+        for index, errors in validate_structures(structures(), processes=options['processes']):
+            path, label, position, definition = pending.popleft()
+            total += 1
+            if not errors:
+                errors = self.definition_errors(definition, user)
+            if errors:
+                invalid += 1
+                for path, message in errors:
+                    self.stderr.write(f'{index} {label} {format_path(path)}: {message}')
+            elif user:
+                valid.append(self.build_structure(path, position, definition, user))
+
+        self.stdout.write(f'{total - invalid} de {total} estructuras válidas')
+
+        if valid:
+            with transaction.atomic():
+                self.assign_versions(valid)
+                Structure.objects.bulk_create(valid)
+                # ``bulk_create`` no envía ``post_save``, por lo que se hace
+                # aquí lo que hacen sus manejadores (ver ``forge.handlers``)
+                for structure in valid:
+                    partitions.create_partition(structure.pk)
+                    transaction.on_commit(partial(self.enqueue_jobs, str(structure.pk)))
+            self.stdout.write(f'{len(valid)} estructuras cargadas')
+
+        if invalid:
+            raise CommandError(f'{invalid} estructuras con errores')
+
+    @staticmethod
+    def enqueue_jobs(structure_id: str) -> None:
+        jobs.sync_field_indexes.delay(structure_id)
+        jobs.sync_projection.delay(structure_id)
+
+    @staticmethod
+    def definition_errors(definition: Any, user: User) -> List[Tuple[Tuple, str]]:
+        if 'structure' not in definition:
+            return []
+        errors = []
+        if user and not definition.get('name'):
+            errors.append((('name',), 'La estructura debe tener un nombre'))
+        module = definition.get('module')
+        if module and module not in modules:
+            errors.append((('module',), f'No existe el módulo {module}'))
+        return errors
+
+    @staticmethod
+    def build_structure(path: str, position: int, definition: Dict, user: User) -> Structure:
+        if 'structure' in definition:
+            name = definition['name']
+            module = definition.get('module')
+            structure = definition['structure']
+        else:
+            # Un fichero puede tener varias estructuras sin nombre
+            name = f'{os.path.splitext(os.path.basename(path))[0]} {position}'
+            module = None
+            structure = definition
+        # ``bulk_create`` no llama a ``save``, por lo que el slug se calcula aquí
+        return Structure(name=name, slug=slugify(name), module=module,
+                         structure=structure, created_by=user)
+
+    @staticmethod
+    def assign_versions(structures: List[Structure]) -> None:
+        '''
+        Enlaza las estructuras con sus versiones, como ``Structure.save``,
+        creando con una sola inserción las que no existen
+        '''
+        hashes = {structure_hash(structure.structure): structure.structure for structure in structures}
+        versions = StructureVersion.objects.in_bulk(list(hashes))
+        versions.update({version.id: version for version in StructureVersion.objects.bulk_create(
+            StructureVersion(id=key, structure=content) for key, content in hashes.items() if key not in versions)})
+        for structure in structures:
+            structure.version = versions[structure_hash(structure.structure)]
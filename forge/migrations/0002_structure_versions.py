@@ -0,0 +1,47 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:13
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import forge.models
+
+
+def create_versions(apps, schema_editor):  # pylint: disable=unused-argument
+    Structure = apps.get_model('forge', 'Structure')
+    StructureVersion = apps.get_model('forge', 'StructureVersion')
+    Data = apps.get_model('forge', 'Data')
+
+    for structure in Structure.objects.all():
+        version, _ = StructureVersion.objects.get_or_create(
+            id=forge.models.structure_hash(structure.structure), defaults={'structure': structure.structure})
+        Structure.objects.filter(pk=structure.pk).update(version=version)
+        Data.objects.filter(structure=structure).update(structure_version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StructureVersion',
+            fields=[
+                ('id', models.CharField(editable=False, max_length=64, primary_key=True, serialize=False)),
+                ('structure', django.contrib.postgres.fields.jsonb.JSONField(editable=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='structure_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='forge.StructureVersion'),
+        ),
+        migrations.AddField(
+            model_name='structure',
+            name='version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='structures', to='forge.StructureVersion'),
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Los índices se crean de forma concurrente para no bloquear la tabla, lo
+    # que no es posible dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('forge', '0002_structure_versions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS forge_data_data_gin '
+            'ON forge_data USING gin (data jsonb_path_ops);',
+            'DROP INDEX CONCURRENTLY IF EXISTS forge_data_data_gin;',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0003_data_gin_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Projection',
+            fields=[
+                ('structure', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='projection', serialize=False, to='forge.Structure')),
+                ('refreshed', models.DateTimeField(auto_now=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='forge.StructureVersion')),
+            ],
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:21
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+from psycopg2.extras import execute_values
+
+# Copia de ``forge.search`` en el momento de la migración: la migración no
+# debe cambiar si el módulo cambia
+TEXT_TYPES = {'text', 'textarea', 'email'}
+CHOICE_TYPES = {'radio', 'select', 'multiselect'}
+
+
+def _choice_labels(choices):
+    labels = {}
+    for value, label in choices:
+        if isinstance(label, (list, tuple)):
+            labels.update(_choice_labels(label))
+        else:
+            labels[str(value)] = str(label)
+    return labels
+
+
+def _document_text(fields, data):
+    words = []
+    for field in fields:
+        value = data.get(field['name'])
+        if field['type'] not in TEXT_TYPES | CHOICE_TYPES or value in (None, '', []):
+            continue
+        if field['type'] in TEXT_TYPES:
+            words.append(str(value))
+        else:
+            labels = _choice_labels(field.get('options', {}).get('choices', []))
+            for choice in value if isinstance(value, list) else [value]:
+                words.append(labels.get(str(choice), str(choice)))
+    return ' '.join(words)
+
+
+def fill_search_vectors(apps, schema_editor):
+    StructureVersion = apps.get_model('forge', 'StructureVersion')
+    Data = apps.get_model('forge', 'Data')
+    config = getattr(settings, 'FORGE_SEARCH_CONFIG', 'simple').replace("'", "''")
+    sql = (f"UPDATE forge_data SET search_vector = to_tsvector('{config}'::regconfig, v.document) "
+           'FROM (VALUES %s) AS v(id, document) WHERE forge_data.id = v.id::uuid')
+    with schema_editor.connection.cursor() as cursor:
+        for version in StructureVersion.objects.iterator():
+            fields = version.structure['fields']
+            rows = Data.objects.filter(structure_version=version).values_list('id', 'data').iterator()
+            execute_values(cursor.cursor, sql, ((str(pk), _document_text(fields, data)) for pk, data in rows),
+                           page_size=2000)
+
+
+class Migration(migrations.Migration):
+    # El índice se crea de forma concurrente para no bloquear la tabla, lo que
+    # no es posible dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('forge', '0004_projection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop, atomic=True),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX CONCURRENTLY IF NOT EXISTS forge_data_search_gin '
+                    'ON forge_data USING gin (search_vector);',
+                    'DROP INDEX CONCURRENTLY IF EXISTS forge_data_search_gin;',
+                ),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='data',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'],
+                                                                   name='forge_data_search_gin'),
+                ),
+            ],
+        ),
+    ]
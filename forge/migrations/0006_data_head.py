@@ -0,0 +1,41 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Los índices se crean de forma concurrente para no bloquear la tabla, lo
+    # que no es posible dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('forge', '0005_data_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='is_head',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        # Igual que ``DataManager.rebuild_heads``
+        migrations.RunSQL(
+            '''
+            UPDATE forge_data SET is_head = (forge_data.id = heads.id)
+            FROM (SELECT DISTINCT ON (tree_id) tree_id, id FROM forge_data
+                  ORDER BY tree_id, created DESC, lft DESC) AS heads
+            WHERE forge_data.tree_id = heads.tree_id AND forge_data.is_head <> (forge_data.id = heads.id);
+            ''',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS forge_data_head_tree '
+            'ON forge_data (tree_id) WHERE is_head;',
+            'DROP INDEX CONCURRENTLY IF EXISTS forge_data_head_tree;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS forge_data_head_structure '
+            'ON forge_data (structure_id) WHERE is_head;',
+            'DROP INDEX CONCURRENTLY IF EXISTS forge_data_head_structure;',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:39
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0006_data_head'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='patch',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
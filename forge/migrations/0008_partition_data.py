@@ -0,0 +1,95 @@
+# Generated by Django 2.0.13 on 2026-10-18 19:02
+
+import re
+import uuid
+
+from django.db import migrations
+import django.db.models.deletion
+import mptt.fields
+
+# Valores de ``forge.partitions`` y ``forge.indexes`` en el momento de la
+# migración: la migración no debe cambiar si los módulos cambian
+TABLE = 'forge_data'
+DEFAULT_PARTITION = f'{TABLE}_default'
+INDEX_PREFIX = 'forge_fidx_'
+
+
+def _is_partitioned(cursor):
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))', [TABLE])
+    return cursor.fetchone()[0]
+
+
+def _rebuild_table(schema_editor, partitioned):
+    '''
+    Recrea ``forge_data`` particionada (o sin particionar, al revertir) con los
+    mismos datos, índices y llaves foráneas
+    '''
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        # Los índices de los campos (ver ``forge.indexes``) se crean en la
+        # partición de su estructura o, al revertir, en la tabla
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE (tablename = %s OR indexname LIKE %s) "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE contype IN ('p', 'u'))",
+            [TABLE, INDEX_PREFIX.replace('_', '\\_') + '%'])
+        indexes = cursor.fetchall()
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = %s::regclass AND contype = 'f'", [TABLE])
+        constraints = cursor.fetchall()
+
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+        cursor.execute(f'CREATE TABLE {TABLE} (LIKE {TABLE}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+                       f'INCLUDING STORAGE){" PARTITION BY LIST (structure_id)" if partitioned else ""}')
+        if partitioned:
+            cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+            cursor.execute(f'ALTER TABLE {DEFAULT_PARTITION} ADD PRIMARY KEY (id)')
+            cursor.execute('SELECT id FROM forge_structure')
+            for (structure_id,) in cursor.fetchall():
+                name = connection.ops.quote_name(f'{TABLE}_{uuid.UUID(str(structure_id)).hex}')
+                cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES IN ('{structure_id}')")
+                cursor.execute(f'ALTER TABLE {name} ADD PRIMARY KEY (id)')
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {TABLE}_old')
+        # Al eliminar la tabla particionada se eliminan sus particiones
+        cursor.execute(f'DROP TABLE {TABLE}_old')
+        if not partitioned:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id)')
+
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {connection.ops.quote_name(name)} {definition}')
+        for name, definition in indexes:
+            target = TABLE
+            if partitioned and name.startswith(INDEX_PREFIX):
+                target = TABLE + '_' + name[len(INDEX_PREFIX):].split('_')[0]
+            cursor.execute(re.sub(r' ON (ONLY )?\S+ ', f' ON {target} ', definition, count=1))
+
+
+def partition_data(apps, schema_editor):
+    connection = schema_editor.connection
+    # Las tablas particionadas con partición por defecto requieren Postgres 11
+    with connection.cursor() as cursor:
+        if connection.pg_version < 110000 or _is_partitioned(cursor):
+            return
+    _rebuild_table(schema_editor, partitioned=True)
+
+
+def unpartition_data(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if not _is_partitioned(cursor):
+            return
+    _rebuild_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0007_data_patch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='data',
+            name='parent',
+            field=mptt.fields.TreeForeignKey(blank=True, db_constraint=False, default=None, null=True, on_delete=django.db.models.deletion.SET_DEFAULT, related_name='children', to='forge.Data'),
+        ),
+        migrations.RunPython(partition_data, unpartition_data),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0008_partition_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='lock_token',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
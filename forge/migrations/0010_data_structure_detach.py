@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-18 19:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0009_data_lock_token'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='data',
+            name='structure',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='forge.Structure'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# Conversiones que devuelven NULL en lugar de fallar cuando el valor no es del
+# tipo del campo (por ejemplo, datos de una versión anterior de la estructura).
+# Se usan en los índices de expresión de ``forge.indexes``, por lo que deben ser
+# IMMUTABLE, y así un valor que no se puede convertir no impide salvar los
+# datos ni crear el índice.
+CAST_FUNCTIONS = [('forge_to_numeric', 'numeric'), ('forge_to_boolean', 'boolean')]
+
+CREATE_FUNCTION = '''
+CREATE OR REPLACE FUNCTION {name}(value text) RETURNS {db_type}
+LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+BEGIN
+    RETURN value::{db_type};
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forge', '0010_data_structure_detach'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            [CREATE_FUNCTION.format(name=name, db_type=db_type) for name, db_type in CAST_FUNCTIONS],
+            [f'DROP FUNCTION IF EXISTS {name}(text);' for name, _ in CAST_FUNCTIONS],
+        ),
+    ]
@@ -1,19 +1,30 @@
 '''
 Modelos que heredan de `django.db.models.Model`
 '''
+import hashlib
+import json
 import uuid
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, List
 
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Max, Q
 from django.urls import reverse
 from django.utils.text import slugify
 
 from mptt.models import MPTTModel, TreeForeignKey, TreeManager
+from mptt.querysets import TreeQuerySet
+from psycopg2.extras import Json, execute_values
 
+from . import caching
+from .patches import MAX_CHAIN, apply_patch, make_patch, resolve_chain
 from .registries import modules
+from .search import SEARCH_CONFIG, get_document, search_vector
 from .validation import validate_structure
 
 
@@ -21,16 +32,19 @@ class BaseModel(models.Model):
     '''
     Modelo que sirve de base para el resto. Implementa algunos campos comunes
     así como sobreescribe el método ``save`` de ``django.db.models.Model`` para que
-    el modelo se valide cada vez que se salve.
+    el modelo se valide cada vez que se salve, salvo que se salve con
+    ``clean=False`` porque sus valores ya se validaron (por ejemplo, con el
+    formulario de la estructura).
     '''
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)  # pylint: disable=invalid-name
     created = models.DateTimeField(auto_now_add=True, editable=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     last_modified = models.DateTimeField(auto_now=True, editable=False)
 
-    def save(self, *args: Any, **kwargs: Any) -> None:  # pylint: disable=arguments-differ
+    def save(self, *args: Any, clean: bool = True, **kwargs: Any) -> None:  # pylint: disable=arguments-differ
         # Valida el modelo cada vez que se salve
-        self.full_clean()
+        if clean:
+            self.full_clean()
         super().save(*args, **kwargs)  # Llamar al método ``save`` real
 
     class Meta:
@@ -44,6 +58,36 @@ def default_structure() -> Dict[str, list]:
 MODULES_CHOICES = [(module_name, module_name) for module_name in modules]
 
 
+def structure_hash(structure: Dict) -> str:
+    '''
+    Hash sha256 del contenido de una estructura, independiente del orden de
+    las llaves de sus objetos.
+    '''
+    content = json.dumps(structure, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class StructureVersion(models.Model):
+    '''
+    Versión inmutable de la definición de una estructura, identificada por el
+    hash de su contenido. Cada vez que se salva una ``Structure`` se enlaza con
+    la versión que corresponde a su contenido, creándola si no existe.
+
+    Como el contenido de una versión nunca cambia, lo que se genere a partir de
+    ella (formularios, html, codecs) puede guardarse en caché sin necesidad de
+    invalidarlo.
+    '''
+    id = models.CharField(primary_key=True, max_length=64, editable=False)  # pylint: disable=invalid-name
+    structure = JSONField(editable=False)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    @classmethod
+    def for_structure(cls, structure: Dict) -> 'StructureVersion':
+        version, _ = cls.objects.get_or_create(id=structure_hash(structure),
+                                               defaults={'structure': structure})
+        return version
+
+
 class Structure(BaseModel):
     '''
     Modelo que representa la estructura de un formulario, principalmente los
@@ -55,24 +99,185 @@ class Structure(BaseModel):
     slug = models.SlugField(max_length=100)
     module = models.CharField(max_length=255, blank=True, null=True, choices=MODULES_CHOICES)
     structure = JSONField(default=default_structure, validators=[validate_structure])
+    version = models.ForeignKey(StructureVersion, null=True, blank=True, editable=False,
+                                on_delete=models.PROTECT, related_name='structures')
 
     def save(self, *args: Any, **kwargs: Any) -> None:  # pylint: disable=arguments-differ
         # Valida el modelo cada vez que se salve
         self.slug = slugify(self.name)
-        super().save(*args, **kwargs)  # Llamar al método ``save`` real
+        # Si la validación falla no debe quedar creada la versión
+        with transaction.atomic():
+            self.version = StructureVersion.for_structure(self.structure)
+            super().save(*args, **kwargs)  # Llamar al método ``save`` real
+
+    @property
+    def definition(self) -> Any:
+        '''
+        Versión actual de la estructura, o la estructura misma si aún no tiene
+        una versión
+        '''
+        return self.version or self
 
     def get_absolute_url(self) -> str:
         return reverse('forge:structure_details',
                        kwargs={'slug': self.slug, 'pk': str(self.pk)})
 
 
-class DataManager(TreeManager):
+def data_key(data_id: Any) -> str:
+    '''
+    Llave en la caché de los datos completos de una versión almacenada como
+    diferencia (ver ``Data.full_data``)
+    '''
+    return f'data:{data_id}'
+
+
+# Llave del bloqueo consultivo con que se reservan los identificadores de árbol
+TREE_ID_LOCK = 0x666f72676500
+
+
+class DataQuerySet(TreeQuerySet):
+    def for_structure(self, structure: Any) -> models.QuerySet:
+        return self.filter(structure=structure)
+
+    def where(self, conditions: Dict[str, Any] = None, **fields: Any) -> models.QuerySet:
+        '''
+        Filtra por el valor de los campos de los datos. Se compila a una
+        consulta de contención (``data @> {...}``) que puede resolver el índice
+        GIN de ``forge_data.data``. Los campos cuyo nombre no es un identificador
+        válido de python (por ejemplo ``e-mail``) se pasan en ``conditions``::
+
+            Data.objects.for_structure(structure).where(occupation='engineer')
+            Data.objects.where({'e-mail': 'foo@bar.com'})
+
+        Para los campos de selección múltiple se pasa una lista con los valores
+        que deben estar seleccionados.
+        '''
+        return self.filter(data__contains=dict(conditions or {}, **fields))
+
+    def current(self) -> models.QuerySet:
+        '''
+        Solo la versión actual de cada registro: la enmienda más reciente de
+        cada árbol de ``Data``
+        '''
+        return self.filter(is_head=True)
+
+    def search(self, text: str) -> models.QuerySet:
+        '''
+        Búsqueda de texto completo en los campos de texto y de selección de los
+        datos (ver ``forge.search``). Los resultados se ordenan por relevancia,
+        que queda anotada en ``rank``.
+        '''
+        query = SearchQuery(text, config=SEARCH_CONFIG)
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)).order_by('-rank', '-last_modified')
+
+
+class DataManager(TreeManager.from_queryset(DataQuerySet)):  # type: ignore
     def orphans(self) -> models.QuerySet:
         return super().get_queryset().filter(level__gt=0, parent=None)
 
     def structureless(self) -> models.QuerySet:
         return super().get_queryset().filter(structure=None)
 
+    def next_tree_id(self) -> int:
+        '''
+        Identificador del próximo árbol nuevo. Toma un bloqueo consultivo hasta
+        el final de la transacción para que otra transacción no obtenga el
+        mismo antes de que se inserte, por lo que debe llamarse dentro de la
+        misma en que se insertan los árboles.
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [TREE_ID_LOCK])
+        return (self.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+
+    def _get_next_tree_id(self) -> int:
+        # Lo usa ``MPTTModel.save`` al insertar una raíz
+        return self.next_tree_id()
+
+    def fence(self, pk: Any, token: int) -> bool:
+        '''
+        Registra que se escribe en los datos ``pk`` con el token de bloqueo
+        ``token`` (ver ``forge.locks``). Devuelve ``False`` si ya se escribió
+        con un token posterior, es decir, si el bloqueo expiró y otra persona
+        lo tomó. La fila queda bloqueada hasta el final de la transacción, por
+        lo que debe llamarse dentro de la misma en que se escribe.
+        '''
+        return bool(self.filter(Q(lock_token__isnull=True) | Q(lock_token__lte=token), pk=pk).update(
+            lock_token=token))
+
+    def rebuild_heads(self, tree_ids: Iterable[int] = None) -> int:
+        '''
+        Marca de nuevo la versión actual de todos los árboles, o solo de los
+        árboles ``tree_ids``. Solo es necesario después de modificar los
+        árboles sin pasar por ``Data.save`` y ``Data.delete`` (por ejemplo, al
+        importar o eliminar datos en masa). Devuelve la cantidad de filas
+        modificadas.
+        '''
+        table = self.model._meta.db_table
+        condition, params = '', []
+        if tree_ids is not None:
+            condition, params = 'WHERE tree_id = ANY(%s)', [list(tree_ids)]
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE {table} SET is_head = ({table}.id = heads.id)
+                FROM (SELECT DISTINCT ON (tree_id) tree_id, id FROM {table} {condition}
+                      ORDER BY tree_id, created DESC, lft DESC) AS heads
+                WHERE {table}.tree_id = heads.tree_id AND {table}.is_head <> ({table}.id = heads.id)
+            ''', params)
+            return cursor.rowcount
+
+    def compact(self, structure: Any, chunk_size: int = 2000) -> int:
+        '''
+        Reescribe cómo se almacenan los datos de ``structure``: si declara
+        ``"delta": true`` las enmiendas anteriores se guardan como diferencias
+        con sus padres (ver ``forge.patches``) y, si no, todos los datos se
+        guardan completos. Sirve para recuperar espacio después de activar el
+        modo y para acortar las cadenas de diferencias de forma periódica.
+        Devuelve la cantidad de filas modificadas.
+        '''
+        delta = bool(structure.definition.structure.get('delta'))
+        if not delta and not self.filter(structure=structure, patch__isnull=False).exists():
+            return 0
+        rows = self.filter(structure=structure).order_by('tree_id', 'lft').values_list(
+            'id', 'parent_id', 'tree_id', 'data', 'patch', 'is_head').iterator(chunk_size=chunk_size)
+        sql = (f'UPDATE {self.model._meta.db_table} SET data = v.data::jsonb, patch = v.patch::jsonb '
+               f'FROM (VALUES %s) AS v(id, data, patch) WHERE {self.model._meta.db_table}.id = v.id::uuid')
+        documents: Dict[Any, Any] = {}
+        current_tree = None
+        updates: List = []
+        updated = 0
+        for data_id, parent_id, tree_id, data, patch, is_head in rows:
+            if tree_id != current_tree:
+                documents, current_tree = {}, tree_id
+            parent = documents.get(parent_id)
+            if patch is not None and parent is None:
+                continue  # No se puede reconstruir; se deja como está
+            document = data if patch is None else apply_patch(parent[0], patch)
+
+            new_patch, depth = None, 0
+            if delta and parent is not None and not is_head and parent[1] < MAX_CHAIN:
+                new_patch, depth = make_patch(parent[0], document), parent[1] + 1
+            documents[data_id] = (document, depth)
+
+            if new_patch != patch:
+                updates.append((str(data_id), Json({} if new_patch is not None else document),
+                                Json(new_patch) if new_patch is not None else None))
+            if len(updates) >= chunk_size:
+                updated += self._write_storage(sql, updates)
+                updates = []
+        return updated + self._write_storage(sql, updates)
+
+    @staticmethod
+    def _write_storage(sql: str, updates: List) -> int:
+        if not updates:
+            return 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            execute_values(cursor.cursor, sql, updates, page_size=len(updates))
+        # Los datos completos en caché de las filas reescritas pueden ser de
+        # una versión anterior
+        caching.delete(*(data_key(data_id) for data_id, _, _ in updates))
+        return len(updates)
+
 
 class Data(BaseModel, MPTTModel):
     '''
@@ -81,13 +286,146 @@ class Data(BaseModel, MPTTModel):
 
     Los datos se almacenan en un campo de tipo ``jsonb`` en la base de datos.
     '''
+    # Al eliminar la estructura sus datos quedan sin estructura, pero no los
+    # actualiza el ORM fila a fila sino ``forge.partitions.detach_structure``
     structure = models.ForeignKey(Structure, null=True, blank=True,
-                                  default=None, on_delete=models.SET_DEFAULT)
+                                  default=None, on_delete=models.DO_NOTHING)
+    structure_version = models.ForeignKey(StructureVersion, null=True, blank=True, editable=False,
+                                          on_delete=models.PROTECT)
     data = JSONField(default=dict, encoder=DjangoJSONEncoder)
-    parent = TreeForeignKey('self', null=True, blank=True, default=None,
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    # Si es la versión actual (la enmienda más reciente) de su árbol
+    is_head = models.BooleanField(default=True, editable=False)
+    # Diferencia con los datos del padre, si se almacenan así (ver ``forge.patches``)
+    patch = JSONField(null=True, blank=True, editable=False)
+    # Token del último bloqueo con el que se escribió (ver ``DataManager.fence``)
+    lock_token = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Sin restricción en la base de datos: la tabla está particionada (ver ``forge.partitions``)
+    parent = TreeForeignKey('self', null=True, blank=True, default=None, db_constraint=False,
                             on_delete=models.SET_DEFAULT, related_name='children', db_index=True)
     objects = DataManager()
 
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='forge_data_search_gin')]
+
+    def save(self, *args: Any, **kwargs: Any) -> None:  # pylint: disable=arguments-differ
+        # Las versiones almacenadas como diferencia se cargan con los datos
+        # vacíos: si no se reemplazaron se guardan sus datos completos
+        if self.patch is not None and not self.data:
+            self.data = self.full_data()
+        # Los datos se capturan con la versión actual de su estructura
+        if self.structure_id and not self.structure_version_id:
+            self.structure_version_id = Structure.objects.values_list(
+                'version_id', flat=True).get(pk=self.structure_id)
+        definition = self.definition
+        self.search_vector = search_vector(get_document(definition).text(self.data)) if definition else None
+        adding = self._state.adding
+        with transaction.atomic():
+            if not adding:
+                # Los datos que se salvan se guardan completos. Las versiones
+                # actuales no tienen hijos, el resto puede tener hijos que se
+                # guardan como diferencias con los datos anteriores
+                if not self.is_head:
+                    self.materialize_children()
+                self.patch = None
+                caching.delete(data_key(self.pk))
+            super().save(*args, **kwargs)
+            # Una enmienda nueva pasa a ser la versión actual de su árbol
+            if adding and self.parent_id:
+                previous = Data.objects.filter(tree_id=self.tree_id, is_head=True).exclude(pk=self.pk)
+                if definition and definition.structure.get('delta'):
+                    for node in previous:
+                        node.store_as_patch()
+                previous.update(is_head=False)
+        # El vector se calcula en la base de datos; si se necesita se carga al
+        # acceder a él
+        self.__dict__.pop('search_vector', None)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:  # pylint: disable=arguments-differ
+        with transaction.atomic():
+            if not self.is_head:
+                self.materialize_children()
+            caching.delete(data_key(self.pk))
+            result = super().delete(*args, **kwargs)
+            # Si se elimina la versión actual, pasa a serlo la más reciente de
+            # las que quedan, con sus datos completos
+            if self.is_head:
+                latest = Data.objects.filter(tree_id=self.tree_id).order_by('-created', '-lft').first()
+                if latest:
+                    Data.objects.filter(pk=latest.pk).update(is_head=True, data=latest.full_data(), patch=None)
+        return result
+
+    def full_data(self) -> Dict[str, Any]:
+        '''
+        Datos completos de esta versión. Si se almacenan como diferencia con
+        los de su padre se reconstruyen y se guardan en la caché.
+        '''
+        if self.patch is None:
+            return self.data
+        key = data_key(self.pk)
+        data = caching.get('data', key)
+        if data is None:
+            chain = list(self.get_ancestors().values_list('data', 'patch')) + [(self.data, self.patch)]
+            data, _ = resolve_chain(chain)
+            caching.set('data', key, data, getattr(settings, 'FORGE_DELTA_CACHE_TIMEOUT', 60 * 60 * 24))
+        return data
+
+    def store_as_patch(self) -> None:
+        '''
+        Guarda estos datos como la diferencia con los de su padre, salvo que
+        sean una raíz o que ya haya ``MAX_CHAIN`` diferencias consecutivas
+        '''
+        if self.parent_id is None or self.patch is not None:
+            return
+        parent_data, depth = resolve_chain(list(self.get_ancestors().values_list('data', 'patch')))
+        if depth >= MAX_CHAIN:
+            return
+        self.patch = make_patch(parent_data, self.data)
+        Data.objects.filter(pk=self.pk).update(data={}, patch=self.patch)
+        caching.set('data', data_key(self.pk), self.data, getattr(settings, 'FORGE_DELTA_CACHE_TIMEOUT', 60 * 60 * 24))
+
+    def materialize_children(self) -> None:
+        '''
+        Guarda completos los datos de los hijos almacenados como diferencia con
+        estos datos, antes de que cambien o se eliminen
+        '''
+        for child in Data.objects.filter(parent_id=self.pk, patch__isnull=False):
+            Data.objects.filter(pk=child.pk).update(data=child.full_data(), patch=None)
+            caching.delete(data_key(child.pk))
+
+    def current_version(self) -> 'Data':
+        if self.is_head:
+            return self
+        return Data.objects.current().filter(tree_id=self.tree_id).first() or self
+
+    @property
+    def definition(self) -> Any:
+        '''
+        Versión de la estructura con la que se capturaron los datos
+        '''
+        return self.structure_version or (self.structure and self.structure.definition)
+
     def get_absolute_url(self) -> str:
         return reverse('forge:data_details',
                        kwargs={'slug': self.structure.slug, 'pk': str(self.pk)})
+
+
+def projection_table(structure_id: uuid.UUID) -> str:
+    return f'forge_projection_{structure_id.hex}'
+
+
+class Projection(models.Model):
+    '''
+    Proyección de los datos de una estructura en una tabla con una columna
+    tipada por cada campo (ver ``forge.projections``). Se crea para las
+    estructuras que declaran ``"projection": true``.
+    '''
+    structure = models.OneToOneField(Structure, primary_key=True, on_delete=models.CASCADE,
+                                     related_name='projection')
+    # Versión de la estructura con la que se construyó la tabla
+    version = models.ForeignKey(StructureVersion, on_delete=models.PROTECT, related_name='+')
+    refreshed = models.DateTimeField(auto_now=True)
+
+    @property
+    def table(self) -> str:
+        return projection_table(self.structure_id)
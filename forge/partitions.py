@@ -0,0 +1,97 @@
+'''
+Particiones de ``forge_data`` por estructura.
+
+La tabla ``forge_data`` está particionada por lista sobre ``structure_id``
+(ver la migración ``0008_partition_data``): cada estructura tiene su partición
+``forge_data_<id>``, que se crea junto con la estructura, y los datos sin
+estructura (por ejemplo, los de estructuras eliminadas) o de estructuras sin
+partición van a ``forge_data_default``. Las consultas que filtran por
+estructura (``DataQuerySet.for_structure``) solo leen su partición, y eliminar
+todos los datos de una estructura es vaciar una tabla.
+
+Postgres exige que las llaves únicas de una tabla particionada incluyan la
+columna de la partición, que en este caso admite nulos, por lo que cada
+partición tiene su propia llave primaria sobre ``id`` y la relación de las
+enmiendas con sus padres no tiene restricción en la base de datos.
+
+Si la tabla no está particionada (por ejemplo, con versiones de Postgres
+anteriores a la 11) las funciones de este módulo no hacen nada.
+'''
+from typing import Any, Optional
+
+from django.db import connection
+
+TABLE = 'forge_data'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def partition_name(structure_id: Any) -> str:
+    return f'{TABLE}_{structure_id.hex}'
+
+
+def is_partitioned() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+                       [TABLE])
+        return cursor.fetchone()[0]
+
+
+def get_partition(structure_id: Any) -> Optional[str]:
+    '''
+    Nombre de la partición de la estructura, o ``None`` si no tiene
+    '''
+    name = partition_name(structure_id)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s) '
+                       'AND inhparent = to_regclass(%s))', [name, TABLE])
+        return name if cursor.fetchone()[0] else None
+
+
+def create_partition(structure_id: Any) -> None:
+    '''
+    Crea la partición de una estructura nueva. Debe crearse antes de que la
+    estructura tenga datos, porque estarían en la partición por defecto.
+    '''
+    if not is_partitioned() or get_partition(structure_id):
+        return
+    name = connection.ops.quote_name(partition_name(structure_id))
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES IN ('{structure_id}')")
+        cursor.execute(f'ALTER TABLE {name} ADD PRIMARY KEY (id)')
+
+
+def drop_partition(structure_id: Any) -> None:
+    '''
+    Elimina la partición de una estructura junto con sus datos
+    '''
+    if get_partition(structure_id):
+        connection.check_constraints()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {connection.ops.quote_name(partition_name(structure_id))}')
+
+
+def detach_structure(structure_id: Any) -> None:
+    '''
+    Deja sin estructura los datos de una estructura que se elimina: se mueven
+    con una sola sentencia a la partición por defecto, sin cargarlos, y se
+    elimina su partición, ya vacía
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {TABLE} SET structure_id = NULL WHERE structure_id = %s', [structure_id])
+    drop_partition(structure_id)
+
+
+def drop_data(structure_id: Any) -> None:
+    '''
+    Elimina todos los datos de una estructura sin pasar por el ORM: se vacía
+    su partición o, si no tiene, se eliminan con una sola sentencia
+    '''
+    partition = get_partition(structure_id)
+    # No se puede vaciar ni eliminar una tabla con verificaciones de llaves
+    # foráneas pendientes en la transacción
+    connection.check_constraints()
+    with connection.cursor() as cursor:
+        if partition:
+            cursor.execute(f'TRUNCATE {connection.ops.quote_name(partition)}')
+        else:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE structure_id = %s', [structure_id])
@@ -0,0 +1,89 @@
+'''
+Almacenamiento de las enmiendas como diferencias (JSON Patch, RFC 6902).
+
+En las estructuras que declaran ``"delta": true``, las enmiendas que dejan de
+ser la versión actual de su árbol guardan en ``Data.patch`` las operaciones que
+convierten los datos de su padre en los suyos, y su ``Data.data`` queda vacío.
+Las raíces, las versiones actuales y una de cada ``FORGE_DELTA_MAX_CHAIN``
+enmiendas consecutivas se guardan completas, de modo que las consultas sobre
+los datos actuales no cambian y reconstruir una versión anterior no requiere
+aplicar demasiadas diferencias.
+
+Como los datos son un objeto con un valor por campo, las diferencias solo
+tienen operaciones sobre sus llaves (``/campo``): ``add``, ``replace`` y
+``remove``.
+'''
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+MAX_CHAIN = getattr(settings, 'FORGE_DELTA_MAX_CHAIN', 10)
+
+
+def _pointer(key: str) -> str:
+    return '/' + key.replace('~', '~0').replace('/', '~1')
+
+
+def _key(pointer: str) -> str:
+    if not pointer.startswith('/') or '/' in pointer[1:]:
+        raise ValueError(f'Ruta no soportada: {pointer}')
+    return pointer[1:].replace('~1', '/').replace('~0', '~')
+
+
+def make_patch(source: Dict[str, Any], target: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''
+    Operaciones que convierten ``source`` en ``target``
+    '''
+    operations: List[Dict[str, Any]] = [
+        {'op': 'remove', 'path': _pointer(key)} for key in source if key not in target]
+    for key, value in target.items():
+        if key not in source:
+            operations.append({'op': 'add', 'path': _pointer(key), 'value': value})
+        elif source[key] != value:
+            operations.append({'op': 'replace', 'path': _pointer(key), 'value': value})
+    return operations
+
+
+def apply_patch(document: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    result = dict(document)
+    for operation in operations:
+        key = _key(operation['path'])
+        if operation['op'] in ('add', 'replace'):
+            result[key] = operation['value']
+        elif operation['op'] == 'remove':
+            result.pop(key, None)
+        else:
+            raise ValueError(f'Operación no soportada: {operation["op"]}')
+    return result
+
+
+def resolve_chain(chain: List[Tuple[Dict, Optional[List]]]) -> Tuple[Dict[str, Any], int]:
+    '''
+    Reconstruye los datos del último nodo de ``chain``, la lista de pares
+    ``(data, patch)`` desde la raíz de un árbol hasta ese nodo. Devuelve
+    también cuántas diferencias consecutivas hubo que aplicar.
+    '''
+    start = max((index for index, (_, patch) in enumerate(chain) if patch is None), default=0)
+    document = chain[start][0]
+    for _, patch in chain[start + 1:]:
+        document = apply_patch(document, patch)
+    return document, len(chain) - 1 - start
+
+
+def iter_documents(rows: Iterable[Tuple]) -> Iterator[Tuple[Tuple, Dict[str, Any]]]:
+    '''
+    Reconstruye los datos de unas filas que empiezan con ``(id, parent_id,
+    tree_id, data, patch)`` y están ordenadas por ``tree_id`` y ``lft`` (cada
+    padre antes que sus hijos). Genera pares ``(fila, datos)``; solo se guardan
+    en memoria los datos del árbol que se está recorriendo.
+    '''
+    documents: Dict[Any, Dict] = {}
+    current_tree = None
+    for row in rows:
+        data_id, parent_id, tree_id, data, patch = row[:5]
+        if tree_id != current_tree:
+            documents, current_tree = {}, tree_id
+        if patch is not None and parent_id in documents:
+            data = apply_patch(documents[parent_id], patch)
+        documents[data_id] = data
+        yield row, data
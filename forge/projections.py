@@ -0,0 +1,247 @@
+'''
+Proyecciones de los datos de una estructura para reportes.
+
+Las estructuras que declaran ``"projection": true`` tienen una tabla
+``forge_projection_<id>`` con la llave ``forge_data_id`` y una columna tipada
+por cada campo, de modo que los reportes no tengan que extraer cada valor de
+``forge_data.data``. Solo se proyectan las versiones actuales de los datos
+(``is_head``), para que cada registro cuente una vez en los reportes. La tabla
+se construye en segundo plano cuando cambia la estructura (``rebuild``) y se
+mantiene fila a fila desde los handlers de ``Data`` (``refresh_row`` y
+``delete_row``). Para leerla está ``rows`` o, con sql, el nombre de la tabla
+en ``Projection.table``.
+'''
+import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from psycopg2.extras import Json, execute_values
+
+from .codec import get_codec
+from .models import Data, Projection, Structure, StructureVersion, projection_table
+from .utils import LRUCache
+
+KEY_COLUMN = 'forge_data_id'
+
+# Tipo de campo -> (tipo de la columna, tipo de python de los valores). Los
+# tipos que no aparecen se proyectan como texto.
+COLUMN_TYPES = {
+    'integer': ('bigint', int),
+    'decimal': ('numeric', Decimal),
+    'date': ('date', datetime.date),
+    'datetime': ('timestamp with time zone', datetime.datetime),
+    'time': ('time', datetime.time),
+    'duration': ('interval', datetime.timedelta),
+    'checkbox': ('boolean', bool),
+    'multiselect': ('jsonb', list),
+}
+
+
+class Layout:
+    '''
+    Columnas de la tabla de proyección de una versión de una estructura, y cómo
+    convertir los datos almacenados en los valores de cada columna.
+    '''
+
+    def __init__(self, version: StructureVersion) -> None:
+        self.codec = get_codec(version)
+        self.columns: List[Tuple[str, str, str, Any]] = []
+        for field in version.structure['fields']:
+            column = field['name'][:63]
+            if column == KEY_COLUMN:
+                continue
+            db_type, python_type = COLUMN_TYPES.get(field['type'], ('text', str))
+            self.columns.append((field['name'], column, db_type, python_type))
+
+    def create_sql(self, table: str) -> str:
+        quote = connection.ops.quote_name
+        columns = ''.join(f', {quote(column)} {db_type}' for _, column, db_type, _ in self.columns)
+        return f'CREATE TABLE {quote(table)} ({KEY_COLUMN} uuid PRIMARY KEY{columns})'
+
+    def upsert_sql(self, table: str) -> str:
+        quote = connection.ops.quote_name
+        names = ', '.join([KEY_COLUMN] + [quote(column) for _, column, _, _ in self.columns])
+        updates = ', '.join(f'{quote(column)} = EXCLUDED.{quote(column)}' for _, column, _, _ in self.columns)
+        action = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        return f'INSERT INTO {quote(table)} ({names}) VALUES %s ON CONFLICT ({KEY_COLUMN}) {action}'
+
+    def row(self, data_id: Any, data: Dict[str, Any]) -> Tuple:
+        '''
+        Valores de la fila de unos datos. Los valores que no tienen el tipo de
+        su columna (por ejemplo, datos capturados con otra versión de la
+        estructura) se proyectan como nulos.
+        '''
+        values = self.codec.decode(data)
+        row = [data_id]
+        for name, _, _, python_type in self.columns:
+            value = values.get(name)
+            if python_type is str:
+                value = None if value is None else str(value)
+            elif not isinstance(value, python_type) or (python_type is int and isinstance(value, bool)):
+                value = None
+            elif python_type is list:
+                value = Json(value)
+            row.append(value)
+        return tuple(row)
+
+
+layouts = LRUCache(getattr(settings, 'FORGE_PROJECTION_CACHE_SIZE', 128))
+
+
+def get_layout(version: StructureVersion) -> Layout:
+    layout = layouts.get(version.pk)
+    if layout is None:
+        layout = Layout(version)
+        layouts.set(version.pk, layout)
+    return layout
+
+
+def upsert(projection: Projection, batch: List[Tuple]) -> None:
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor, get_layout(projection.version).upsert_sql(projection.table), batch)
+
+
+def is_projected(data: Data) -> bool:
+    '''
+    Si la estructura de ``data`` declara una proyección, sin consultar la base
+    de datos: se usa la estructura si está cargada (como en las vistas) o la
+    versión con la que se salvaron los datos, que ``Data.save`` ya cargó
+    '''
+    if not data.structure_id:
+        return False
+    if Data._meta.get_field('structure').is_cached(data):  # pylint: disable=protected-access
+        definition = data.structure.structure
+    else:
+        definition = data.definition.structure if data.definition else {}
+    return bool(definition.get('projection'))
+
+
+def _delete(structure_id: Any, sql: str, params: List[Any]) -> None:
+    table = connection.ops.quote_name(projection_table(structure_id))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {KEY_COLUMN} {sql}', params)
+
+
+def refresh_row(data: Data) -> None:
+    '''
+    Actualiza la fila de ``data`` en la proyección de su estructura, si la
+    tiene. Solo se proyectan las versiones actuales: una enmienda nueva
+    reemplaza la fila de la versión anterior de su árbol.
+    '''
+    if not data.is_head or not is_projected(data):
+        return
+    projection = Projection.objects.select_related('version').filter(structure_id=data.structure_id).first()
+    if projection:
+        if data.parent_id:
+            _delete(data.structure_id, 'IN (SELECT id FROM forge_data WHERE tree_id = %s AND id <> %s)',
+                    [data.tree_id, data.pk])
+        upsert(projection, [get_layout(projection.version).row(data.pk, data.data)])
+
+
+def delete_row(data: Data) -> None:
+    '''
+    Elimina la fila de ``data`` de la proyección. Si era la versión actual de
+    su árbol, se proyecta la que pasa a serlo (ver ``Data.delete``).
+    '''
+    if not data.is_head or not is_projected(data):
+        return
+    projection = Projection.objects.select_related('version').filter(structure_id=data.structure_id).first()
+    if projection:
+        _delete(data.structure_id, '= %s', [data.pk])
+        latest = Data.objects.filter(tree_id=data.tree_id).order_by('-created', '-lft').first()
+        if latest:
+            upsert(projection, [get_layout(projection.version).row(latest.pk, latest.full_data())])
+
+
+def clear(structure_id: Any) -> None:
+    '''
+    Elimina todas las filas de la proyección de una estructura, si la tiene
+    '''
+    if Projection.objects.filter(structure_id=structure_id).exists():
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {connection.ops.quote_name(projection_table(structure_id))}')
+
+
+def drop(structure_id: Any) -> None:
+    with transaction.atomic():
+        Projection.objects.filter(structure_id=structure_id).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(projection_table(structure_id))}')
+
+
+def rebuild(structure: Structure, chunk_size: int = 2000) -> Projection:
+    '''
+    Construye de nuevo la tabla de proyección de ``structure`` con su versión
+    actual. La tabla nueva se llena aparte y reemplaza a la anterior dentro de
+    una transacción; luego se proyectan otra vez los datos modificados
+    mientras se construía.
+    '''
+    layout = get_layout(structure.version)
+    table = projection_table(structure.pk)
+    new_table = f'{table}_new'
+    quote = connection.ops.quote_name
+    started = timezone.now()
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {quote(new_table)}')
+            cursor.execute(layout.create_sql(new_table))
+            upsert_sql = layout.upsert_sql(new_table)
+            batch = []
+            # Las versiones actuales siempre se guardan completas
+            records = Data.objects.filter(structure=structure).current().values_list(
+                'id', 'data').iterator(chunk_size=chunk_size)
+            for data_id, data in records:
+                batch.append(layout.row(data_id, data))
+                if len(batch) >= chunk_size:
+                    execute_values(cursor.cursor, upsert_sql, batch)
+                    batch = []
+            if batch:
+                execute_values(cursor.cursor, upsert_sql, batch)
+            cursor.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+            cursor.execute(f'ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}')
+        projection, _ = Projection.objects.update_or_create(structure=structure,
+                                                            defaults={'version': structure.version})
+
+    for data in Data.objects.filter(structure=structure, last_modified__gte=started).select_related('structure'):
+        refresh_row(data)
+    return projection
+
+
+def sync(structure_id: Any) -> None:
+    '''
+    Construye, reconstruye o elimina la proyección de una estructura según lo
+    que declare su versión actual
+    '''
+    structure = Structure.objects.select_related('version', 'projection').filter(pk=structure_id).first()
+    if structure is None or not structure.structure.get('projection'):
+        drop(structure_id)
+        return
+    projection = getattr(structure, 'projection', None)
+    if projection is None or projection.version_id != structure.version_id:
+        rebuild(structure)
+
+
+def rows(structure: Structure, fields: Optional[List[str]] = None,
+         chunk_size: int = 2000) -> Iterator[Dict[str, Any]]:
+    '''
+    Genera las filas de la proyección de ``structure`` como diccionarios
+    ``columna -> valor`` con los valores ya tipados. Se leen con un cursor del
+    lado del servidor, por lo que no se cargan todas en memoria.
+    '''
+    projection = Projection.objects.get(structure=structure)
+    quote = connection.ops.quote_name
+    columns = [KEY_COLUMN] + list(fields or [column for _, column, _, _ in get_layout(projection.version).columns])
+    sql = f'SELECT {", ".join(quote(column) for column in columns)} FROM {quote(projection.table)}'
+
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for row in chunk:
+                yield dict(zip(columns, row))
@@ -2,6 +2,26 @@ from collections import OrderedDict
 
 from django import forms
 
+# Tipos de campo incluidos en forge: tipo -> (clase del campo, widget)
+BUILTIN_FIELDS = {
+    'text': (forms.CharField, None),
+    'textarea': (forms.CharField, forms.Textarea()),
+    'email': (forms.EmailField, None),
+    'radio': (forms.ChoiceField, forms.RadioSelect()),
+    'select': (forms.ChoiceField, None),
+    'multiselect': (forms.MultipleChoiceField, None),
+    'date': (forms.DateField, forms.SelectDateWidget(attrs={'type': 'date'})),
+    'datetime': (forms.DateTimeField, forms.DateTimeInput(attrs={'type': 'datetime-local'})),
+    'duration': (forms.DurationField, None),
+    'time': (forms.TimeField, forms.TimeInput(attrs={'type': 'time'})),
+    'integer': (forms.IntegerField, None),
+    'decimal': (forms.DecimalField, None),
+    'file': (forms.FileField, None),
+    'filepath': (forms.FilePathField, None),
+    'image': (forms.ImageField, None),
+    'checkbox': (forms.BooleanField, forms.CheckboxInput()),
+}
+
 
 class Module:  # pylint: disable=too-few-public-methods
     def __init__(self, name):
@@ -9,6 +29,7 @@ class Module:  # pylint: disable=too-few-public-methods
             raise ValueError('El nombre del módulo no puede estar vacío')
         self.name = name
         self.fields = {}
+        self.registry = None
 
     def register_field(self, field_name, field_type, widget=None):
 
@@ -18,6 +39,8 @@ class Module:  # pylint: disable=too-few-public-methods
             raise TypeError('El campo a registrar debe ser una subclase de django.forms.Field')
         if widget and not issubclass(widget, forms.Widget):
             raise TypeError('El widget debe ser una subclase de django.forms.Widget')
+        if self.registry is not None:
+            self.registry.check_field_name(field_name, self)
 
         new_field = {
             'field_type': field_type,
@@ -26,10 +49,24 @@ class Module:  # pylint: disable=too-few-public-methods
 
         self.fields[field_name] = new_field
 
+        # Si el módulo ya está registrado los tipos de campo disponibles cambiaron
+        if self.registry is not None:
+            self.registry.index_field(field_name, new_field)
+
 
 class Registry(OrderedDict):
     look_into = 'forge'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Se incrementa cada vez que cambian los tipos de campo registrados.
+        # Permite a quien compile algo a partir del registro saber cuándo
+        # debe volver a hacerlo.
+        self.generation = 0
+        # Índice de todos los tipos de campo disponibles, incluidos los de los
+        # módulos: tipo -> (clase del campo, widget)
+        self.field_index = dict(BUILTIN_FIELDS)
+
     def autodiscover(self, apps):
         for app in apps:
             try:
@@ -39,7 +76,50 @@ class Registry(OrderedDict):
                 pass
 
     def register(self, data):
+        if data.name in self:
+            self.unregister(data.name)
+        for field_name in data.fields:
+            self.check_field_name(field_name, data)
+
+        data.registry = self
         self[data.name] = data
+        for field_name, field in data.fields.items():
+            self.index_field(field_name, field)
+
+    def unregister(self, name):
+        module = self.pop(name)
+        module.registry = None
+        for field_name in module.fields:
+            del self.field_index[field_name]
+        self.generation += 1
+
+    def check_field_name(self, field_name, module):
+        '''
+        Comprueba que el tipo de campo no esté ya registrado por forge o por
+        otro módulo
+        '''
+        own_field = module.registry is self and field_name in module.fields
+        if field_name in self.field_index and not own_field:
+            raise ValueError(f'El tipo de campo {field_name} ya está registrado')
+
+    def index_field(self, field_name, field):
+        self.field_index[field_name] = (field['field_type'], field['widget'])
+        self.generation += 1
+
+    def resolve(self, field_type):
+        '''
+        Devuelve la clase del campo y el widget correspondientes al tipo de campo
+        '''
+        try:
+            return self.field_index[field_type]
+        except (KeyError, TypeError):
+            raise ValueError('Wrong or not implemented field type')
+
+    def field_types(self):
+        '''
+        Devuelve los nombres de todos los tipos de campo registrados por los módulos
+        '''
+        return [field_type for module in self.values() for field_type in module.fields]
 
 
 modules = Registry()
@@ -0,0 +1,108 @@
+'''
+Búsqueda de texto completo sobre ``forge.models.Data``.
+
+Cada instancia de ``Data`` tiene en ``search_vector`` un ``tsvector`` construido
+con el texto de sus campos de texto (``text``, ``textarea`` y ``email``) y las
+etiquetas de los valores de sus campos de selección. El vector se calcula al
+salvar los datos, por lo que siempre está al día, y se consulta con
+``DataQuerySet.search``::
+
+    Data.objects.for_structure(structure).search('ana pérez')
+
+La configuración de búsqueda se toma de ``FORGE_SEARCH_CONFIG``; si se cambia,
+los vectores existentes deben calcularse de nuevo con ``update_vectors``.
+'''
+from typing import Any, Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import Value
+from psycopg2.extras import execute_values
+
+from .utils import LRUCache
+
+# Por defecto no se usan reglas de un idioma: lo que más se busca son nombres
+SEARCH_CONFIG = getattr(settings, 'FORGE_SEARCH_CONFIG', 'simple')
+
+TEXT_TYPES = {'text', 'textarea', 'email'}
+CHOICE_TYPES = {'radio', 'select', 'multiselect'}
+
+
+def _choice_labels(choices: List) -> Dict[str, str]:
+    labels = {}
+    for value, label in choices:
+        # Grupos de opciones: [grupo, [[valor, etiqueta], ...]]
+        if isinstance(label, (list, tuple)):
+            labels.update(_choice_labels(label))
+        else:
+            labels[str(value)] = str(label)
+    return labels
+
+
+class SearchDocument:
+    '''
+    Extrae de los datos de una estructura el texto que se indexa para la
+    búsqueda, en el orden de sus campos.
+    '''
+
+    def __init__(self, fields: list) -> None:
+        # Nombre del campo -> etiquetas de sus opciones, o None si es de texto
+        self.fields: List[Tuple[str, Any]] = []
+        for field in fields:
+            if field['type'] in TEXT_TYPES:
+                self.fields.append((field['name'], None))
+            elif field['type'] in CHOICE_TYPES:
+                choices = field.get('options', {}).get('choices', [])
+                self.fields.append((field['name'], _choice_labels(choices)))
+
+    def text(self, data: Dict[str, Any]) -> str:
+        words = []
+        for name, labels in self.fields:
+            value = data.get(name)
+            if value in (None, '', []):
+                continue
+            if labels is None:
+                words.append(str(value))
+            else:
+                for choice in value if isinstance(value, list) else [value]:
+                    words.append(labels.get(str(choice), str(choice)))
+        return ' '.join(words)
+
+
+documents = LRUCache(getattr(settings, 'FORGE_SEARCH_CACHE_SIZE', 128))
+
+
+def get_document(structure: Any) -> SearchDocument:
+    key = (structure.id, getattr(structure, 'last_modified', None))
+    document = documents.get(key)
+    if document is None:
+        document = SearchDocument(structure.structure['fields'])
+        documents.set(key, document)
+    return document
+
+
+def search_vector(text: str) -> SearchVector:
+    '''
+    Expresión que calcula el ``tsvector`` de ``text`` al salvar un modelo
+    '''
+    return SearchVector(Value(text), config=SEARCH_CONFIG)
+
+
+def update_vectors(document: SearchDocument, rows: Iterable[Tuple[Any, Dict]], chunk_size: int = 2000) -> None:
+    '''
+    Calcula de nuevo el vector de búsqueda de las filas ``(id, data)`` de
+    ``forge_data``, en lotes de ``chunk_size`` filas.
+    '''
+    config = SEARCH_CONFIG.replace("'", "''")
+    sql = (f"UPDATE forge_data SET search_vector = to_tsvector('{config}'::regconfig, v.document) "
+           'FROM (VALUES %s) AS v(id, document) WHERE forge_data.id = v.id::uuid')
+    batch = []
+    with connection.cursor() as cursor:
+        for data_id, data in rows:
+            batch.append((str(data_id), document.text(data)))
+            if len(batch) >= chunk_size:
+                execute_values(cursor.cursor, sql, batch, page_size=chunk_size)
+                batch = []
+        if batch:
+            execute_values(cursor.cursor, sql, batch, page_size=chunk_size)
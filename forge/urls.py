@@ -25,6 +25,12 @@ urlpatterns = [
          views.DataUpdate.as_view(), name='update_data'),
     path('d/<slug:slug>/update/<str:action>/<uuid:pk>',
          views.DataUpdate.as_view(), name='amend_data'),
+    path('d/<slug:slug>/lock/<uuid:pk>',
+         views.renew_data_lock, name='renew_data_lock'),
+    path('d/<slug:slug>/search/<uuid:pk>',
+         views.DataSearch.as_view(), name='search_data'),
+    path('d/<slug:slug>/export/<str:export_format>/<uuid:pk>',
+         views.DataExport.as_view(), name='export_data'),
     path('d/<slug:slug>/delete/<uuid:pk>',
          views.DataDelete.as_view(), name='delete_data'),
     path('d/<slug:slug>/<uuid:pk>/',
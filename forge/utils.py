@@ -1,26 +1,101 @@
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Iterable, List
+
+from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Model
 
 
-def acquire_lock(user: Model, resource: Model) -> None:
-    key = f'lock:{resource.pk}'
-    if not cache.set(key, user.pk, 60 * 15, nx=True):
-        raise ResourceAlreadyBlocked('El recurso se encuentra bloqueado por otra persona.')
+# Las generaciones expiran si el objeto no cambia en este tiempo, que debe ser
+# mayor que el de cualquier entrada que dependa de ellas: al expirar vuelven a
+# 0 y una entrada anterior de la generación 0 no debe seguir existiendo
+GENERATION_TIMEOUT = getattr(settings, 'FORGE_GENERATION_TIMEOUT', 7 * 24 * 60 * 60)
+
+
+def generation_key(pk: Any) -> str:
+    return f'generation:{pk}'
+
+
+def get_generation(pk: Any) -> int:
+    '''
+    Generación en la caché del objeto con identificador ``pk``. Forma parte de
+    las llaves de lo que se guarda en la caché a partir del objeto, de modo que
+    al cambiar (``bump_generation``) las entradas anteriores dejan de usarse y
+    expiran solas.
+    '''
+    return cache.get(generation_key(pk), 0)
+
+
+def bump_generation(pk: Any) -> int:
+    return bump_generations([pk])[0]
+
+
+def bump_generations(pks: Iterable[Any]) -> List[int]:
+    '''
+    Aumenta la generación de varios objetos en un solo viaje a redis y renueva
+    su expiración. Devuelve las generaciones nuevas.
+    '''
+    pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+    for pk in pks:
+        key = cache.client.make_key(generation_key(pk))
+        pipeline.incr(key)
+        pipeline.expire(key, GENERATION_TIMEOUT)
+    return pipeline.execute()[::2]
+
+
+def data_version_key(structure_pk: Any) -> str:
+    return f'data-version:{structure_pk}'
+
+
+def get_data_version(structure_pk: Any) -> str:
+    '''
+    Versión de los datos de la estructura con identificador ``structure_pk``,
+    que cambia (``bump_data_versions``) una vez que se confirma cualquier
+    escritura en ellos. Las versiones son aleatorias, por lo que si expira se
+    crea otra que no coincide con ninguna anterior.
+    '''
+    key = cache.client.make_key(data_version_key(structure_pk))
+    pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+    pipeline.set(key, uuid.uuid4().hex, nx=True, ex=GENERATION_TIMEOUT)
+    pipeline.get(key)
+    return pipeline.execute()[1].decode()
+
+
+def bump_data_versions(structure_pks: Iterable[Any]) -> None:
+    pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+    for pk in structure_pks:
+        pipeline.set(cache.client.make_key(data_version_key(pk)), uuid.uuid4().hex, ex=GENERATION_TIMEOUT)
+    pipeline.execute()
 
 
-def release_lock(user: Model, resource: Model) -> None:
-    key = f'lock:{resource.pk}'
-    user_that_locked = cache.get(key)
-    if user_that_locked:
-        if user.pk == user_that_locked:
-            cache.delete_pattern(key)
-        else:
-            raise UserDoesNotOwnTheLock('Este recurso no fue bloqueado por el usuario actual.')
+class LRUCache:
+    '''
+    Caché LRU en memoria y acotada a ``max_size`` elementos. Cada proceso tiene
+    la suya; se usa para guardar lo que se compila a partir de una versión de
+    una estructura (clases de formulario, codecs, etc.)
+    '''
 
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = Lock()
 
-class ResourceAlreadyBlocked(Exception):
-    pass
+    def get(self, key: Any) -> Any:
+        with self.lock:
+            try:
+                self.items.move_to_end(key)
+            except KeyError:
+                return None
+            return self.items[key]
 
+    def set(self, key: Any, value: Any) -> None:
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
 
-class UserDoesNotOwnTheLock(Exception):
-    pass
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
@@ -1,12 +1,18 @@
 '''
 Validaciones
 '''
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
-from typing import Dict, List
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from django.core.exceptions import ValidationError
 from jsonschema import Draft4Validator
 
+from .registries import modules
+
 # Missing properties:
 # - widget
 # - error_messages
@@ -16,6 +22,8 @@ BASE_FIELD = {
     'properties': {
         'type': {'enum': []},
         'name': {'type': 'string'},
+        # Crea un índice sobre el campo en ``forge_data`` (ver ``forge.indexes``)
+        'indexed': {'type': 'boolean'},
         'options': {
             'type': 'object',
             'properties': {
@@ -152,6 +160,10 @@ SCHEMA = {
     'description': 'schema for a form',
     'type': 'object',
     'properties': {
+        # Mantiene una tabla con los datos de la estructura (ver ``forge.projections``)
+        'projection': {'type': 'boolean'},
+        # Las enmiendas se almacenan como diferencias con sus padres (ver ``forge.patches``)
+        'delta': {'type': 'boolean'},
         'fields': {
             'type': 'array',
             'minItems': 1,
@@ -164,19 +176,129 @@ SCHEMA = {
 }
 
 
-def validate_structure(structure: Dict) -> None:
+FIELDS_BY_TYPE = OrderedDict((field['properties']['type']['enum'][0], field) for field in ALL_FIELDS)
+
+# Estructura sin la validación de cada campo. Los campos se validan por
+# separado contra el esquema que corresponde a su tipo.
+ROOT_SCHEMA = deepcopy(SCHEMA)
+ROOT_SCHEMA['properties']['fields']['items'] = {}  # type: ignore
+
+INCORRECT_TYPE = 'Incorrect type of field'
+
+
+def custom_field_schema(field_type: str) -> Dict:
+    '''
+    Esquema para un tipo de campo registrado mediante ``forge.registries.Module``.
+    Solo admite las opciones comunes a todos los campos.
+    '''
+    schema = deepcopy(BASE_FIELD)
+    schema['properties']['type']['enum'].append(field_type)  # type: ignore
+    return schema
+
+
+class StructureValidator:
+    '''
+    Validador de estructuras que se construye una sola vez. En lugar de probar
+    cada campo contra todos los esquemas (``anyOf``), selecciona directamente el
+    esquema que corresponde al ``type`` del campo, por lo que el costo de
+    validar una estructura es lineal con respecto a su cantidad de campos.
+    '''
+
+    def __init__(self, field_schemas: Dict[str, Dict]) -> None:
+        self.root_validator = Draft4Validator(ROOT_SCHEMA)
+        self.field_validators = {field_type: Draft4Validator(schema)
+                                 for field_type, schema in field_schemas.items()}
+        # Los campos sin un tipo conocido se validan contra el esquema base,
+        # que solo indica que el tipo es incorrecto
+        unknown_field = deepcopy(BASE_FIELD)
+        unknown_field['properties']['type']['enum'] = list(field_schemas)  # type: ignore
+        self.unknown_validator = Draft4Validator(unknown_field)
+
+    def iter_errors(self, structure: Any) -> Iterator[Tuple[Tuple, str]]:
+        '''
+        Genera pares ``(ruta, mensaje)`` con cada error encontrado. La ruta es una
+        tupla con la posición del error dentro de la estructura, por ejemplo
+        ``('fields', 3, 'options')``.
+        '''
+        root_errors = list(self.root_validator.iter_errors(structure))
+        for error in root_errors:
+            yield tuple(error.absolute_path), error.message
+        if root_errors:
+            return
+
+        for index, field in enumerate(structure['fields']):
+            field_type = field.get('type') if isinstance(field, dict) else None
+            try:
+                validator = self.field_validators[field_type]
+            except (KeyError, TypeError):
+                validator = self.unknown_validator
+            for error in validator.iter_errors(field):
+                message = INCORRECT_TYPE if 'is not one of' in error.message else error.message
+                yield ('fields', index) + tuple(error.absolute_path), message
+
+    def messages(self, structure: Any) -> List[str]:
+        return sorted(set(message for _, message in self.iter_errors(structure)))
+
+
+_VALIDATOR: Dict[str, Any] = {'generation': None, 'validator': None}
+
+
+def get_validator() -> StructureValidator:
+    '''
+    Devuelve el validador de estructuras, compilándolo de nuevo solo si han
+    cambiado los tipos de campo registrados por los módulos.
+    '''
+    if _VALIDATOR['generation'] != modules.generation:
+        field_schemas = OrderedDict(FIELDS_BY_TYPE)
+        for field_type in modules.field_types():
+            field_schemas.setdefault(field_type, custom_field_schema(field_type))
+        _VALIDATOR['validator'] = StructureValidator(field_schemas)
+        _VALIDATOR['generation'] = modules.generation
+    return _VALIDATOR['validator']
 
-    validator = Draft4Validator(SCHEMA)
-    errors = list(validator.iter_errors(structure))
 
-    if errors:
-        messages: List
-        if len(errors) > 1:
-            messages = list(set(context.message for error in errors for context in error.context))
-            valid_messages = [message for message in messages if not 'is not one of' in message]
-            if len(messages) != len(valid_messages):
-                valid_messages.append('Incorrect type of field')
-        else:
-            valid_messages = [errors[0].message]
+def validate_structure(structure: Dict) -> None:
 
-        raise ValidationError([ValidationError(message) for message in sorted(valid_messages)])
+    messages = get_validator().messages(structure)
+
+    if messages:
+        raise ValidationError([ValidationError(message) for message in messages])
+
+
+def _structure_errors(structure: Any) -> List[Tuple[Tuple, str]]:
+    return list(get_validator().iter_errors(structure))
+
+
+def validate_structures(structures: Iterable[Any], processes: Optional[int] = None,
+                        batch_size: int = 256) -> Iterator[Tuple[int, List[Tuple[Tuple, str]]]]:
+    '''
+    Valida una secuencia de estructuras sin tocar la base de datos. Genera, en
+    el mismo orden de entrada, una tupla ``(índice, errores)`` por estructura,
+    donde ``errores`` es la lista de pares ``(ruta, mensaje)`` de
+    ``StructureValidator.iter_errors``; una lista vacía indica que es válida.
+
+    Las estructuras se consumen por lotes de ``batch_size`` y cada lote se
+    reparte entre ``processes`` procesos (por defecto uno por núcleo). Con
+    ``processes=1`` todo se valida en el proceso actual.
+    '''
+    structures = iter(structures)
+    index = 0
+    processes = processes or os.cpu_count() or 1
+
+    executor = ProcessPoolExecutor(processes) if processes > 1 else None
+    try:
+        while True:
+            batch = list(islice(structures, batch_size))
+            if not batch:
+                break
+            if executor:
+                chunksize = max(1, len(batch) // processes)
+                results = executor.map(_structure_errors, batch, chunksize=chunksize)
+            else:
+                results = map(_structure_errors, batch)
+            for errors in results:
+                yield index, errors
+                index += 1
+    finally:
+        if executor:
+            executor.shutdown()
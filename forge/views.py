@@ -2,33 +2,99 @@
 Vistas de la aplicación.
 '''
 # pylint: disable=too-many-ancestors
-from copy import deepcopy
-from typing import Any
+from itertools import chain
+from typing import Any, Dict, Optional, Tuple
 from uuid import UUID
 
+from django.conf import settings
+
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.messages.views import SuccessMessageMixin
+from django.core.exceptions import ValidationError
 from django.db import transaction, DatabaseError
-from django.http import HttpRequest, HttpResponse
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
 from django.shortcuts import get_object_or_404, redirect, render
-from django.urls import reverse_lazy
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import require_POST
 from django.views.generic import (CreateView, DeleteView, DetailView, ListView,
                                   UpdateView, View)
 
-from .decorators import cache_page
-from .forms import DynamicForm
-from .models import Data, Structure
-from .utils import (acquire_lock, release_lock,
+from .codec import get_codec
+from .decorators import cache_page, conditional
+from .export import CONTENT_TYPES, export
+from .forms import DynamicForm, get_form_class, iter_form_html, render_unbound_form
+from .locks import (LEASE, UNRENEWED_LEASE, acquire_lock, check_lock, release_lock, renew_lock,
                     ResourceAlreadyBlocked, UserDoesNotOwnTheLock)
+from .models import Data, Structure
+from .utils import get_data_version
+
+FORM_MARKER = '<!-- forge:form -->'
+
+
+def render_form(request: HttpRequest, structure: Structure, context: Dict[str, Any],
+                form: DynamicForm = None) -> HttpResponseBase:
+    '''
+    Renderiza ``forge/form.html`` con el formulario de ``structure``. Si no se
+    pasa ``form`` se usa el html cacheado del formulario vacío.
+
+    Las estructuras con al menos ``FORGE_STREAMING_THRESHOLD`` campos se envían
+    por partes en un ``StreamingHttpResponse``: primero la cabecera de la
+    página, luego los campos en bloques de ``FORGE_STREAMING_CHUNK_SIZE`` y
+    por último el resto de la página.
+    '''
+    context = dict(context, form=form)
+    if len(structure.structure['fields']) < getattr(settings, 'FORGE_STREAMING_THRESHOLD', 1000):
+        if form is None:
+            context['form_html'] = render_unbound_form(structure)
+        return render(request, 'forge/form.html', context)
+
+    context['form_html'] = mark_safe(FORM_MARKER)
+    head, tail = render_to_string('forge/form.html', context, request).split(FORM_MARKER, 1)
+    if form is None:
+        body = [render_unbound_form(structure)]
+    else:
+        body = iter_form_html(form, getattr(settings, 'FORGE_STREAMING_CHUNK_SIZE', 100))
+    return StreamingHttpResponse(chain([head], body, [tail]))
+
 
 #############################
 #  Structure-related views  #
 #############################
 
 
+def preview_state(slug: str, pk: UUID) -> Optional[Tuple]:  # pylint: disable=unused-argument
+    return Structure.objects.filter(pk=pk).values_list('last_modified').first()
+
+
+def structure_state(slug: str, pk: UUID) -> Optional[Tuple]:  # pylint: disable=unused-argument
+    '''
+    Los detalles de una estructura muestran el árbol de sus datos, que cambia
+    al crear, modificar o eliminar cualquiera de ellos (ver
+    ``forge.utils.get_data_version``)
+    '''
+    state = Structure.objects.filter(pk=pk).values_list('last_modified').first()
+    return state and state + (get_data_version(pk),)
+
+
+def data_state(slug: str, pk: UUID) -> Optional[Tuple]:  # pylint: disable=unused-argument
+    '''
+    Los detalles de unos datos muestran el nombre de su estructura y el enlace
+    a la versión actual de su árbol
+    '''
+    head = Data.objects.filter(tree_id=OuterRef('tree_id'), is_head=True).values('id')[:1]
+    return Data.objects.filter(pk=pk).annotate(head=Subquery(head)).values_list(
+        'last_modified', 'structure__last_modified', 'head').first()
+
+
 @login_required
+@conditional(preview_state)
 @cache_page(60 * 60)
 def preview_structure(request: HttpRequest, slug: str, pk: UUID) -> HttpResponse:  # pylint: disable=unused-argument, invalid-name
     '''
@@ -36,9 +102,8 @@ def preview_structure(request: HttpRequest, slug: str, pk: UUID) -> HttpResponse
     controles para hacerle submit.
     '''
     structure = Structure.objects.get(pk=pk)
-    form = DynamicForm(structure=structure)
-    return render(request, 'forge/form.html',
-                  {'form': form, 'object': structure, 'is_structure': True, 'is_preview': True})
+    return render_form(request, structure.definition,
+                       {'object': structure, 'is_structure': True, 'is_preview': True})
 
 
 class StructureCreate(UserPassesTestMixin, SuccessMessageMixin, CreateView):
@@ -72,14 +137,9 @@ class StructureUpdate(LoginRequiredMixin, SuccessMessageMixin, UpdateView):
     model = Structure
     fields = ('name', 'module', 'structure',)
     success_message = 'Estructura actualizada correctamente.'
-    warning_message = 'La estructura ha cambiado. Es posible que las instancias no se renderizen correctamente'
-
-    def form_valid(self, form: DynamicForm) -> bool:
-        if self.object.data_set.count():
-            messages.warning(self.request, self.warning_message)
-        return super().form_valid(form)
 
 
+@method_decorator(conditional(structure_state), name='get')
 class StructureDetails(LoginRequiredMixin, DetailView):
     '''
     Vista para mostrar los detalles de una instancia de
@@ -122,75 +182,110 @@ class StructureDelete(UserPassesTestMixin, DeleteView):
 class DataCreate(LoginRequiredMixin, View):
     form_class = DynamicForm
     structure: Structure
+    definition: Any
     success_message = 'Los datos se han guardado correctamente.'
     error_message = 'Error validando el formulario. Revise los campos marcados'
 
     def dispatch(self, request: HttpRequest, slug: str, pk: UUID, *args: Any, **kwargs: Any) -> HttpResponse:  # pylint: disable=arguments-differ, unused-argument
-        self.structure = Structure.objects.get(pk=pk)
+        self.structure = Structure.objects.select_related('version').get(pk=pk)
+        self.definition = self.structure.definition
+        self.form_class = get_form_class(self.definition)
         return super().dispatch(request, *args, **kwargs)
 
     def get(self, request: HttpRequest) -> HttpResponse:
-        form = self.form_class(structure=self.structure)
-        return render(request, 'forge/form.html',
-                      {'form': form, 'object': self.structure, 'is_new': True})
+        return render_form(request, self.definition, {'object': self.structure, 'is_new': True})
 
     def post(self, request: HttpRequest) -> HttpResponse:
-        form = self.form_class(request.POST, structure=self.structure)
+        form = self.form_class(request.POST)
         if form.is_valid():
-            data = Data.objects.create(created_by=request.user, structure_id=self.structure.id,
-                                       data=form.cleaned_data)
+            data = Data(created_by=request.user, structure=self.structure, structure_version=self.structure.version,
+                        data=get_codec(self.definition).encode(form.cleaned_data))
             try:
-                data.save()
+                # El formulario ya validó los datos: se insertan con una sola
+                # sentencia, sin validar de nuevo el modelo
+                data.save(clean=False, force_insert=True)
             except DatabaseError as error:
                 self.error_message = error
             else:
                 messages.success(request, self.success_message)
                 return redirect(data.get_absolute_url())
         messages.error(request, self.error_message)
-        return render(request, 'forge/form.html',
-                      {'form': form, 'object': self.structure,
-                       'is_new': True, 'is_structure': True})  # Technically we are still on a structure page
+        return render_form(request, self.definition,
+                           {'object': self.structure, 'is_new': True,
+                            'is_structure': True}, form)  # Technically we are still on a structure page
 
 
 class DataUpdate(LoginRequiredMixin, View):
     '''
-    Vista para actualizar una instancia de ``forge.models.Data``
+    Vista para actualizar una instancia de ``forge.models.Data``. Mientras se
+    editan, los datos están bloqueados (ver ``forge.locks``): el formulario
+    envía el token del bloqueo en ``lock_param`` y la página lo renueva con
+    ``renew_data_lock``. Los cambios solo se guardan si el token sigue vigente.
     '''
     form_class = DynamicForm
     data_object: Data
+    definition: Any
     resource_locked: Data
     amend: bool
+    # Empieza con "_" para que no coincida con el nombre de un campo
+    lock_param = '_lock'
     success_message = 'Los datos se han actualizado correctamente.'
     error_message = 'Error validando el formulario. Revise los campos marcados'
+    lock_lost_message = 'El bloqueo de los datos expiró o lo tomó otra persona. Vuelva a editarlos.'
 
     def dispatch(self, request: HttpRequest, slug: str, pk: UUID, *args: Any, **kwargs: Any) -> HttpResponse:  # pylint: disable=arguments-differ, unused-argument
-        self.data_object = get_object_or_404(Data, id=pk)
+        self.data_object = get_object_or_404(Data.objects.select_related('structure', 'structure_version'), id=pk)
         self.amend = bool(request.GET.get('amend', False))
+        # Los datos se editan con la versión de la estructura con la que se capturaron
+        self.definition = self.data_object.definition
+        self.form_class = get_form_class(self.definition)
         return super().dispatch(request, *args, **kwargs)
 
+    def get_context(self, token: Any) -> Dict[str, Any]:
+        return {
+            'object': self.data_object,
+            'lock_param': self.lock_param,
+            'lock_token': token,
+            'lock_lease': LEASE,
+            'lock_url': reverse('forge:renew_data_lock',
+                                kwargs={'slug': self.data_object.structure.slug, 'pk': self.data_object.pk}),
+        }
+
     def get(self, request: HttpRequest) -> HttpResponse:
         try:
-            acquire_lock(request.user, self.data_object)
+            token = acquire_lock(request.user, self.data_object)
         except ResourceAlreadyBlocked as info:
             messages.info(request, info)
             return redirect(self.data_object.get_absolute_url())
-        form = self.form_class(data=self.data_object.data, structure=self.data_object.structure)
-        return render(request, 'forge/form.html',
-                      {'form': form, 'object': self.data_object})
+        # Los datos almacenados se decodifican directamente, sin validarlos de nuevo
+        form = self.form_class(initial=get_codec(self.definition).decode(self.data_object.full_data()))
+        return render_form(request, self.definition, self.get_context(token), form)
 
     def post(self, request: HttpRequest) -> HttpResponse:
+        token = request.POST.get(self.lock_param)
+        # El bloqueo solo depende del identificador de los datos
+        self.resource_locked = self.data_object
         try:
             with transaction.atomic():
-                form = self.form_class(data=request.POST, structure=self.data_object.structure)
+                form = self.form_class(data=request.POST)
                 if form.is_valid():
-                    self.resource_locked = deepcopy(self.data_object)
-                    self.data_object.data = form.cleaned_data
+                    # Si el bloqueo expiró otra persona pudo tomarlo y modificar los datos.
+                    # ``fence`` lo comprueba de nuevo en la base de datos, por si expira
+                    # antes de que se confirme la transacción
+                    if (not check_lock(request.user, self.data_object, token)
+                            or not Data.objects.fence(self.data_object.pk, int(token))):
+                        raise UserDoesNotOwnTheLock(self.lock_lost_message)
+                    data = get_codec(self.definition).encode(form.cleaned_data)
                     if self.amend:
-                        amended_data = Data(created_by=request.user, structure=self.data_object.structure,
-                                            data=self.data_object.data, parent=self.data_object)
-                        self.data_object = amended_data
+                        self.data_object = Data(created_by=request.user, structure=self.data_object.structure,
+                                                structure_version=self.data_object.structure_version,
+                                                data=data, parent=self.data_object)
+                    else:
+                        self.data_object.data = data
+                        self.data_object.lock_token = int(token)
                     try:
-                        self.data_object.save()
+                        # Igual que en ``DataCreate``, sin validar de nuevo el modelo
+                        self.data_object.save(clean=False, force_insert=self.amend)
                     except DatabaseError as error:
                         self.error_message = error
                     else:
@@ -203,16 +298,108 @@ class DataUpdate(LoginRequiredMixin, View):
             return redirect(self.resource_locked.get_absolute_url())
 
         messages.error(request, self.error_message)
-        return render(request, 'forge/form.html',
-                      {'form': form, 'object': self.data_object})
+        return render_form(request, self.definition, self.get_context(token), form)
+
+
+@login_required
+@require_POST
+def renew_data_lock(request: HttpRequest, slug: str, pk: UUID) -> HttpResponse:  # pylint: disable=unused-argument, invalid-name
+    '''
+    Renueva el bloqueo de los datos que se editan. Responde 409 si el token
+    ya no es el vigente.
+    '''
+    data_object = get_object_or_404(Data.objects.only('id'), pk=pk)
+    if renew_lock(request.user, data_object, request.POST.get(DataUpdate.lock_param)):
+        return HttpResponse(status=204)
+    return HttpResponse(status=409)
+
+
+class DataSearch(LoginRequiredMixin, ListView):
+    '''
+    Vista para buscar las instancias de ``forge.models.Data`` de una estructura
+    por el valor de sus campos. Los valores se toman de los parámetros GET y la
+    búsqueda se resuelve con ``DataQuerySet.where``. El parámetro
+    ``search_param`` se busca además como texto completo
+    (``DataQuerySet.search``) y los resultados se ordenan por relevancia.
+    '''
+    template_name = 'forge/data_search.html'
+    paginate_by = 50
+    # Empieza con "_" para que no coincida con el nombre de un campo
+    search_param = '_q'
+    structure: Structure
+    definition: Any
+    error_message = 'Valor incorrecto para el campo {field}: {error}'
 
+    def dispatch(self, request: HttpRequest, slug: str, pk: UUID, *args: Any, **kwargs: Any) -> HttpResponse:  # pylint: disable=arguments-differ, unused-argument
+        self.structure = get_object_or_404(Structure, pk=pk)
+        self.definition = self.structure.definition
+        self.form_class = get_form_class(self.definition)
+        return super().dispatch(request, *args, **kwargs)
 
+    def get_conditions(self) -> Dict[str, Any]:
+        conditions = {}
+        for name, field in self.form_class.base_fields.items():
+            value = field.widget.value_from_datadict(self.request.GET, {}, name)
+            # Una casilla sin marcar no se toma como criterio de búsqueda
+            if value in field.empty_values or value is False:
+                continue
+            try:
+                conditions[name] = field.clean(value)
+            except ValidationError as error:
+                messages.error(self.request, self.error_message.format(field=name, error=' '.join(error.messages)))
+        return conditions
+
+    def get_queryset(self) -> Any:
+        self.conditions = self.get_conditions()
+        self.text = self.request.GET.get(self.search_param, '').strip()
+        queryset = Data.objects.for_structure(self.structure).current().where(
+            get_codec(self.definition).encode(self.conditions))
+        return queryset.search(self.text) if self.text else queryset
+
+    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context['object'] = self.structure
+        context['form'] = self.form_class(initial=self.conditions, use_required_attribute=False)
+        context['search_param'] = self.search_param
+        context['text'] = self.text
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context['query'] = query.urlencode()
+        return context
+
+
+class DataExport(LoginRequiredMixin, View):
+    '''
+    Vista para descargar todos los datos de una estructura en CSV o JSONL, o
+    solo sus versiones actuales con ``?current=1``. La respuesta se genera a
+    medida que se leen los datos (ver ``forge.export``)
+    '''
+
+    def get(self, request: HttpRequest, slug: str, export_format: str, pk: UUID) -> HttpResponseBase:  # pylint: disable=unused-argument
+        if export_format not in CONTENT_TYPES:
+            raise Http404
+        structure = get_object_or_404(Structure.objects.select_related('version'), pk=pk)
+        chunk_size = getattr(settings, 'FORGE_EXPORT_CHUNK_SIZE', 2000)
+        current = bool(request.GET.get('current', False))
+        response = StreamingHttpResponse(export(structure, export_format, chunk_size=chunk_size, current=current),
+                                         content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{structure.slug}.{export_format}"'
+        return response
+
+
+@method_decorator(conditional(data_state), name='get')
 class DataDetails(LoginRequiredMixin, DetailView):
     '''
     Vista para mostrar los detalles de una instancia de ``forge.models.Data``
     '''
     model = Data
 
+    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context['current'] = self.object.current_version()
+        context['data'] = self.object.full_data()
+        return context
+
 
 class DataDelete(UserPassesTestMixin, DeleteView):
     '''
@@ -225,7 +412,8 @@ class DataDelete(UserPassesTestMixin, DeleteView):
     def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         data_object = self.get_object()
         try:
-            acquire_lock(request.user, data_object)
+            # La página de confirmación no renueva el bloqueo
+            acquire_lock(request.user, data_object, UNRENEWED_LEASE)
         except ResourceAlreadyBlocked as info:
             messages.info(request, info)
             return redirect(data_object.get_absolute_url())
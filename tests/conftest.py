@@ -0,0 +1,19 @@
+import pytest
+
+from forge.models import Structure
+
+from .fixtures import FULL_STRUCTURE_VALID
+
+
+@pytest.fixture
+def structure_definition():
+    '''
+    Definición de la estructura del fixture ``structure``. Los módulos de
+    pruebas que necesitan otros campos redefinen este fixture.
+    '''
+    return FULL_STRUCTURE_VALID
+
+
+@pytest.fixture
+def structure(admin_user, structure_definition):  # pylint: disable=redefined-outer-name
+    return Structure.objects.create(name='people', created_by=admin_user, structure=structure_definition)
@@ -0,0 +1,68 @@
+import pytest
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+from forge import caching
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    monkeypatch.setattr(caching, 'STATS_ENABLED', True)
+    caching.reset_stats()
+    yield
+    caching.reset_stats()
+
+
+def test_text_compressed(stats):  # pylint: disable=redefined-outer-name,unused-argument
+    html = '<p>It Works</p>' * 100
+    caching.set('form-html', 'form-html:test', html)
+
+    payload = cache.client.get_client().get(cache.client.make_key('form-html:test'))
+    assert payload.startswith(caching.COMPRESSED)
+    assert len(payload) < len(html) / 10
+    assert caching.get('form-html', 'form-html:test') == html
+
+    stats = caching.get_stats()['form-html']
+    assert stats['writes'] == 1 and stats['hits'] == 1 and stats['misses'] == 0
+    assert stats['raw'] == len(html) and stats['written'] == stats['read'] == len(payload)
+
+    cache.delete('form-html:test')
+
+
+def test_small_values_not_compressed():
+    caching.set('data', 'data:test', {'first_name': 'Ana'})
+
+    payload = cache.client.get_client().get(cache.client.make_key('data:test'))
+    assert payload == caching.RAW + b'{"first_name":"Ana"}'
+    assert caching.get('data', 'data:test') == {'first_name': 'Ana'}
+
+    cache.delete('data:test')
+
+
+def test_missing_and_expired(stats):  # pylint: disable=redefined-outer-name,unused-argument
+    assert caching.get('data', 'data:missing', 'default') == 'default'
+    caching.set('data', 'data:missing', {}, timeout=0)
+    assert caching.get('data', 'data:missing') is None
+    assert caching.get_stats()['data']['misses'] == 2
+
+
+def test_stats_disabled():
+    caching.reset_stats()
+    caching.set('data', 'data:test', {'first_name': 'Ana'})
+    assert caching.get('data', 'data:test') == {'first_name': 'Ana'}
+    assert caching.get('data', 'data:missing') is None
+    assert not cache.client.get_client().exists(cache.client.make_key(caching.stats_key('data')))
+
+    cache.delete('data:test')
+
+
+def test_forge_cache_stats(stats, capsys):  # pylint: disable=redefined-outer-name,unused-argument
+    caching.set('cache-page', 'cache-page:test', (0, 0, b'It Works', {}))
+
+    call_command('forge_cache_stats', reset=True)
+    out, _ = capsys.readouterr()
+    assert 'cache-page: 0 aciertos, 0 fallos, 0 bytes leídos, 1 escrituras' in out
+    assert caching.get_stats()['cache-page']['writes'] == 0
+
+    cache.delete('cache-page:test')
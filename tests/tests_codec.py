@@ -0,0 +1,59 @@
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from forge.codec import StructureCodec, get_codec
+
+from .fixtures import FULL_STRUCTURE_VALID
+
+VALUES = {
+    'first_name': 'Ana',
+    'occupation_multiselect': ['engineer', 'farmer'],
+    'date': datetime.date(2017, 3, 4),
+    'datetime': datetime.datetime(2017, 3, 4, 10, 30, tzinfo=datetime.timezone.utc),
+    'duration': datetime.timedelta(hours=1, minutes=2),
+    'time': datetime.time(10, 30),
+    'integer': 7,
+    'decimal': Decimal('6.5'),
+    'file': None,
+    'internet': True,
+}
+
+
+def test_codec_roundtrip():
+    codec = StructureCodec(FULL_STRUCTURE_VALID['fields'])
+
+    encoded = codec.encode(VALUES)
+
+    # El resultado se puede guardar como json sin un encoder especial
+    assert json.loads(json.dumps(encoded)) == encoded
+    assert codec.decode(encoded) == VALUES
+
+
+def test_codec_decodes_django_json_encoder_output():
+    codec = StructureCodec(FULL_STRUCTURE_VALID['fields'])
+    stored = json.loads(json.dumps(VALUES, cls=DjangoJSONEncoder))
+    assert codec.decode(stored) == VALUES
+
+
+def test_codec_keeps_undecodable_values():
+    codec = StructureCodec(FULL_STRUCTURE_VALID['fields'])
+    assert codec.decode({'date': 'not a date', 'decimal': 'nan?', 'unknown': 1}) == {
+        'date': 'not a date', 'decimal': 'nan?', 'unknown': 1}
+
+
+def test_get_codec():
+    class FakeStructure():  # pylint: disable=too-few-public-methods
+        def __init__(self, last_modified):
+            self.id = uuid.uuid4()  # pylint: disable=invalid-name
+            self.structure = FULL_STRUCTURE_VALID
+            self.last_modified = last_modified
+
+    structure = FakeStructure(1)
+    codec = get_codec(structure)
+    assert get_codec(structure) is codec
+    structure.last_modified = 2
+    assert get_codec(structure) is not codec
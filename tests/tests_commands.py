@@ -0,0 +1,193 @@
+import json
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from forge import jobs
+from forge.models import Data, Structure
+
+from .fixtures import FULL_STRUCTURE_VALID
+
+
+@pytest.fixture
+def definitions(tmpdir):
+    source = tmpdir.join('structures.jsonl')
+    source.write('\n'.join(json.dumps(definition) for definition in [
+        {'name': 'valid one', 'structure': FULL_STRUCTURE_VALID},
+        {'name': 'invalid', 'structure': {'fields': [{'name': 'x', 'type': 'nope'}]}},
+        {'name': 'valid two', 'module': 'A demo module', 'structure': FULL_STRUCTURE_VALID},
+    ]))
+    return str(source)
+
+
+@pytest.mark.django_db
+def test_forge_validate_reports_errors(definitions, capsys):  # pylint: disable=redefined-outer-name
+    with pytest.raises(CommandError):
+        call_command('forge_validate', definitions, processes=1)
+    _, err = capsys.readouterr()
+    assert 'fields.0.type: Incorrect type of field' in err
+    assert not Structure.objects.exists()
+
+
+@pytest.mark.django_db
+def test_forge_validate_loads_valid(definitions, admin_user):  # pylint: disable=redefined-outer-name
+    with pytest.raises(CommandError):
+        call_command('forge_validate', definitions, processes=1, load=True, user=admin_user.username)
+    assert sorted(Structure.objects.values_list('slug', flat=True)) == ['valid-one', 'valid-two']
+
+
+@pytest.mark.django_db
+def test_forge_validate_load_enqueues_jobs(definitions, admin_user, monkeypatch):  # pylint: disable=redefined-outer-name
+    enqueued = []
+    monkeypatch.setattr(transaction, 'on_commit', lambda func: func())
+    monkeypatch.setattr(jobs.sync_field_indexes, 'delay', lambda pk: enqueued.append(('indexes', pk)))
+    monkeypatch.setattr(jobs.sync_projection, 'delay', lambda pk: enqueued.append(('projection', pk)))
+    with pytest.raises(CommandError):
+        call_command('forge_validate', definitions, processes=1, load=True, user=admin_user.username)
+    loaded = [str(pk) for pk in Structure.objects.values_list('pk', flat=True)]
+    assert sorted(enqueued) == sorted([(kind, pk) for pk in loaded for kind in ('indexes', 'projection')])
+
+
+@pytest.mark.django_db
+def test_forge_validate_loaded_structures_accept_data(admin_user, tmpdir):
+    definition = {'fields': [{'name': 'first_name', 'type': 'text'}]}
+    source = tmpdir.join('people.jsonl')
+    source.write('\n'.join(json.dumps(item) for item in [definition, definition]))
+    call_command('forge_validate', str(source), processes=1, load=True, user=admin_user.username)
+
+    # Las estructuras sin nombre lo toman del fichero y su posición en él
+    assert sorted(Structure.objects.values_list('slug', flat=True)) == ['people-1', 'people-2']
+    structure = Structure.objects.get(slug='people-1')
+    assert structure.version.structure == definition
+
+    data = tmpdir.join('data.jsonl')
+    data.write(json.dumps({'first_name': 'Ana'}))
+    call_command('forge_import', str(structure.pk), str(data), user=admin_user.username, processes=1)
+    imported = Data.objects.get()
+    assert imported.structure_version == structure.version
+    assert imported.data == {'first_name': 'Ana'}
+
+
+@pytest.fixture
+def structure_definition():
+    optional = {'required': False}
+    return {'fields': [
+        {'name': 'first_name', 'type': 'text'},
+        {'name': 'integer', 'type': 'integer', 'options': optional},
+        {'name': 'occupation_multiselect', 'type': 'multiselect', 'options': {
+            'required': False, 'choices': [['engineer', 'Engineer'], ['farmer', 'Farmer']]}},
+        {'name': 'date', 'type': 'date', 'options': optional},
+    ]}
+
+
+@pytest.mark.django_db
+def test_forge_import_csv(structure, admin_user, tmpdir, capsys):  # pylint: disable=redefined-outer-name
+    source = tmpdir.join('people.csv')
+    parent_id = '7d4a9c8e-2a3b-4c5d-8e9f-0a1b2c3d4e5f'
+    source.write('_id,_parent,first_name,integer,occupation_multiselect,date\n'
+                 f'{parent_id},,Ana,7,engineer|farmer,2000-01-02\n'
+                 ',,Bea,abc,,\n'
+                 f',{parent_id},Ana Maria,8,,\n')
+    with pytest.raises(CommandError):
+        call_command('forge_import', 'people', str(source), user=admin_user.username, processes=1, chunk_size=2)
+    out, err = capsys.readouterr()
+    assert 'people.csv:3 integer' in err
+    assert '2 filas importadas' in out
+    assert not tmpdir.join('people.csv.forge-import').exists()
+
+    parent = Data.objects.get(pk=parent_id)
+    assert parent.data['occupation_multiselect'] == ['engineer', 'farmer']
+    assert parent.data['date'] == '2000-01-02'
+    assert parent.structure_version == structure.version
+    amendment = parent.get_children().get()
+    assert amendment.data['first_name'] == 'Ana Maria'
+    assert list(Data.objects.current()) == [amendment]
+    assert list(Data.objects.for_structure(structure).search('ana')) != []
+
+
+@pytest.mark.django_db
+def test_forge_import_resume(structure, admin_user, tmpdir):  # pylint: disable=redefined-outer-name
+    source = tmpdir.join('people.jsonl')
+    source.write('\n'.join(json.dumps({'first_name': name}) for name in ['a', 'b', 'c']))
+    # Una importación anterior confirmó la primera fila y se interrumpió antes
+    # de guardar su avance
+    call_command('forge_import', str(structure.pk), str(source), user=admin_user.username, processes=1)
+    Data.objects.filter(data__first_name__in=['b', 'c']).delete()
+    tmpdir.join('people.jsonl.forge-import').write(json.dumps({'read': 0}))
+
+    call_command('forge_import', str(structure.pk), str(source), user=admin_user.username, processes=1,
+                 resume=True)
+    assert sorted(data['first_name'] for data in Data.objects.values_list('data', flat=True)) == ['a', 'b', 'c']
+
+
+@pytest.mark.django_db
+def test_forge_import_resume_rebuilds_interrupted_trees(structure, admin_user, tmpdir):  # pylint: disable=redefined-outer-name
+    parent = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'a'})
+    source = tmpdir.join('people.jsonl')
+    source.write('\n'.join(json.dumps(row) for row in [
+        {'first_name': 'b', '_parent': str(parent.pk)}, {'first_name': 'c'}]))
+    # Una importación anterior insertó la enmienda y se interrumpió antes de
+    # reconstruir su árbol
+    call_command('forge_import', str(structure.pk), str(source), user=admin_user.username, processes=1)
+    amendment = Data.objects.get(data__first_name='b')
+    Data.objects.filter(pk=amendment.pk).update(level=0, lft=1, rght=2, is_head=True)
+    Data.objects.filter(data__first_name='c').delete()
+    tmpdir.join('people.jsonl.forge-import').write(json.dumps({'read': 1, 'trees': [parent.tree_id]}))
+
+    call_command('forge_import', str(structure.pk), str(source), user=admin_user.username, processes=1,
+                 resume=True)
+    assert list(Data.objects.get(pk=parent.pk).get_children()) == [amendment]
+    assert list(Data.objects.current().filter(tree_id=parent.tree_id)) == [amendment]
+    assert Data.objects.filter(data__first_name='c').exists()
+
+
+@pytest.mark.django_db
+def test_forge_import_empty_file(structure, admin_user, tmpdir):  # pylint: disable=redefined-outer-name
+    source = tmpdir.join('people.jsonl')
+    source.write('')
+    call_command('forge_import', str(structure.pk), str(source), user=admin_user.username, processes=1)
+    assert not Data.objects.exists()
+
+
+@pytest.mark.django_db
+def test_forge_import_same_name_and_other_trees(structure, admin_user, tmpdir):  # pylint: disable=redefined-outer-name
+    other = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'x'})
+    amendment = Data.objects.create(created_by=admin_user, structure=structure, parent=other,
+                                    data={'first_name': 'y'})
+
+    # Ficheros distintos con el mismo nombre no generan los mismos identificadores
+    for directory, name in [('a', 'Ana'), ('b', 'Bea')]:
+        source = tmpdir.mkdir(directory).join('people.jsonl')
+        source.write('\n'.join(json.dumps(row) for row in [
+            {'first_name': name}, {'first_name': 'z', '_parent': str(amendment.pk)}]))
+        call_command('forge_import', 'people', str(source), user=admin_user.username, processes=1)
+    assert Data.objects.filter(data__first_name__in=['Ana', 'Bea']).count() == 2
+
+    # Las enmiendas importadas quedan en el árbol de su padre
+    amendment.refresh_from_db()
+    imported = amendment.get_children()
+    assert imported.count() == 2
+    assert list(Data.objects.current().filter(tree_id=amendment.tree_id)) == [imported.latest('created')]
+    root = Data.objects.get(pk=other.pk)
+    assert root.tree_id == other.tree_id
+    assert root.get_descendant_count() == 3
+
+
+@pytest.mark.django_db
+def test_forge_export_roundtrip(structure, admin_user, tmpdir):  # pylint: disable=redefined-outer-name
+    parent = Data.objects.create(created_by=admin_user, structure=structure,
+                                 data={'first_name': 'Ana', 'occupation_multiselect': ['engineer', 'farmer']})
+    Data.objects.create(created_by=admin_user, structure=structure, parent=parent, data={'first_name': 'Bea'})
+    target = tmpdir.join('people.csv')
+    call_command('forge_export', 'people', output=str(target))
+
+    other = Structure.objects.create(name='copy', structure=structure.structure, created_by=admin_user)
+    Data.objects.all().delete()
+    call_command('forge_import', 'copy', str(target), user=admin_user.username, processes=1)
+    imported = Data.objects.get(pk=parent.pk)
+    assert imported.structure == other
+    assert imported.data['occupation_multiselect'] == ['engineer', 'farmer']
+    assert [child.data['first_name'] for child in imported.get_children()] == ['Bea']
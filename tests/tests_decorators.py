@@ -1,11 +1,17 @@
+import time
+import uuid
+from datetime import datetime, timezone
+
 import pytest
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.text import slugify
 
-from forge.decorators import cache_page
+from forge import caching
+from forge.decorators import cache_page, conditional
+from forge.utils import bump_generation, generation_key
 
 
 @pytest.fixture
@@ -28,7 +34,13 @@ def test_cache_page_get(rf, fake_url, fake_view):  # pylint: disable=redefined-o
     key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
     response = decorated_view(request)
 
-    assert cache.get(key) == response.content
+    generation, fresh_until, content, headers = caching.get('cache-page', key)
+    assert generation == 0 and fresh_until > time.time()
+    assert (content, headers) == (response.content, {'Content-Type': response['Content-Type']})
+    # La respuesta cacheada conserva las cabeceras de la original
+    cached = decorated_view(request)
+    assert cached.content == response.content
+    assert cached['Content-Type'] == response['Content-Type']
 
     # Cleanup
     cache.delete_pattern(key)
@@ -43,7 +55,154 @@ def test_cache_page_post(rf, fake_url, fake_view):  # pylint: disable=redefined-
     key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
     decorated_view(request)
 
-    assert cache.get(key) is None
+    assert caching.get('cache-page', key) is None
 
     # Cleanup
     cache.delete_pattern(key)
+
+
+def test_cache_page_streaming(rf, fake_url):  # pylint: disable=redefined-outer-name,invalid-name
+    def view(request):  # pylint: disable=unused-argument
+        return StreamingHttpResponse(iter(['It ', 'Works']))
+
+    decorated_view = cache_page(60*60)(view)
+    request = rf.get(fake_url)
+    request.user = User('foo', 'foo@bar.com', 'bar')
+    key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
+    response = decorated_view(request)
+
+    assert b''.join(response.streaming_content) == b'It Works'
+    assert caching.get('cache-page', key) is None
+
+
+def test_cache_page_generation(rf, fake_url):  # pylint: disable=redefined-outer-name,invalid-name
+    calls = []
+
+    def view(request, pk):  # pylint: disable=unused-argument,invalid-name
+        calls.append(pk)
+        return HttpResponse(f'It Works {len(calls)}')
+
+    decorated_view = cache_page(60*60)(view)
+    request = rf.get(fake_url)
+    request.user = User('foo', 'foo@bar.com', 'bar')
+    pk = uuid.uuid4()  # pylint: disable=invalid-name
+
+    assert decorated_view(request, pk=pk).content == b'It Works 1'
+    assert decorated_view(request, pk=pk).content == b'It Works 1'
+    # Cuando el objeto cambia la página se genera de nuevo
+    bump_generation(pk)
+    assert decorated_view(request, pk=pk).content == b'It Works 2'
+
+    cache.delete_pattern(f'cache-page:*{slugify(fake_url)}*')
+    cache.delete(generation_key(pk))
+
+
+def test_conditional(rf, fake_url):  # pylint: disable=redefined-outer-name,invalid-name
+    calls = []
+    state = [datetime(2020, 1, 1, tzinfo=timezone.utc), 1]
+
+    def view(request, pk):  # pylint: disable=unused-argument,invalid-name
+        calls.append(pk)
+        return HttpResponse('It Works')
+
+    decorated_view = conditional(lambda pk: tuple(state))(view)
+    request = rf.get(fake_url)
+    request.user = User(pk=1, username='foo')
+    response = decorated_view(request, pk=1)
+
+    assert response.status_code == 200
+    assert response['Last-Modified'] == 'Wed, 01 Jan 2020 00:00:00 GMT'
+    assert 'private' in response['Cache-Control'] and 'no-cache' in response['Cache-Control']
+
+    request = rf.get(fake_url, HTTP_IF_NONE_MATCH=response['ETag'])
+    request.user = User(pk=1, username='foo')
+    assert decorated_view(request, pk=1).status_code == 304
+    assert len(calls) == 1
+    # La ETag depende del usuario
+    request.user = User(pk=2, username='bar')
+    assert decorated_view(request, pk=1).status_code == 200
+    # y de los valores del objeto
+    state[1] = 2
+    request.user = User(pk=1, username='foo')
+    assert decorated_view(request, pk=1).status_code == 200
+    assert len(calls) == 3
+
+
+def test_conditional_missing_object(rf, fake_url, fake_view):  # pylint: disable=redefined-outer-name,invalid-name
+    decorated_view = conditional(lambda: None)(fake_view)
+    request = rf.get(fake_url)
+    request.user = User(pk=1, username='foo')
+    response = decorated_view(request)
+
+    assert response.status_code == 200
+    assert not response.has_header('ETag')
+
+
+def test_cache_page_stale(rf, fake_url):  # pylint: disable=redefined-outer-name,invalid-name
+    calls = []
+
+    def view(request):  # pylint: disable=unused-argument
+        calls.append(1)
+        return HttpResponse(f'It Works {len(calls)}')
+
+    decorated_view = cache_page(0, stale=60)(view)
+    request = rf.get(fake_url)
+    request.user = User('foo', 'foo@bar.com', 'bar')
+    key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
+
+    assert decorated_view(request).content == b'It Works 1'
+    # Mientras otra petición la genera de nuevo, se sirve la copia vencida
+    cache.set(f'{key}:lock', 'other')
+    assert decorated_view(request).content == b'It Works 1'
+    cache.delete(f'{key}:lock')
+    assert decorated_view(request).content == b'It Works 2'
+    assert not cache.has_key(f'{key}:lock')
+
+    cache.delete(key)
+
+
+def test_cache_page_keeps_lock_of_other_render(rf, fake_url):  # pylint: disable=redefined-outer-name,invalid-name
+    request = rf.get(fake_url)
+    request.user = User('foo', 'foo@bar.com', 'bar')
+    key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
+
+    def view(request):  # pylint: disable=unused-argument
+        # El bloqueo expira mientras se genera la página y otra petición lo toma
+        cache.set(f'{key}:lock', 'other')
+        return HttpResponse('It Works')
+
+    assert cache_page(60)(view)(request).content == b'It Works'
+    assert cache.get(f'{key}:lock') == 'other'
+
+    cache.delete(key)
+    cache.delete(f'{key}:lock')
+
+
+def test_cache_page_waits_for_render(rf, fake_url, monkeypatch):  # pylint: disable=redefined-outer-name,invalid-name
+    calls = []
+
+    def view(request, pk):  # pylint: disable=unused-argument,invalid-name
+        calls.append(pk)
+        return HttpResponse(f'It Works {len(calls)}')
+
+    decorated_view = cache_page(60*60)(view)
+    request = rf.get(fake_url)
+    request.user = User('foo', 'foo@bar.com', 'bar')
+    key = f'cache-page:{request.user}:{request.method}:{slugify(request.get_full_path())}'
+    pk = uuid.uuid4()  # pylint: disable=invalid-name
+    decorated_view(request, pk=pk)
+    bump_generation(pk)
+
+    # Las páginas invalidadas no se sirven: se espera a la que se está generando
+    cache.set(f'{key}:lock', 'other')
+
+    def render_elsewhere(seconds):  # pylint: disable=unused-argument
+        caching.set('cache-page', key, (1, time.time() + 60, b'Rendered elsewhere', {}))
+        cache.delete(f'{key}:lock')
+    monkeypatch.setattr(time, 'sleep', render_elsewhere)
+
+    assert decorated_view(request, pk=pk).content == b'Rendered elsewhere'
+    assert len(calls) == 1
+
+    cache.delete(key)
+    cache.delete(generation_key(pk))
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from django.urls import reverse
+
+from forge.export import export
+from forge.models import Data
+
+
+@pytest.fixture
+def structure_definition():
+    return {'fields': [
+        {'name': 'name', 'type': 'text'},
+        {'name': 'skills', 'type': 'multiselect', 'options': {'choices': [['a', 'A'], ['b', 'B']]}},
+    ]}
+
+
+@pytest.fixture
+def records(structure, admin_user):  # pylint: disable=redefined-outer-name
+    first = Data.objects.create(created_by=admin_user, structure=structure,
+                                data={'name': 'Ana, "la" de Pedro', 'skills': ['a', 'b'], 'removed': 1})
+    amendment = Data.objects.create(created_by=admin_user, structure=structure, parent=first,
+                                    data={'name': 'Ana'})
+    return first, amendment
+
+
+@pytest.mark.django_db
+def test_export_csv(structure, records):  # pylint: disable=redefined-outer-name
+    first, amendment = records
+    assert ''.join(export(structure, 'csv', chunk_size=1, buffer_size=1)) == (
+        '_id,_parent,name,skills\r\n'
+        f'{first.pk},,"Ana, ""la"" de Pedro",a|b\r\n'
+        f'{amendment.pk},{first.pk},Ana,\r\n')
+
+
+@pytest.mark.django_db
+def test_export_jsonl(structure, records):  # pylint: disable=redefined-outer-name
+    first, amendment = records
+    lines = ''.join(export(structure, 'jsonl')).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'_id': str(first.pk), 'name': 'Ana, "la" de Pedro', 'skills': ['a', 'b']},
+        {'_id': str(amendment.pk), '_parent': str(first.pk), 'name': 'Ana'},
+    ]
+
+
+@pytest.mark.django_db
+def test_export_view(structure, records, admin_client):  # pylint: disable=redefined-outer-name
+    url = reverse('forge:export_data', args=[structure.slug, 'jsonl', structure.pk])
+    response = admin_client.get(url)
+    assert response.streaming
+    assert response['Content-Disposition'] == 'attachment; filename="people.jsonl"'
+    assert len(b''.join(response.streaming_content).splitlines()) == len(records)
+
+    url = reverse('forge:export_data', args=[structure.slug, 'xml', structure.pk])
+    assert admin_client.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+def test_export_current(structure, records):  # pylint: disable=redefined-outer-name
+    _, amendment = records
+    assert ''.join(export(structure, 'csv', current=True)) == (
+        '_id,_parent,name,skills\r\n'
+        f'{amendment.pk},,Ana,\r\n')
@@ -5,7 +5,8 @@ import pytest
 from django import forms
 from django.core.cache import cache
 
-from forge.forms import generate_field, DynamicForm
+from forge import caching
+from forge.forms import generate_field, get_form_class, iter_form_html, render_unbound_form, DynamicForm
 
 from .fixtures import FULL_STRUCTURE_VALID, SELECT_CHOICES
 
@@ -17,6 +18,11 @@ def test_generate_field_invalid():
         generate_field(FIELD)
 
 
+def test_generate_field_without_type():
+    with pytest.raises(ValueError):
+        generate_field({'name': 'first_name', 'options': {'required': True}})
+
+
 def test_generate_field_text():
     FIELD = {'name': 'first_name', 'type': 'text', 'options': {  # pylint: disable=invalid-name
         'required': True, 'max_length': 25}}
@@ -145,6 +151,64 @@ def test_dynamic_form():
     for field in structure.structure['fields']:
         assert field['name'] in form.fields
 
-    assert cache.get(f'fields_{structure_id}')
+    # Los campos no se guardan en redis
+    assert not cache.keys(f'fields_{structure_id}*')
+
+
+class VersionedStructure():  # pylint: disable=too-few-public-methods
+    def __init__(self, structure, last_modified):
+        self.id = uuid.uuid4()  # pylint: disable=invalid-name
+        self.structure = structure
+        self.last_modified = last_modified
+
+
+def test_get_form_class():
+    structure = VersionedStructure(FULL_STRUCTURE_VALID, 1)
+
+    form_class = get_form_class(structure)
+
+    assert issubclass(form_class, forms.Form)
+    assert form_class.structure_id == structure.id
+    assert list(form_class.base_fields) == [field['name'] for field in FULL_STRUCTURE_VALID['fields']]
+
+    # Una vez generada, la clase se reutiliza
+    assert get_form_class(structure) is form_class
+
+    # Los formularios no comparten sus campos
+    assert form_class().fields['first_name'] is not form_class().fields['first_name']
+
+    # Una nueva versión de la estructura genera una nueva clase
+    structure.last_modified = 2
+    structure.structure = {'fields': FULL_STRUCTURE_VALID['fields'][:1]}
+    new_form_class = get_form_class(structure)
+    assert new_form_class is not form_class
+    assert list(new_form_class.base_fields) == ['first_name']
+
+
+def test_render_unbound_form():
+    structure = VersionedStructure(FULL_STRUCTURE_VALID, 1)
+    key = f'form-html:{structure.id}:1'
+
+    html = render_unbound_form(structure)
+
+    assert 'name="first_name"' in html
+    assert caching.get('form-html', key) == html
+
+    # Se sirve desde la caché mientras no cambie la versión
+    caching.set('form-html', key, '<p>cached</p>')
+    assert render_unbound_form(structure) == '<p>cached</p>'
+    structure.last_modified = 2
+    assert 'name="first_name"' in render_unbound_form(structure)
+
+    cache.delete_pattern(f'*{structure.id}*')
+
+
+@pytest.mark.parametrize('data', [None, {'first_name': 'x' * 30, 'integer': 'nope'}])
+def test_iter_form_html(data):
+    structure = VersionedStructure(FULL_STRUCTURE_VALID, 1)
+    form = get_form_class(structure)(data=data)
+
+    chunks = list(iter_form_html(form, chunk_size=4))
 
-    cache.delete_pattern(f'fields_{structure_id}')
+    assert len(chunks) > 1
+    assert ''.join(chunks) == form.as_p()
@@ -0,0 +1,73 @@
+import pytest
+
+from django.db import connection
+
+from forge.indexes import existing_indexes, field_value, index_name, sync_indexes
+from forge.jobs import sync_field_indexes
+from forge.models import Data, Structure
+
+FIELDS = [
+    {'name': 'document', 'type': 'integer', 'indexed': True},
+    {'name': 'birth date', 'type': 'date', 'indexed': True},
+    {'name': 'notes', 'type': 'text'},
+]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sync_field_indexes(admin_user):
+    structure = Structure.objects.create(name='indexed', structure={'fields': FIELDS}, created_by=admin_user)
+    for number in range(3):
+        Data.objects.create(created_by=admin_user, structure=structure,
+                            data={'document': number, 'birth date': f'2000-01-0{number + 1}', 'notes': ''})
+
+    sync_field_indexes(str(structure.pk))
+    assert existing_indexes(structure.pk) == {index_name(structure.pk, 'document', 'integer'),
+                                              index_name(structure.pk, 'birth date', 'date')}
+
+    queryset = Data.objects.for_structure(structure).annotate(
+        document=field_value('document', 'integer')).filter(document__gte=1).order_by('-document')
+    assert [data.data['document'] for data in queryset] == [2, 1]
+    with connection.cursor() as cursor:
+        cursor.execute('SET enable_seqscan = off')
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = ' '.join(row[0] for row in cursor.fetchall())
+        cursor.execute('SET enable_seqscan = on')
+    assert index_name(structure.pk, 'document', 'integer') in plan
+
+    structure.structure = {'fields': FIELDS[:1]}
+    structure.save()
+    sync_field_indexes(str(structure.pk))
+    assert existing_indexes(structure.pk) == {index_name(structure.pk, 'document', 'integer')}
+
+    # Al cambiar el tipo del campo cambia la expresión del índice
+    structure.structure = {'fields': [dict(FIELDS[0], type='text')]}
+    structure.save()
+    sync_field_indexes(str(structure.pk))
+    assert existing_indexes(structure.pk) == {index_name(structure.pk, 'document', 'text')}
+
+    # Los índices que quedaron inválidos se crean de nuevo
+    name = index_name(structure.pk, 'document', 'text')
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE pg_index SET indisvalid = false WHERE indexrelid = %s::regclass', [name])
+    assert not existing_indexes(structure.pk)
+    sync_field_indexes(str(structure.pk))
+    assert existing_indexes(structure.pk) == {name}
+
+    sync_indexes(structure.pk)
+    assert not existing_indexes(structure.pk)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sync_field_indexes_with_uncastable_values(admin_user):
+    structure = Structure.objects.create(name='indexed', structure={'fields': FIELDS[:1]}, created_by=admin_user)
+    # Datos de una versión anterior de la estructura en la que el campo era de texto
+    Data.objects.create(created_by=admin_user, structure=structure, data={'document': 'n/a'})
+    sync_field_indexes(str(structure.pk))
+    assert existing_indexes(structure.pk) == {index_name(structure.pk, 'document', 'integer')}
+
+    Data.objects.create(created_by=admin_user, structure=structure, data={'document': 'unknown'})
+    Data.objects.create(created_by=admin_user, structure=structure, data={'document': 7})
+    queryset = Data.objects.for_structure(structure).annotate(
+        document=field_value('document', 'integer')).filter(document__isnull=False)
+    assert [data.data['document'] for data in queryset] == [7]
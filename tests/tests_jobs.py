@@ -1,23 +1,80 @@
 import uuid
+from types import SimpleNamespace
+
+import pytest
 
 from django.core.cache import cache
+from django.db import transaction
 
-from forge.jobs import release_all_locks_of_user, vanish_pattern_from_cache
+from forge import jobs
+from forge.jobs import invalidate_cache, release_all_locks_of_user
+from forge.models import Data, Structure
+from forge.locks import acquire_lock, check_lock, held_locks_key, lock_key, release_lock
+from forge.utils import generation_key, get_generation
 
 
-def test_vanish_pattern_from_cache():
-    pattern = uuid.uuid4()
-    cache.set(pattern, uuid.uuid4())
-    vanish_pattern_from_cache(pattern)
-    assert cache.get(pattern) is None
+def test_release_all_locks_of_user():
+    user, other = SimpleNamespace(pk=str(uuid.uuid4())), SimpleNamespace(pk=str(uuid.uuid4()))
+    resources = [SimpleNamespace(pk=uuid.uuid4()) for _ in range(3)]
+    for resource in resources:
+        acquire_lock(user, resource)
+    # El bloqueo expiró y lo tomó otro usuario
+    cache.delete(lock_key(resources[2]))
+    token = acquire_lock(other, resources[2])
 
+    release_all_locks_of_user(user.pk)
+    assert not cache.has_key(lock_key(resources[0]))
+    assert not cache.has_key(lock_key(resources[1]))
+    assert check_lock(other, resources[2], token)
+    assert not cache.has_key(held_locks_key(user.pk))
 
-def test_release_all_locks_of_user():
-    user_id = uuid.uuid4()
-    lock = uuid.uuid4()
-    lock1 = uuid.uuid4()
-    cache.set(f'lock:{lock}', user_id)
-    cache.set(f'lock:{lock1}', user_id)
-    release_all_locks_of_user(str(user_id))
-    for key in cache.keys('lock:*'):
-        assert cache.get(key) != user_id
+    # Cleanup
+    release_lock(other, resources[2])
+
+
+def test_invalidate_cache():
+    pks = [str(uuid.uuid4()), str(uuid.uuid4())]
+    invalidate_cache(pks)
+    invalidate_cache(pks[:1])
+    assert [get_generation(pk) for pk in pks] == [2, 1]
+    cache.delete_many([generation_key(pk) for pk in pks])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_invalidations_are_batched_per_commit(admin_user, monkeypatch):
+    batches = []
+    monkeypatch.setattr(jobs.invalidate_cache, 'delay', lambda pks, structure_ids: batches.append((pks, structure_ids)))
+    structure = Structure.objects.create(name='batched', created_by=admin_user,
+                                         structure={'fields': [{'name': 'name', 'type': 'text'}]})
+    # Los objetos nuevos no tienen nada en la caché
+    assert not batches
+    records = [Data.objects.create(created_by=admin_user, structure=structure, data={'name': str(number)})
+               for number in range(2)]
+    # Los datos cambian la versión de los de su estructura
+    assert batches == [([], [str(structure.pk)])] * 2
+
+    other = Structure.objects.create(name='other', created_by=admin_user, structure=structure.structure)
+    with transaction.atomic():
+        structure.save()
+        structure.save()
+        other.save()
+        Data.objects.filter(pk__in=[data.pk for data in records]).delete()
+    assert batches[2:] == [(sorted(str(obj.pk) for obj in [structure, other]), [str(structure.pk)])]
+
+    # Revertir un savepoint no descarta lo que se invalidó fuera de él
+    with transaction.atomic():
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                other.save()
+                raise ValueError
+        structure.save()
+    assert str(structure.pk) in batches[3][0]
+
+    # Lo que se invalidó en una transacción revertida no impide enviar lo siguiente
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            other.save()
+            raise ValueError
+    structure_id = str(structure.pk)
+    structure.delete()
+    assert len(batches) == 5 and structure_id in batches[4][0]
\ No newline at end of file
@@ -0,0 +1,98 @@
+import pytest
+
+from django.core.cache import cache
+
+from forge.locks import (LEASE, UNRENEWED_LEASE, acquire_lock, check_lock, held_locks_key, lock_key,
+                         release_all_locks, release_lock, renew_lock, ResourceAlreadyBlocked,
+                         UserDoesNotOwnTheLock)
+
+
+class ThingWithPk:  # pylint: disable=too-few-public-methods
+    def __init__(self, pk):
+        self.pk = pk  # pylint: disable=invalid-name
+
+
+@pytest.fixture
+def fake_user():
+    return ThingWithPk('123')
+
+
+@pytest.fixture
+def other_user():
+    return ThingWithPk('789')
+
+
+@pytest.fixture
+def fake_resource():
+    resource = ThingWithPk('456')
+    yield resource
+    # Cleanup
+    cache.delete(lock_key(resource))
+
+
+def test_acquire_lock_success(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
+    token = acquire_lock(fake_user, fake_resource)
+
+    assert check_lock(fake_user, fake_resource, token)
+    assert 0 < cache.ttl(lock_key(fake_resource)) <= 2 * 60
+
+
+def test_acquire_lock_raises(fake_user, other_user, fake_resource):  # pylint: disable=redefined-outer-name
+    acquire_lock(other_user, fake_resource)
+
+    # Verifica que no se pueda obtener si ya está bloqueado
+    with pytest.raises(ResourceAlreadyBlocked):
+        acquire_lock(fake_user, fake_resource)
+
+
+def test_acquire_lock_again_fences_previous_token(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
+    token = acquire_lock(fake_user, fake_resource)
+    new_token = acquire_lock(fake_user, fake_resource)
+
+    assert new_token > token
+    assert not check_lock(fake_user, fake_resource, token)
+    assert check_lock(fake_user, fake_resource, new_token)
+
+
+def test_held_locks_outlive_longest_lease(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
+    other = ThingWithPk('654')
+    token = acquire_lock(fake_user, other, UNRENEWED_LEASE)
+    # Un bloqueo más corto no acorta el conjunto de bloqueos del usuario
+    renew_lock(fake_user, fake_resource, acquire_lock(fake_user, fake_resource))
+    assert cache.ttl(held_locks_key(fake_user.pk)) > LEASE
+
+    release_all_locks(fake_user.pk)
+    assert not check_lock(fake_user, other, token)
+
+
+def test_renew_lock(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
+    token = acquire_lock(fake_user, fake_resource)
+    cache.expire(lock_key(fake_resource), 5)
+
+    assert renew_lock(fake_user, fake_resource, token)
+    assert cache.ttl(lock_key(fake_resource)) > 5
+    assert not renew_lock(fake_user, fake_resource, token + 1)
+
+    # Un bloqueo que expiró no se renueva
+    cache.delete(lock_key(fake_resource))
+    assert not renew_lock(fake_user, fake_resource, token)
+
+
+def test_release_lock_success(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
+    token = acquire_lock(fake_user, fake_resource)
+
+    release_lock(fake_user, fake_resource)
+
+    assert not check_lock(fake_user, fake_resource, token)
+    assert cache.get(lock_key(fake_resource)) is None
+    # Liberar un bloqueo que ya no existe no falla
+    release_lock(fake_user, fake_resource)
+
+
+def test_release_lock_raises(fake_user, other_user, fake_resource):  # pylint: disable=redefined-outer-name
+    token = acquire_lock(fake_user, fake_resource)
+
+    # Verifica que no se pueda liberar si el usuario es diferente
+    with pytest.raises(UserDoesNotOwnTheLock):
+        release_lock(other_user, fake_resource)
+    assert check_lock(fake_user, fake_resource, token)
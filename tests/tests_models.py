@@ -1,16 +1,14 @@
 import pytest
 
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
 # Not using relative imports bc some stupid pytest conflict
-from forge.models import Data, Structure
+from forge.models import Data, Structure, StructureVersion, structure_hash
 
 from .fixtures import FULL_STRUCTURE_VALID
 
 
-@pytest.fixture
-def structure(admin_user):
-    return Structure.objects.create(name='test structure', structure=FULL_STRUCTURE_VALID, created_by=admin_user)
-
-
 @pytest.fixture(scope='module')
 def data():
     return {"first_name": "asdads"}
@@ -30,3 +28,172 @@ def test_data_manager_orphans(data, admin_user): # pylint: disable=redefined-out
     assert len(Data.objects.orphans()) == 2
     assert data_child1 in Data.objects.orphans()
     assert data_child2 in Data.objects.orphans()
+
+
+def test_structure_versions(structure, admin_user):  # pylint: disable=redefined-outer-name
+    first_version = structure.version
+    assert first_version.id == structure_hash(FULL_STRUCTURE_VALID)
+    assert first_version.structure == FULL_STRUCTURE_VALID
+
+    data_object = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'x'})
+    assert data_object.structure_version == first_version
+
+    # El mismo contenido reutiliza la versión
+    other = Structure.objects.create(name='other', structure=FULL_STRUCTURE_VALID, created_by=admin_user)
+    assert other.version == first_version
+
+    structure.structure = {'fields': FULL_STRUCTURE_VALID['fields'][:1]}
+    structure.save()
+    assert structure.version != first_version
+    assert StructureVersion.objects.count() == 2
+
+    # Los datos ya capturados conservan su versión
+    data_object.refresh_from_db()
+    assert data_object.definition == first_version
+
+
+def test_structure_invalid_does_not_create_version(admin_user):
+    with pytest.raises(ValidationError):
+        Structure.objects.create(name='invalid', structure={'fields': []}, created_by=admin_user)
+    assert not StructureVersion.objects.exists()
+
+
+def test_data_where(structure, admin_user):  # pylint: disable=redefined-outer-name
+    engineer = Data.objects.create(created_by=admin_user, structure=structure, data={
+        'first_name': 'Ana', 'e-mail': 'ana@example.com', 'integer': 7,
+        'occupation_multiselect': ['engineer', 'farmer']})
+    Data.objects.create(created_by=admin_user, structure=structure, data={
+        'first_name': 'Bea', 'integer': 8, 'occupation_multiselect': ['farmer']})
+    Data.objects.create(created_by=admin_user, data={'first_name': 'Ana'})
+
+    in_structure = Data.objects.for_structure(structure)
+    assert list(in_structure.where(first_name='Ana')) == [engineer]
+    assert list(in_structure.where({'e-mail': 'ana@example.com'}, integer=7)) == [engineer]
+    assert list(in_structure.where(occupation_multiselect=['engineer'])) == [engineer]
+    assert in_structure.where(occupation_multiselect=['farmer']).count() == 2
+    assert not in_structure.where(first_name='Ana', integer=8).exists()
+    assert Data.objects.where(first_name='Ana').count() == 2
+
+
+def test_data_search(structure, admin_user):  # pylint: disable=redefined-outer-name
+    ana = Data.objects.create(created_by=admin_user, structure=structure, data={
+        'first_name': 'Ana Perez', 'smallcv': 'Ingeniera', 'occupation': 'office_clerk'})
+    bea = Data.objects.create(created_by=admin_user, structure=structure, data={
+        'first_name': 'Bea Perez', 'smallcv': 'Perez Perez'})
+    Data.objects.create(created_by=admin_user, data={'first_name': 'Ana Perez'})
+
+    in_structure = Data.objects.for_structure(structure)
+    assert list(in_structure.search('ana')) == [ana]
+    assert list(in_structure.search('clerk')) == [ana]
+    # Los resultados se ordenan por relevancia
+    assert list(in_structure.search('perez')) == [bea, ana]
+
+    # El vector se actualiza al salvar y al enmendar
+    ana.data['first_name'] = 'Ana Gomez'
+    ana.save()
+    assert list(in_structure.search('perez')) == [bea]
+    amended = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'Carla'},
+                                  parent=ana)
+    assert list(in_structure.search('carla')) == [amended]
+
+
+def test_data_heads(structure, admin_user):  # pylint: disable=redefined-outer-name
+    original = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'a'})
+    other = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'x'})
+    first = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'b'},
+                                parent=original)
+    second = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'c'},
+                                 parent=first)
+    assert set(Data.objects.current()) == {second, other}
+    original.refresh_from_db()
+    assert original.current_version() == second
+
+    # Si se elimina la versión actual pasa a serlo la anterior
+    second.delete()
+    assert set(Data.objects.current()) == {first, other}
+
+    Data.objects.update(is_head=True)
+    assert Data.objects.rebuild_heads() == 1
+    assert set(Data.objects.current()) == {first, other}
+
+
+def test_data_next_tree_id(structure, admin_user, django_assert_num_queries):  # pylint: disable=redefined-outer-name
+    data = Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'a'})
+    # Bloqueo consultivo y máximo de los árboles
+    with django_assert_num_queries(2):
+        assert Data.objects.next_tree_id() == data.tree_id + 1
+
+
+def test_data_delta_storage(admin_user):
+    structure = Structure.objects.create(name='delta', created_by=admin_user, structure={
+        'delta': True, 'fields': [{'name': 'name', 'type': 'text'}, {'name': 'age', 'type': 'integer'}]})
+    versions = [Data.objects.create(created_by=admin_user, structure=structure, data={'name': 'Ana', 'age': 1})]
+    for age in range(2, 5):
+        versions.append(Data.objects.create(created_by=admin_user, structure=structure, parent=versions[-1],
+                                            data={'name': 'Ana', 'age': age}))
+
+    stored = {data.pk: data for data in Data.objects.all()}
+    # La raíz y la versión actual se guardan completas
+    assert stored[versions[0].pk].patch is None
+    assert stored[versions[-1].pk].data == {'name': 'Ana', 'age': 4}
+    assert stored[versions[1].pk].data == {}
+    assert stored[versions[1].pk].patch == [{'op': 'replace', 'path': '/age', 'value': 2}]
+    cache.clear()
+    assert [stored[data.pk].full_data()['age'] for data in versions] == [1, 2, 3, 4]
+
+    # Al editar o eliminar una versión sus hijos se guardan completos
+    middle = stored[versions[2].pk]
+    middle.data = {'name': 'Bea', 'age': 3}
+    middle.save()
+    assert Data.objects.get(pk=versions[3].pk).patch is None
+    stored[versions[1].pk].delete()
+    assert Data.objects.get(pk=versions[2].pk).full_data() == {'name': 'Bea', 'age': 3}
+
+    structure.structure = {'fields': structure.structure['fields']}
+    structure.save()
+    Data.objects.update(patch=None)
+    assert Data.objects.compact(structure) == 0
+
+
+def test_data_delta_save_and_cache(admin_user):
+    structure = Structure.objects.create(name='delta', created_by=admin_user, structure={
+        'delta': True, 'fields': [{'name': 'name', 'type': 'text'}, {'name': 'age', 'type': 'integer'}]})
+    root = Data.objects.create(created_by=admin_user, structure=structure, data={'name': 'Ana', 'age': 1})
+    middle = Data.objects.create(created_by=admin_user, structure=structure, parent=root,
+                                 data={'name': 'Ana', 'age': 2})
+    Data.objects.create(created_by=admin_user, structure=structure, parent=middle, data={'name': 'Ana', 'age': 3})
+
+    # Salvar una versión almacenada como diferencia no pierde sus datos
+    loaded = Data.objects.get(pk=middle.pk)
+    assert loaded.patch is not None and loaded.data == {}
+    loaded.save()
+    assert Data.objects.get(pk=middle.pk).data == {'name': 'Ana', 'age': 2}
+
+    # Al editarla y volver a guardarla como diferencia no se lee la caché anterior
+    loaded.data = {'name': 'Bea', 'age': 2}
+    loaded.save()
+    assert Data.objects.compact(structure) == 1
+    assert Data.objects.get(pk=middle.pk).full_data() == {'name': 'Bea', 'age': 2}
+
+
+def test_data_compact(admin_user):
+    structure = Structure.objects.create(name='compact', created_by=admin_user,
+                                         structure={'fields': [{'name': 'age', 'type': 'integer'}]})
+    versions = [Data.objects.create(created_by=admin_user, structure=structure, data={'age': 0})]
+    for age in range(1, 14):
+        versions.append(Data.objects.create(created_by=admin_user, structure=structure, parent=versions[-1],
+                                            data={'age': age}))
+    assert not Data.objects.filter(patch__isnull=False).exists()
+
+    structure.structure = dict(structure.structure, delta=True)
+    structure.save()
+    # Raíz, versión actual y una de cada MAX_CHAIN quedan completas
+    assert Data.objects.compact(structure) == 11
+    assert Data.objects.filter(patch__isnull=True).count() == 3
+    cache.clear()
+    assert [data.full_data()['age'] for data in Data.objects.order_by('lft')] == list(range(14))
+
+    structure.structure = {'fields': structure.structure['fields']}
+    structure.save()
+    assert Data.objects.compact(structure) == 11
+    assert [data.data['age'] for data in Data.objects.order_by('lft')] == list(range(14))
@@ -0,0 +1,66 @@
+import pytest
+
+from django.core.management import call_command
+from django.db import connection
+
+from forge import partitions
+from forge.models import Data, Structure
+
+
+def partition_rows(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT id FROM {connection.ops.quote_name(name)}')
+        return {row[0] for row in cursor.fetchall()}
+
+
+@pytest.mark.django_db
+def test_table_is_partitioned():
+    assert partitions.is_partitioned()
+
+
+@pytest.mark.django_db
+def test_structure_partition(structure, admin_user):  # pylint: disable=redefined-outer-name
+    name = partitions.get_partition(structure.pk)
+    assert name == partitions.partition_name(structure.pk)
+
+    data = Data.objects.create(created_by=admin_user, structure=structure, data={'x': 1})
+    orphan = Data.objects.create(created_by=admin_user, data={'x': 1})
+    assert partition_rows(name) == {data.pk}
+    assert orphan.pk in partition_rows(partitions.DEFAULT_PARTITION)
+
+    sql, params = Data.objects.for_structure(structure).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = ' '.join(row[0] for row in cursor.fetchall())
+    assert name in plan
+    assert partitions.DEFAULT_PARTITION not in plan
+
+
+@pytest.mark.django_db
+def test_structure_delete_detaches_data(structure, admin_user):  # pylint: disable=redefined-outer-name
+    data = Data.objects.create(created_by=admin_user, structure=structure, data={'x': 1})
+    structure_id = structure.pk
+    structure.delete()
+    assert partitions.get_partition(structure_id) is None
+    # Los datos quedan sin estructura en la partición por defecto
+    assert list(Data.objects.structureless()) == [data]
+    assert data.pk in partition_rows(partitions.DEFAULT_PARTITION)
+
+
+@pytest.mark.django_db
+def test_forge_drop_data(structure, admin_user):  # pylint: disable=redefined-outer-name
+    parent = Data.objects.create(created_by=admin_user, structure=structure, data={'x': 1})
+    Data.objects.create(created_by=admin_user, structure=structure, parent=parent, data={'x': 1})
+    orphan = Data.objects.create(created_by=admin_user, data={'x': 1})
+    call_command('forge_drop_data', structure.slug)
+    assert not Data.objects.for_structure(structure).exists()
+    assert Data.objects.filter(pk=orphan.pk).exists()
+    assert partitions.get_partition(structure.pk)
+
+
+@pytest.mark.django_db
+def test_structure_queryset_delete_detaches_data(structure, admin_user):  # pylint: disable=redefined-outer-name
+    data = Data.objects.create(created_by=admin_user, structure=structure, data={'x': 1})
+    Structure.objects.filter(pk=structure.pk).delete()
+    assert partitions.get_partition(structure.pk) is None
+    assert list(Data.objects.structureless()) == [data]
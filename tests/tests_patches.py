@@ -0,0 +1,36 @@
+import pytest
+
+from forge.patches import apply_patch, iter_documents, make_patch, resolve_chain
+
+
+def test_patch_roundtrip():
+    source = {'name': 'Ana', 'a/b': 1, 'til~de': [1], 'gone': True}
+    target = {'name': 'Ana María', 'a/b': 1, 'til~de': [1, 2], 'new': None}
+    patch = make_patch(source, target)
+    assert sorted(operation['path'] for operation in patch) == ['/gone', '/name', '/new', '/til~0de']
+    assert apply_patch(source, patch) == target
+    assert make_patch(target, target) == []
+
+    with pytest.raises(ValueError):
+        apply_patch(source, [{'op': 'move', 'path': '/name', 'from': '/x'}])
+    with pytest.raises(ValueError):
+        apply_patch(source, [{'op': 'add', 'path': '/name/first', 'value': 1}])
+
+
+def test_resolve_chain():
+    first, second, third = {'a': 1}, {'a': 2}, {'a': 2, 'b': 3}
+    chain = [(first, None), ({}, make_patch(first, second)), ({}, make_patch(second, third))]
+    assert resolve_chain(chain) == (third, 2)
+    # Un documento completo en medio corta la cadena
+    chain[1] = (second, None)
+    assert resolve_chain(chain) == (third, 1)
+
+
+def test_iter_documents():
+    first, second = {'a': 1}, {'a': 2}
+    rows = [
+        (1, None, 1, first, None),
+        (2, 1, 1, {}, make_patch(first, second)),
+        (3, None, 2, {'b': 1}, None),
+    ]
+    assert [(row[0], data) for row, data in iter_documents(rows)] == [(1, first), (2, second), (3, {'b': 1})]
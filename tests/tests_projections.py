@@ -0,0 +1,99 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from django.db import connection
+
+from forge import projections
+from forge.models import Data, Projection, Structure
+
+FIELDS = [
+    {'name': 'name', 'type': 'text'},
+    {'name': 'age', 'type': 'integer'},
+    {'name': 'salary', 'type': 'decimal'},
+    {'name': 'birth date', 'type': 'date'},
+    {'name': 'skills', 'type': 'multiselect', 'options': {'choices': [['a', 'A'], ['b', 'B']]}},
+    {'name': 'active', 'type': 'checkbox'},
+]
+
+
+@pytest.fixture
+def structure_definition():
+    return {'projection': True, 'fields': FIELDS}
+
+
+def table_exists(structure):  # pylint: disable=redefined-outer-name
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [projections.projection_table(structure.pk)])
+        return cursor.fetchone()[0] is not None
+
+
+@pytest.mark.django_db
+def test_projection(structure, admin_user):  # pylint: disable=redefined-outer-name
+    first = Data.objects.create(created_by=admin_user, structure=structure, data={
+        'name': 'Ana', 'age': 30, 'salary': '100.50', 'birth date': '1990-01-02', 'skills': ['a'], 'active': True})
+
+    projections.sync(structure.pk)
+    assert Projection.objects.get(structure=structure).version == structure.version
+    assert list(projections.rows(structure)) == [{
+        'forge_data_id': first.pk, 'name': 'Ana', 'age': 30, 'salary': Decimal('100.50'),
+        'birth date': datetime.date(1990, 1, 2), 'skills': ['a'], 'active': True}]
+
+    # Los datos se mantienen fila a fila
+    second = Data.objects.create(created_by=admin_user, structure=structure, data={'name': 'Bea', 'age': 'x'})
+    first.data['age'] = 31
+    first.save()
+    assert {row['forge_data_id']: row['age'] for row in projections.rows(structure, ['age'])} == {
+        first.pk: 31, second.pk: None}
+    second.delete()
+    assert [row['name'] for row in projections.rows(structure, ['name'])] == ['Ana']
+
+    # Al cambiar la estructura se reconstruye la tabla
+    structure.structure = {'projection': True, 'fields': FIELDS[:2]}
+    structure.save()
+    projections.sync(structure.pk)
+    assert list(projections.rows(structure)) == [{'forge_data_id': first.pk, 'name': 'Ana', 'age': 31}]
+
+    structure.structure = {'fields': FIELDS}
+    structure.save()
+    projections.sync(structure.pk)
+    assert not Projection.objects.filter(structure=structure).exists()
+    assert not table_exists(structure)
+
+
+@pytest.mark.django_db
+def test_projection_dropped_with_structure(structure):  # pylint: disable=redefined-outer-name
+    projections.sync(structure.pk)
+    assert table_exists(structure)
+    structure_id = structure.pk
+    structure.delete()
+    projections.sync(structure_id)
+    structure.pk = structure_id
+    assert not table_exists(structure)
+
+
+@pytest.mark.django_db
+def test_projection_current_versions(structure, admin_user):  # pylint: disable=redefined-outer-name
+    first = Data.objects.create(created_by=admin_user, structure=structure, data={'name': 'Ana'})
+    projections.sync(structure.pk)
+
+    # Las enmiendas reemplazan la fila de la versión anterior
+    amendment = Data.objects.create(created_by=admin_user, structure=structure, parent=first, data={'name': 'Bea'})
+    assert list(projections.rows(structure, ['name'])) == [{'forge_data_id': amendment.pk, 'name': 'Bea'}]
+    projections.rebuild(structure)
+    assert list(projections.rows(structure, ['name'])) == [{'forge_data_id': amendment.pk, 'name': 'Bea'}]
+
+    # Al eliminar la versión actual se proyecta la que pasa a serlo
+    amendment.delete()
+    assert list(projections.rows(structure, ['name'])) == [{'forge_data_id': first.pk, 'name': 'Ana'}]
+
+
+@pytest.mark.django_db
+def test_unprojected_structures_skip_projection(admin_user, django_assert_num_queries):
+    structure = Structure.objects.create(name='plain', created_by=admin_user, structure={'fields': FIELDS})
+    data = Data.objects.create(created_by=admin_user, structure=structure, data={'name': 'Ana'})
+    data.data['name'] = 'Bea'
+    # Savepoint, actualización y liberación del savepoint, sin consultar ``Projection``
+    with django_assert_num_queries(3):
+        data.save(clean=False)
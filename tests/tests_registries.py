@@ -0,0 +1,55 @@
+import pytest
+
+from django import forms
+
+from forge.registries import Module, Registry
+
+
+class CustomField(forms.CharField):
+    pass
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_registry_resolves_builtin_fields(registry):  # pylint: disable=redefined-outer-name
+    field_class, widget = registry.resolve('textarea')
+    assert field_class is forms.CharField
+    assert isinstance(widget, forms.Textarea)
+    with pytest.raises(ValueError):
+        registry.resolve('nonexistent')
+
+
+def test_registry_indexes_module_fields(registry):  # pylint: disable=redefined-outer-name
+    module = Module('test')
+    module.register_field('before', CustomField, forms.Textarea)
+    registry.register(module)
+    module.register_field('after', CustomField)
+
+    assert registry.resolve('before') == (CustomField, forms.Textarea)
+    assert registry.resolve('after') == (CustomField, None)
+
+    registry.unregister('test')
+    with pytest.raises(ValueError):
+        registry.resolve('before')
+
+
+@pytest.mark.parametrize('field_name', ['text', 'custom'])
+def test_registry_conflicting_field_names(registry, field_name):  # pylint: disable=redefined-outer-name
+    module = Module('first')
+    module.register_field('custom', CustomField)
+    registry.register(module)
+
+    other = Module('second')
+    other.register_field(field_name, CustomField)
+    with pytest.raises(ValueError):
+        registry.register(other)
+    assert 'second' not in registry
+
+    with pytest.raises(ValueError):
+        module.register_field('text', CustomField)
+    # Un módulo puede volver a registrar sus propios campos
+    module.register_field('custom', CustomField, forms.Textarea)
+    assert registry.resolve('custom') == (CustomField, forms.Textarea)
@@ -0,0 +1,19 @@
+from forge.search import SearchDocument
+
+from .fixtures import FULL_STRUCTURE_VALID
+
+
+def test_search_document():
+    document = SearchDocument(FULL_STRUCTURE_VALID['fields'])
+    assert document.text({
+        'first_name': 'Ana', 'smallcv': '', 'e-mail': 'ana@example.com', 'marital_status': 'single',
+        'occupation_multiselect': ['engineer', 'unknown'], 'integer': 7, 'internet': True,
+    }) == 'Ana ana@example.com Single Engineer unknown'
+    assert document.text({}) == ''
+
+
+def test_search_document_option_groups():
+    document = SearchDocument([{'name': 'city', 'type': 'select', 'options': {'choices': [
+        ['Cuba', [['hav', 'La Habana'], ['stg', 'Santiago']]], ['other', 'Otra']]}}])
+    assert document.text({'city': 'stg'}) == 'Santiago'
+    assert document.text({'city': 'other'}) == 'Otra'
@@ -1,79 +1,44 @@
-import pytest
+import uuid
 
 from django.core.cache import cache
 
-from forge.utils import (acquire_lock, release_lock,
-                      ResourceAlreadyBlocked, UserDoesNotOwnTheLock)
+from forge.utils import (GENERATION_TIMEOUT, bump_data_versions, bump_generation, data_version_key, generation_key,
+                         get_data_version, get_generation, LRUCache)
 
 
-class ThingWithPk:  # pylint: disable=too-few-public-methods
-    def __init__(self, pk):
-        self.pk = pk  # pylint: disable=invalid-name
+def test_lru_cache_is_bounded():
+    lru = LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1 and lru.get('c') == 3
 
 
-@pytest.fixture
-def fake_user():
-    return ThingWithPk('123')
-
-
-@pytest.fixture
-def fake_resource():
-    return ThingWithPk('456')
-
-
-def test_acquire_lock_success(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
-    key = f'lock:{fake_resource.pk}'
-
-    # Intenta adquirir el lock
-    acquire_lock(fake_user, fake_resource)
-
-    # Verifica que se obtuvo con éxito
-    assert cache.get(key) == fake_user.pk
-
-    # Cleanup
-    cache.delete_pattern(key)
-
-
-def test_acquire_lock_raises(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
-    key = f'lock:{fake_resource.pk}'
-
-    # Crea un lock a mano
-    cache.set(key, fake_user.pk)
-
-    # Verifica que no se pueda obtener si ya está bloqueado
-    with pytest.raises(ResourceAlreadyBlocked):
-        acquire_lock(fake_user, fake_resource)
-
-    # Cleanup
-    cache.delete_pattern(key)
-
-
-def test_release_lock_success(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
-    key = f'lock:{fake_resource.pk}'
-
-    # Crea un lock a mano
-    cache.set(key, fake_user.pk)
-
-    # Intenta liberar el lock
-    release_lock(fake_user, fake_resource)
-
-    # Verifica que se liberó con éxito
-    assert cache.get(key) is None
+def test_generation():
+    pk = uuid.uuid4()  # pylint: disable=invalid-name
+    assert get_generation(pk) == 0
+    assert bump_generation(pk) == 1
+    assert bump_generation(pk) == 2
+    assert get_generation(pk) == 2
+    # Las generaciones expiran si el objeto deja de cambiar
+    assert 0 < cache.ttl(generation_key(pk)) <= GENERATION_TIMEOUT
 
     # Cleanup
-    cache.delete_pattern(key)
-
+    cache.delete(generation_key(pk))
 
-def test_release_lock_raises(fake_user, fake_resource):  # pylint: disable=redefined-outer-name
-    key = f'lock:{fake_resource.pk}'
 
-    # Crea un lock a mano
-    cache.set(key, fake_user.pk)
+def test_data_version():
+    pk = uuid.uuid4()  # pylint: disable=invalid-name
+    version = get_data_version(pk)
+    assert get_data_version(pk) == version
+    bump_data_versions([pk])
+    assert get_data_version(pk) != version
 
-    # Verifica que no se pueda liberar si el usuario es diferente
-    fake_user.pk = '789'
-    with pytest.raises(UserDoesNotOwnTheLock):
-        release_lock(fake_user, fake_resource)
+    # Si expira, la nueva versión no coincide con ninguna anterior
+    cache.delete(data_version_key(pk))
+    assert get_data_version(pk) != version
 
     # Cleanup
-    cache.delete_pattern(key)
+    cache.delete(data_version_key(pk))
@@ -1,8 +1,10 @@
 import pytest
 
+from django import forms
 from django.core.exceptions import ValidationError
 
-from forge.validation import validate_structure
+from forge.registries import Module, modules
+from forge.validation import get_validator, validate_structure, validate_structures
 from .fixtures import FULL_STRUCTURE_VALID, SELECT_CHOICES
 
 
@@ -51,3 +53,44 @@ INVALID_STRUCTURES.extend([FULL_STRUCTURE_INVALID, EMPTY_STRUCTURE, EMPTY_FIELDS
 def test_validate_structure_invalid(structure):
     with pytest.raises(ValidationError):
         validate_structure(structure)
+
+
+def test_validate_structure_incorrect_type_message():
+    with pytest.raises(ValidationError) as error:
+        validate_structure({'fields': [{'name': 'internet', 'type': 'checkboxx'}]})
+    assert error.value.messages == ['Incorrect type of field']
+
+
+def test_validate_structure_custom_field():
+    # Registrado por el módulo de demostración
+    validate_structure({'fields': [{'name': 'custom', 'type': 'first_custom_field'}]})
+
+
+def test_validate_structure_recompiles_on_new_module():
+    validator = get_validator()
+    module = Module('test validation module')
+    module.register_field('test_validation_field', forms.CharField)
+    modules.register(module)
+    try:
+        assert get_validator() is not validator
+        validate_structure({'fields': [{'name': 'custom', 'type': 'test_validation_field'}]})
+    finally:
+        modules.unregister(module.name)
+
+
+def test_structure_validator_error_paths():
+    structure = {'fields': [
+        {'name': 'first_name', 'type': 'text'},
+        {'name': 'integer', 'type': 'integer', 'options': {'max_value': 'asdasd'}},
+    ]}
+    errors = list(get_validator().iter_errors(structure))
+    assert [path for path, _ in errors] == [('fields', 1, 'options', 'max_value')]
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_validate_structures(processes):
+    structures = [FULL_STRUCTURE_VALID, EMPTY_FIELDS, FULL_STRUCTURE_VALID]
+    results = list(validate_structures(structures, processes=processes, batch_size=2))
+    assert [index for index, _ in results] == [0, 1, 2]
+    assert not results[0][1] and not results[2][1]
+    assert results[1][1] == [(('fields',), '[] is too short')]
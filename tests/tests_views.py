@@ -0,0 +1,125 @@
+import pytest
+
+from django.db import transaction
+from django.urls import reverse
+
+from forge import jobs, views
+from forge.models import Data
+
+
+@pytest.fixture
+def structure_definition():
+    return {'fields': [{'name': 'first_name', 'type': 'text'}]}
+
+
+@pytest.fixture
+def data(structure, admin_user):  # pylint: disable=redefined-outer-name
+    return Data.objects.create(created_by=admin_user, structure=structure, data={'first_name': 'Ana'})
+
+
+# Las cantidades incluyen la consulta del usuario de la sesión y los
+# savepoints de ``ATOMIC_REQUESTS`` y de ``Data.save``
+
+
+@pytest.mark.django_db
+def test_data_create_queries(admin_client, structure, django_assert_num_queries):  # pylint: disable=redefined-outer-name
+    url = reverse('forge:create_data', kwargs={'slug': structure.slug, 'pk': structure.pk})
+    # Estructura con su versión, usuario, reserva del árbol nuevo e inserción
+    with django_assert_num_queries(9):
+        response = admin_client.post(url, {'first_name': 'Ana'})
+    data = Data.objects.get()
+    assert response.url == data.get_absolute_url()
+    assert data.data == {'first_name': 'Ana'}
+    assert data.structure_version_id == structure.version_id
+
+
+@pytest.mark.django_db
+def test_data_update_queries(admin_client, data, django_assert_num_queries):  # pylint: disable=redefined-outer-name
+    url = reverse('forge:update_data', kwargs={'slug': data.structure.slug, 'pk': data.pk})
+    token = admin_client.get(url).context['lock_token']
+    # Datos con su estructura, usuario, token del bloqueo y actualización
+    with django_assert_num_queries(10):
+        admin_client.post(url, {'first_name': 'Bea', '_lock': token})
+    data.refresh_from_db()
+    assert data.data == {'first_name': 'Bea'}
+
+
+@pytest.mark.django_db
+def test_data_amend_queries(admin_client, data, django_assert_num_queries):  # pylint: disable=redefined-outer-name
+    url = reverse('forge:update_data', kwargs={'slug': data.structure.slug, 'pk': data.pk}) + '?amend=1'
+    token = admin_client.get(url).context['lock_token']
+    # Además, el espacio en el árbol y la versión actual anterior
+    with django_assert_num_queries(13):
+        admin_client.post(url, {'first_name': 'Bea', '_lock': token})
+    amendment = Data.objects.current().get(tree_id=data.tree_id)
+    assert amendment.parent_id == data.pk
+    assert amendment.data == {'first_name': 'Bea'}
+
+
+@pytest.mark.django_db
+def test_data_update_requires_current_lock(admin_client, data):  # pylint: disable=redefined-outer-name
+    url = reverse('forge:update_data', kwargs={'slug': data.structure.slug, 'pk': data.pk})
+    lock_url = reverse('forge:renew_data_lock', kwargs={'slug': data.structure.slug, 'pk': data.pk})
+    token = admin_client.get(url).context['lock_token']
+    assert admin_client.post(lock_url, {'_lock': token}).status_code == 204
+
+    # Al editarlos de nuevo, por ejemplo en otra pestaña, el token anterior deja de valer
+    new_token = admin_client.get(url).context['lock_token']
+    assert admin_client.post(lock_url, {'_lock': token}).status_code == 409
+    response = admin_client.post(url, {'first_name': 'Bea', '_lock': token})
+    assert response.url == data.get_absolute_url()
+    data.refresh_from_db()
+    assert data.data == {'first_name': 'Ana'}
+
+    admin_client.post(url, {'first_name': 'Bea', '_lock': new_token})
+    data.refresh_from_db()
+    assert data.data == {'first_name': 'Bea'}
+    assert data.lock_token == new_token
+
+
+@pytest.mark.django_db
+def test_data_update_fenced_in_database(admin_client, data, monkeypatch):  # pylint: disable=redefined-outer-name
+    url = reverse('forge:update_data', kwargs={'slug': data.structure.slug, 'pk': data.pk})
+    token = admin_client.get(url).context['lock_token']
+    # El bloqueo expira después de comprobarlo y otra persona escribe con uno posterior
+    monkeypatch.setattr(views, 'check_lock', lambda *args: True)
+    assert Data.objects.fence(data.pk, token + 1)
+
+    admin_client.post(url, {'first_name': 'Bea', '_lock': token})
+    data.refresh_from_db()
+    assert data.data == {'first_name': 'Ana'}
+    assert data.lock_token == token + 1
+
+
+@pytest.mark.django_db
+def test_data_details_not_modified(admin_client, data, django_assert_num_queries):  # pylint: disable=redefined-outer-name
+    url = data.get_absolute_url()
+    etag = admin_client.get(url)['ETag']
+    # Solo el usuario y el estado de los datos, sin renderizar la página
+    with django_assert_num_queries(4):
+        response = admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+
+    # Al enmendarlos, la página enlaza a la versión actual
+    Data.objects.create(created_by=data.created_by, structure=data.structure, parent=data, data={'first_name': 'Bea'})
+    assert admin_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_structure_details_not_modified(admin_client, data, django_assert_num_queries, monkeypatch):  # pylint: disable=redefined-outer-name
+    # Cada escritura se confirma y sus trabajos se ejecutan en el acto
+    monkeypatch.setattr(transaction, 'on_commit', lambda func: func())
+    monkeypatch.setattr(jobs.invalidate_cache, 'delay', jobs.invalidate_cache)
+    url = reverse('forge:structure_details', kwargs={'slug': data.structure.slug, 'pk': data.structure.pk})
+    etag = admin_client.get(url)['ETag']
+    assert admin_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    data.delete()
+    etag = admin_client.get(url, HTTP_IF_NONE_MATCH=etag)['ETag']
+
+    # Solo el usuario y la estructura, sin recorrer sus datos
+    with django_assert_num_queries(4):
+        assert admin_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    Data.objects.create(created_by=data.created_by, structure=data.structure, data={'first_name': 'Bea'})
+    assert admin_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200